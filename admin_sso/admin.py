@@ -18,7 +18,10 @@ class ProfileAdmin(admin.ModelAdmin):
             'fields': ('user', ),
             }],
         ['Google Auth', {
-            'fields': ('google_auth_token', 'google_auth_refresh_token', ),
+            'fields': (
+                'google_auth_token', 'google_auth_refresh_token',
+                'google_auth_expiry', 'google_calendars_synced_at',
+                ),
             'classes': ('collapse', )
             }]
         ]
@@ -26,6 +29,8 @@ class ProfileAdmin(admin.ModelAdmin):
     readonly_fields = [
         'google_auth_token',
         'google_auth_refresh_token',
+        'google_auth_expiry',
+        'google_calendars_synced_at',
         ]
     list_display = ["__str__"]
 
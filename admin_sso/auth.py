@@ -1,6 +1,8 @@
 from django.contrib.auth.models import User
 from django.contrib.auth import get_user_model, user_login_failed
 
+from datetime import timezone
+
 import jwt
 
 
@@ -35,6 +37,11 @@ class DjangoSSOAuthBackend(object):
                     )
                 if refresh_token:
                     user.profile.google_auth_refresh_token = refresh_token
+                expiry = google_auth_credentials.get('expiry', None)
+                if expiry:  # Naive UTC datetime
+                    user.profile.google_auth_expiry = expiry.replace(
+                        tzinfo=timezone.utc
+                        )
                 user.save()
                 return user
 
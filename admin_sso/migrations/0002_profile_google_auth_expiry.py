@@ -0,0 +1,18 @@
+# Generated by Django 3.2.5 on 2026-10-17 21:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('admin_sso', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='google_auth_expiry',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+    ]
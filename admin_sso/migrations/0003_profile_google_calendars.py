@@ -0,0 +1,28 @@
+# Generated by Django 3.2.5 on 2026-10-17 21:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('admin_sso', '0002_profile_google_auth_expiry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='google_calendars',
+            field=models.JSONField(blank=True, default=list, editable=False),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='google_calendars_sync_token',
+            field=models.TextField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='google_calendars_synced_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+    ]
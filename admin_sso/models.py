@@ -1,11 +1,14 @@
 from django.db import models
-from django.core.cache import cache
 from django.dispatch import receiver
 from django.contrib.auth.models import User
 from django.db.models.signals import post_save
 from django.contrib.auth.models import User, Permission
 
-from gcal2clickup.google_calendar import GoogleCalendar
+from gcal2clickup.google_calendar import (
+    GoogleCalendar, is_sync_token_expired
+    )
+
+from datetime import datetime, timezone
 
 BASE_PROFILE_PERMISSIONS = [
     'Can add clickup user',
@@ -33,7 +36,19 @@ class Profile(models.Model):
     google_auth_refresh_token = models.CharField(
         blank=True, max_length=255, editable=False
         )
-    # google_auth_expiry = models.DateTimeField(blank=True, editable=False)
+    google_auth_expiry = models.DateTimeField(
+        blank=True, null=True, editable=False
+        )
+    # [id, summary] of the calendar list, kept by `sync_calendars`
+    google_calendars = models.JSONField(
+        default=list, blank=True, editable=False
+        )
+    google_calendars_sync_token = models.TextField(
+        blank=True, null=True, editable=False
+        )
+    google_calendars_synced_at = models.DateTimeField(
+        blank=True, null=True, editable=False
+        )
     _google_calendar = None
 
     def __str__(self):
@@ -44,28 +59,78 @@ class Profile(models.Model):
         if self._google_calendar is None:
             self._google_calendar = GoogleCalendar(
                 token=self.google_auth_token,
-                refresh_token=self.google_auth_refresh_token
+                refresh_token=self.google_auth_refresh_token,
+                tenant=str(self.user_id),
+                expiry=self.google_auth_expiry,
+                on_refresh=self.save_google_credentials,
                 )
         return self._google_calendar
 
+    def save_google_credentials(self, credentials):
+        # Store the tokens refreshed by any client for the next ones
+        self.google_auth_token = credentials.token
+        if credentials.refresh_token:
+            self.google_auth_refresh_token = credentials.refresh_token
+        self.google_auth_expiry = credentials.expiry.replace(
+            tzinfo=timezone.utc
+            ) if credentials.expiry else None
+        Profile.objects.filter(pk=self.pk).update(
+            google_auth_token=self.google_auth_token,
+            google_auth_refresh_token=self.google_auth_refresh_token,
+            google_auth_expiry=self.google_auth_expiry,
+            )
+
     @property
     def calendar_choices(self):
-        choices = cache.get('cal-' + str(self))
-        if choices is None:
-            choices = [(c['id'], c['summary'])
-                       for c in self.google_calendar.list_calendars()]
-            cache.set('cal-' + str(self), choices, 600)
-        return choices
+        # Stored list, only listed here if it was never synced
+        if self.google_calendars_synced_at is None:
+            self.sync_calendars()
+        return [tuple(c) for c in self.google_calendars]
+
+    def sync_calendars(self) -> int:
+        # Applies the changes of the calendar list since the last sync, the
+        # whole list when there is no sync token or it expired. Returns the
+        # number of added, renamed or removed calendars
+        stored = dict(self.google_calendars)
+        calendars = {} if self.google_calendars_sync_token is None \
+            else dict(stored)
+        kwargs = {
+            'fields': 'nextPageToken,nextSyncToken,items(id,summary,deleted)',
+            'maxResults': 250,
+            }
+        if self.google_calendars_sync_token is not None:
+            kwargs['syncToken'] = self.google_calendars_sync_token
+        try:
+            pages = list(self.google_calendar.list_calendars_pages(**kwargs))
+        except Exception as e:
+            if 'syncToken' not in kwargs or not is_sync_token_expired(e):
+                raise
+            self.google_calendars_sync_token = None
+            return self.sync_calendars()
+        for page in pages:
+            for c in page.get('items', []):
+                if c.get('deleted', False):
+                    calendars.pop(c['id'], None)
+                else:
+                    calendars[c['id']] = c.get('summary', c['id'])
+        self.google_calendars = [[k, v] for k, v in calendars.items()]
+        self.google_calendars_sync_token = pages[-1].get('nextSyncToken', None)
+        self.google_calendars_synced_at = datetime.now(timezone.utc)
+        Profile.objects.filter(pk=self.pk).update(
+            google_calendars=self.google_calendars,
+            google_calendars_sync_token=self.google_calendars_sync_token,
+            google_calendars_synced_at=self.google_calendars_synced_at,
+            )
+        return sum(
+            stored.get(c, None) != calendars.get(c, None)
+            for c in stored.keys() | calendars.keys()
+            )
 
     @property
     def list_choices(self):
         choices = []
         for u in self.user.clickupuser_set.all():
-            u_choices = cache.get('lst-' + u.token)
-            if u_choices is None:
-                u_choices = u.list_choices
-                cache.set('lst-' + u.token, u_choices, 60)
-            choices += u_choices
+            choices += u.list_choices
         return choices
 
     def save(self, *args, **kwargs):
@@ -169,9 +169,11 @@ LOGGING = {
         #     'handlers': ['console'],
         #     'level': os.getenv('DJANGO_LOG_LEVEL', 'INFO'),
         #     },
-        'gcal2clickup': {
+        # Name of the loggers of every module
+        'gcal2clikup': {
             'handlers': ['console'],
             'level': 'DEBUG' if DEBUG else 'INFO',
+            'propagate': False,  # Root logs to the console already
             },
         },
     }
@@ -209,5 +211,99 @@ GOOGLE_OAUTH_TOKEN_URI = "https://accounts.google.com/o/oauth2/token"
 # Other settings
 SYNCED_TASK_TAG = 'google_calendar'
 
+# JSON library used for API responses and webhook bodies, by default the
+# fastest one installed among orjson, ujson and json
+JSON_CODEC = os.getenv('JSON_CODEC', None)
+
+# Seconds between saves of the in-memory API metrics of each process, and
+# token that grants access to the metrics endpoint besides superusers
+METRICS_FLUSH_INTERVAL = int(os.getenv('METRICS_FLUSH_INTERVAL', 10))
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', None)
+
+# Retries of failed Clickup and Google API calls
+RETRY_MAX_RETRIES = int(os.getenv('RETRY_MAX_RETRIES', 3))
+RETRY_BACKOFF = float(os.getenv('RETRY_BACKOFF', 0.5))  # Seconds
+RETRY_MAX_BACKOFF = float(os.getenv('RETRY_MAX_BACKOFF', 30))
+RETRY_DEADLINE = float(os.getenv('RETRY_DEADLINE', 60))  # Per call
+
+# Google access tokens are renewed in the background when they expire within
+# GOOGLE_TOKEN_REFRESH_MARGIN seconds, checking every ..._INTERVAL seconds
+GOOGLE_TOKEN_REFRESHER = os.getenv('GOOGLE_TOKEN_REFRESHER', 'True').lower() \
+    in ['true', '1', 'yes']
+GOOGLE_TOKEN_REFRESH_MARGIN = int(
+    os.getenv('GOOGLE_TOKEN_REFRESH_MARGIN', 600)
+    )
+GOOGLE_TOKEN_REFRESH_INTERVAL = int(
+    os.getenv('GOOGLE_TOKEN_REFRESH_INTERVAL', 60)
+    )
+
+# Calendar lists of the profiles are synced in the background when they are
+# older than GOOGLE_CALENDARS_MAX_AGE seconds, checking every ..._INTERVAL
+GOOGLE_CALENDARS_SYNCER = os.getenv('GOOGLE_CALENDARS_SYNCER', 'True') \
+    .lower() in ['true', '1', 'yes']
+GOOGLE_CALENDARS_MAX_AGE = int(os.getenv('GOOGLE_CALENDARS_MAX_AGE', 300))
+GOOGLE_CALENDARS_SYNC_INTERVAL = int(
+    os.getenv('GOOGLE_CALENDARS_SYNC_INTERVAL', 60)
+    )
+
+# Calls per Google batch request, the Calendar API accepts up to 50
+GOOGLE_BATCH_SIZE = int(os.getenv('GOOGLE_BATCH_SIZE', 50))
+
+# Threads checking the events of the calendars in runchecks
+GOOGLE_CHECK_WORKERS = int(os.getenv('GOOGLE_CHECK_WORKERS', 4))
+
+# Google GET responses revalidated with their ETag, kept in memory and also
+# in the database when GOOGLE_ETAG_CACHE_DB
+GOOGLE_ETAG_CACHE_SIZE = int(os.getenv('GOOGLE_ETAG_CACHE_SIZE', 1000))
+GOOGLE_ETAG_CACHE_DB = os.getenv('GOOGLE_ETAG_CACHE_DB', 'False').lower() \
+    in ['true', '1', 'yes']
+
+# Circuit breakers of the Clickup and Google APIs, per host and credential.
+# The reset timeout is the seconds that a circuit stays open before probing
+BREAKER_FAILURE_THRESHOLD = int(os.getenv('BREAKER_FAILURE_THRESHOLD', 5))
+BREAKER_RESET_TIMEOUT = float(os.getenv('BREAKER_RESET_TIMEOUT', 30))
+BREAKER_HALF_OPEN_MAX = int(os.getenv('BREAKER_HALF_OPEN_MAX', 1))
+
+# Clickup HTTP sessions, shared by every client using the same token
+CLICKUP_POOL_SIZE = int(os.getenv('CLICKUP_POOL_SIZE', 10))
+CLICKUP_SESSION_IDLE_TIMEOUT = int(os.getenv('CLICKUP_SESSION_IDLE_TIMEOUT', 300))
+# Maximum concurrent requests per token of the asynchronous Clickup client
+CLICKUP_ASYNC_CONCURRENCY = int(os.getenv('CLICKUP_ASYNC_CONCURRENCY', 8))
+
+# Clickup rate limit per token and minute, calls are delayed when only the
+# reserve is left
+CLICKUP_RATE_LIMIT = int(os.getenv('CLICKUP_RATE_LIMIT', 100))
+CLICKUP_RATE_LIMIT_RESERVE = int(os.getenv('CLICKUP_RATE_LIMIT_RESERVE', 5))
+CLICKUP_RATE_LIMIT_MAX_WAIT = int(os.getenv('CLICKUP_RATE_LIMIT_MAX_WAIT', 60))
+# Database alias of the governor connection, added below as a copy of default.
+# The API metrics are saved through it too
+CLICKUP_RATE_LIMIT_DATABASE = 'ratelimit'
+
+# Seconds between full refreshes of the stored Clickup hierarchy, webhooks
+# keep it updated in between
+CLICKUP_HIERARCHY_MAX_AGE = int(os.getenv('CLICKUP_HIERARCHY_MAX_AGE', 86400))
+
+# Cassette file of recorded Clickup and Google responses. In "record" mode
+# every response is appended to it, in "replay" mode they are served from it
+# with their recorded latency multiplied by CASSETTE_LATENCY_SCALE
+CASSETTE = os.getenv('CASSETTE', None)
+CASSETTE_MODE = os.getenv('CASSETTE_MODE', 'replay')
+CASSETTE_LATENCY_SCALE = float(os.getenv('CASSETTE_LATENCY_SCALE', 1.0))
+
+# Keep the links between synced tasks and events in the task description and
+# the event source instead of posting comments. Matchers can override it
+LEAN_SYNC = os.getenv('LEAN_SYNC', 'False').lower() in ['true', '1', 'yes']
+
+# Seconds of Clickup task changes checked by `runchecks` the first time a team
+# is checked, later runs continue from the stored cursor
+CLICKUP_TASKS_BACKFILL = int(os.getenv('CLICKUP_TASKS_BACKFILL', 86400))
+
 # Activate Django-Heroku.
-django_heroku.settings(locals(), logging=False)
\ No newline at end of file
+django_heroku.settings(locals(), logging=False)
+
+# Second connection to the default database, used by the Clickup rate limit
+# governor and the API metrics so that their locks are not held by the
+# transaction of the caller
+DATABASES[CLICKUP_RATE_LIMIT_DATABASE] = dict(
+    DATABASES['default'], TEST={'MIRROR': 'default'}
+    )
\ No newline at end of file
@@ -43,7 +43,7 @@ class GoogleCalendarWebhookAdmin(UserModelAdmin):
                 updated {updated} existing ones'''
                 )
 
-    @admin.display(ordering='calendar', description='Calendar')
+    @admin.display(ordering='calendar_name', description='Calendar')
     def get_calendar(self, obj):
         return obj.calendar[1]
 
@@ -125,7 +125,10 @@ class MatcherAdmin(UserModelAdmin):
                 updated {updated} existing ones'''
                 )
 
-    @admin.display(ordering='calendar', description='Calendar')
+    @admin.display(
+        ordering='google_calendar_webhook__calendar_name',
+        description='Calendar'
+        )
     def get_calendar(self, obj):
         return obj.calendar[1]
 
@@ -168,6 +171,9 @@ class MatcherAdmin(UserModelAdmin):
                     obj.google_calendar_webhook = GoogleCalendarWebhook.create(
                         user=obj.user,
                         calendarId=calendar_id,
+                        calendar_name=dict(
+                            request.user.profile.calendar_choices
+                            ).get(calendar_id, ''),
                         )
                 except Exception as e:
                     raise ValidationError('Calendar not suported') from e
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class Gcal2ClickupConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'gcal2clickup'
+
+    def ready(self):
+        from gcal2clickup import tokens  # noqa: F401, connects the refresher
+        from gcal2clickup import calendars  # noqa: F401, connects the syncer
@@ -0,0 +1,52 @@
+from django.db import close_old_connections
+
+from abc import ABC, abstractmethod
+
+import threading
+import logging
+
+logger = logging.getLogger('gcal2clikup')
+
+
+class PeriodicThread(ABC):
+    # Calls `run_once` every `interval` seconds from a daemon thread, started
+    # by the first request of every worker and by `runchecks`
+    name = 'periodic'
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    @abstractmethod
+    def run_once(self):
+        pass
+
+    def run(self):
+        while not self._stop.is_set():
+            # The thread keeps its database connection between runs, drop it
+            # if the server closed it or a failed run left it unusable
+            close_old_connections()
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error(f'Failed running {self.name}', exc_info=e)
+            finally:
+                close_old_connections()
+            self._stop.wait(self.interval)
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self.run, name=self.name, daemon=True
+                )
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
@@ -0,0 +1,184 @@
+from typing import Dict, List, Optional, Tuple
+
+from app.settings import (
+    BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_TIMEOUT, BREAKER_HALF_OPEN_MAX
+    )
+from gcal2clickup.retry import NETWORK_ERRORS, error_status
+
+from collections import Counter
+from contextlib import contextmanager
+
+import threading
+import logging
+import time
+
+logger = logging.getLogger('gcal2clikup')
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+# Statuses telling that the host is unavailable, any other response means
+# that it is up even if the request was wrong
+OUTAGE_STATUSES = {408, 500, 502, 503, 504}
+
+
+def is_outage(e: Exception) -> bool:
+    status, _ = error_status(e)
+    if status is None:
+        return isinstance(e, NETWORK_ERRORS)
+    return status in OUTAGE_STATUSES
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, breaker: 'CircuitBreaker'):
+        super().__init__(
+            f'Circuit of {breaker.name} is {breaker.state}, retry in '
+            f'{breaker.retry_in():.0f}s'
+            )
+        self.breaker = breaker
+
+
+class CircuitBreaker:
+    """Fails fast the calls to a host that keeps failing.
+
+    The circuit opens after `failure_threshold` consecutive outage errors
+    and every call raises `CircuitOpenError` without being sent. After
+    `reset_timeout` seconds up to `half_open_max` calls are let through as
+    probes, the circuit closes when a probe succeeds and opens again when it
+    fails.
+    """
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = BREAKER_FAILURE_THRESHOLD,
+        reset_timeout: float = BREAKER_RESET_TIMEOUT,
+        half_open_max: int = BREAKER_HALF_OPEN_MAX,
+        ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_max = half_open_max
+        self.state = CLOSED
+        self.failures = 0
+        self.probes = 0
+        self.opened_at: Optional[float] = None
+        self.counters = Counter()
+        self._lock = threading.Lock()
+
+    def _transition(self, state: str):
+        logger.warning(f'Circuit of {self.name}: {self.state} -> {state}')
+        self.counters[f'{self.state}->{state}'] += 1
+        self.state = state
+        self.probes = 0
+        if state == OPEN:
+            self.opened_at = time.monotonic()
+        elif state == CLOSED:
+            self.failures = 0
+            self.opened_at = None
+
+    def retry_in(self) -> float:
+        # Seconds until the next probe is allowed
+        if self.opened_at is None:
+            return 0.0
+        return max(self.reset_timeout - time.monotonic() + self.opened_at, 0.0)
+
+    @property
+    def is_open(self) -> bool:
+        # True when calls would be rejected right now
+        with self._lock:
+            return self.state == OPEN and self.retry_in() > 0
+
+    def allow(self):
+        with self._lock:
+            if self.state == OPEN:
+                if self.retry_in() > 0:
+                    self.counters['rejected'] += 1
+                    raise CircuitOpenError(self)
+                self._transition(HALF_OPEN)
+            if self.state == HALF_OPEN:
+                if self.probes >= self.half_open_max:
+                    self.counters['rejected'] += 1
+                    raise CircuitOpenError(self)
+                self.probes += 1
+            self.counters['allowed'] += 1
+
+    def release(self):
+        # Gives back the probe of an allowed call that was never sent
+        with self._lock:
+            if self.state == HALF_OPEN and self.probes > 0:
+                self.probes -= 1
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+            if self.state != CLOSED:
+                self._transition(CLOSED)
+
+    def failure(self, e: Exception):
+        if not is_outage(e):  # The host answered
+            return self.success()
+        with self._lock:
+            self.failures += 1
+            self.counters['outages'] += 1
+            if self.state == HALF_OPEN:  # The probe failed
+                self._transition(OPEN)
+            elif self.state == CLOSED and \
+                self.failures >= self.failure_threshold:
+                self._transition(OPEN)
+
+    @contextmanager
+    def guard(self, allow: bool = True):
+        # Records the outcome of the calls in the block, `allow=False` when
+        # the call was already allowed before other work such as throttling
+        if allow:
+            self.allow()
+        try:
+            yield self
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            self.failure(e)
+            raise e
+        else:
+            self.success()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'name': self.name,
+                'state': self.state,
+                'failures': self.failures,
+                'retry_in': round(self.retry_in(), 1),
+                **self.counters,
+                }
+
+
+class BreakerRegistry:
+    # Process-wide circuit breakers keyed by (host, tenant)
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+        self._breakers: Dict[Tuple[str, str], CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    def get(self, host: str, tenant: Optional[str]) -> CircuitBreaker:
+        key = (host, tenant or '')
+        with self._lock:
+            if key not in self._breakers:
+                self._breakers[key] = CircuitBreaker(
+                    f'{host} ({tenant or "-"})', **self.kwargs
+                    )
+            return self._breakers[key]
+
+    def is_open(self, host: str, tenant: Optional[str]) -> bool:
+        with self._lock:
+            breaker = self._breakers.get((host, tenant or ''), None)
+        return breaker is not None and breaker.is_open
+
+    def stats(self) -> List[dict]:
+        with self._lock:
+            breakers = list(self._breakers.values())
+        return [b.stats() for b in breakers]
+
+
+breakers = BreakerRegistry()
@@ -0,0 +1,81 @@
+from django.apps import apps
+from django.db import transaction
+from django.db.models import Q
+from django.core.signals import request_started
+from django.utils import timezone
+from app.settings import (
+    GOOGLE_CALENDARS_SYNCER, GOOGLE_CALENDARS_MAX_AGE,
+    GOOGLE_CALENDARS_SYNC_INTERVAL
+    )
+
+from gcal2clickup.background import PeriodicThread
+
+from datetime import timedelta
+
+import logging
+
+logger = logging.getLogger('gcal2clikup')
+
+
+class CalendarListSyncer(PeriodicThread):
+    """Keeps the stored calendar lists of the profiles up to date.
+
+    Every `interval` seconds the lists synced more than `max_age` seconds
+    ago are updated with the changes since their sync token, so the Matcher
+    form reads them without calling Google. Profiles are locked while synced
+    so that several workers do not sync the same list.
+    """
+    name = 'calendar-list-syncer'
+
+    def __init__(
+        self,
+        max_age: float = GOOGLE_CALENDARS_MAX_AGE,
+        interval: float = GOOGLE_CALENDARS_SYNC_INTERVAL,
+        ):
+        super().__init__(interval)
+        self.max_age = max_age
+
+    def due(self):
+        model = apps.get_model('admin_sso', 'Profile')
+        return model.objects.exclude(google_auth_refresh_token='').filter(
+            Q(google_calendars_synced_at__isnull=True)
+            | Q(
+                google_calendars_synced_at__lte=timezone.now() -
+                timedelta(seconds=self.max_age)
+                )
+            )
+
+    def sync_due(self) -> int:
+        synced = 0
+        for pk in self.due().values_list('pk', flat=True):
+            try:
+                with transaction.atomic():
+                    # Skip the profile if another worker is syncing it or
+                    # has synced it already
+                    profile = self.due().select_for_update(
+                        skip_locked=True
+                        ).filter(pk=pk).first()
+                    if profile is None:
+                        continue
+                    profile.sync_calendars()
+                    synced += 1
+            except Exception as e:
+                # Kept with the last synced list until the next run
+                logger.error(
+                    f'Failed syncing the calendar list of {pk}', exc_info=e
+                    )
+        return synced
+
+    def run_once(self):
+        synced = self.sync_due()
+        if synced:
+            logger.info(f'Synced {synced} Google calendar lists')
+
+
+calendar_syncer = CalendarListSyncer()
+
+
+@request_started.connect
+def start_calendar_syncer(sender, **kwargs):
+    if GOOGLE_CALENDARS_SYNCER:
+        calendar_syncer.start()
@@ -0,0 +1,267 @@
+from typing import Dict, List, Mapping, Optional, Tuple
+
+from app.settings import CASSETTE, CASSETTE_MODE, CASSETTE_LATENCY_SCALE
+from gcal2clickup import codec
+
+from collections import defaultdict
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+import threading
+import requests
+import httplib2
+import asyncio
+import logging
+import base64
+import httpx
+import gzip
+import time
+import re
+
+logger = logging.getLogger('gcal2clikup')
+
+RECORD = 'record'
+REPLAY = 'replay'
+
+# Response headers kept in the cassettes, the clients do not use the rest
+HEADERS = [
+    'content-type', 'retry-after', 'etag', 'x-ratelimit-limit',
+    'x-ratelimit-remaining', 'x-ratelimit-reset'
+    ]
+# JSON keys and query parameters whose values are never recorded
+SECRET_KEYS = [
+    'access_token', 'refresh_token', 'id_token', 'client_secret', 'secret',
+    'key'
+    ]
+SCRUBBED = 'SCRUBBED'
+_secret_value = re.compile(r'"(%s)"\s*:\s*"[^"]*"' % '|'.join(SECRET_KEYS))
+_secret_param = re.compile(r'\b(%s)=[^&#\s"\']*' % '|'.join(SECRET_KEYS))
+
+
+class CassetteMissError(LookupError):
+    pass
+
+
+class Cassette:
+    """Recorded Clickup and Google responses to re-run syncs offline.
+
+    In record mode the transports append every response and its latency to
+    the file, leaving out request headers and replacing tokens and secrets.
+    In replay mode the responses of each method and URL are served in the
+    recorded order after sleeping their latency times `latency_scale`. URLs
+    with a query that changes between runs, such as `timeMin`, fall back to
+    the responses of the same path.
+    """
+    def __init__(
+        self,
+        path: str,
+        mode: str = REPLAY,
+        latency_scale: float = CASSETTE_LATENCY_SCALE,
+        ):
+        if mode not in [RECORD, REPLAY]:
+            raise ValueError(f'Unknown cassette mode "{mode}"')
+        self.path = str(path)
+        self.mode = mode
+        self.latency_scale = latency_scale
+        self.secrets = set()
+        self.size = 0  # Loaded responses
+        self._interactions: Dict[Tuple[str, str], List[dict]] = \
+            defaultdict(list)
+        self._played: Dict[Tuple[str, str], int] = defaultdict(int)
+        self._lock = threading.Lock()
+        if mode == REPLAY:
+            self.load()
+
+    def open(self, mode: str):
+        if self.path.endswith('.gz'):
+            return gzip.open(self.path, mode)
+        return open(self.path, mode)
+
+    @staticmethod
+    def keys(method: str, url: str) -> List[Tuple[str, str]]:
+        # Exact URL first, then the URL without its query
+        method = method.upper()
+        return [(method, url), (method, url.split('?')[0].rstrip('/'))]
+
+    def load(self):
+        with self.open('rb') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                interaction = codec.loads(line)
+                for key in self.keys(
+                    interaction['method'], interaction['url']
+                    ):
+                    self._interactions[key].append(interaction)
+                self.size += 1
+        logger.info(f'Loaded {self.size} responses from {self.path}')
+
+    def rewind(self):
+        with self._lock:
+            self._played.clear()
+
+    def add_secret(self, authorization: Optional[str]):
+        # Token of an Authorization header, with or without scheme
+        if authorization:
+            self.secrets.add(authorization.split(' ')[-1])
+
+    def scrub(self, text: str) -> str:
+        for secret in self.secrets:
+            text = text.replace(secret, SCRUBBED)
+        text = _secret_value.sub(rf'"\1": "{SCRUBBED}"', text)
+        return _secret_param.sub(rf'\1={SCRUBBED}', text)
+
+    def record(
+        self,
+        method: str,
+        url: str,
+        status: int,
+        headers: Mapping[str, str],
+        content: bytes,
+        latency: float,
+        ):
+        interaction = {
+            'method': method.upper(),
+            'url': self.scrub(url),
+            'status': int(status),
+            'headers': {k: headers[k] for k in HEADERS if k in headers},
+            'latency': round(latency, 4),
+            }
+        try:
+            interaction['body'] = self.scrub(content.decode())
+        except UnicodeDecodeError:
+            interaction['body64'] = base64.b64encode(content).decode()
+        line = codec.dumps(interaction) + b'\n'
+        with self._lock:
+            with self.open('ab') as f:
+                f.write(line)
+
+    def play(self, method: str, url: str) -> Tuple[dict, bytes]:
+        # (interaction, content) of the next recorded response
+        with self._lock:
+            for key in self.keys(method, url):
+                interactions = self._interactions.get(key, None)
+                if interactions:
+                    break
+            else:
+                raise CassetteMissError(
+                    f'No recorded response for {method} {url}'
+                    )
+            played = self._played[key]
+            self._played[key] += 1
+        # Wrap around so the same scenario can be replayed several times
+        interaction = interactions[played % len(interactions)]
+        if 'body64' in interaction:
+            content = base64.b64decode(interaction['body64'])
+        else:
+            content = interaction['body'].encode()
+        return (interaction, content)
+
+    def latency(self, interaction: dict) -> float:
+        return interaction['latency'] * self.latency_scale
+
+
+_cassette = Cassette(CASSETTE, CASSETTE_MODE) if CASSETTE else None
+
+
+def active_cassette() -> Optional[Cassette]:
+    return _cassette
+
+
+def use_cassette(cassette: Optional[Cassette]):
+    # Clients created afterwards record or replay with the cassette
+    global _cassette
+    _cassette = cassette
+
+
+class CassetteAdapter(HTTPAdapter):
+    # requests transport of the Clickup sessions
+    def __init__(self, cassette: Cassette, **kwargs):
+        super().__init__(**kwargs)
+        self.cassette = cassette
+
+    def send(self, request, **kwargs):
+        if self.cassette.mode == REPLAY:
+            interaction, content = self.cassette.play(
+                request.method, request.url
+                )
+            time.sleep(self.cassette.latency(interaction))
+            response = requests.Response()
+            response.status_code = interaction['status']
+            response.headers = CaseInsensitiveDict(interaction['headers'])
+            response._content = content
+            response.url = request.url
+            response.request = request
+            return response
+        self.cassette.add_secret(request.headers.get('Authorization', None))
+        started = time.monotonic()
+        response = super().send(request, **kwargs)
+        self.cassette.record(
+            request.method, request.url, response.status_code,
+            response.headers, response.content, time.monotonic() - started
+            )
+        return response
+
+
+class CassetteTransport(httpx.AsyncBaseTransport):
+    # httpx transport of the asynchronous Clickup client
+    def __init__(
+        self, cassette: Cassette, transport: httpx.AsyncBaseTransport
+        ):
+        self.cassette = cassette
+        self.transport = transport
+
+    async def handle_async_request(self, request: httpx.Request):
+        url = str(request.url)
+        if self.cassette.mode == REPLAY:
+            interaction, content = self.cassette.play(request.method, url)
+            await asyncio.sleep(self.cassette.latency(interaction))
+            return httpx.Response(
+                interaction['status'],
+                headers=interaction['headers'],
+                content=content,
+                request=request,
+                )
+        self.cassette.add_secret(request.headers.get('Authorization', None))
+        started = time.monotonic()
+        response = await self.transport.handle_async_request(request)
+        content = await response.aread()
+        self.cassette.record(
+            request.method, url, response.status_code, response.headers,
+            content, time.monotonic() - started
+            )
+        return response
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+class CassetteHttp(httplib2.Http):
+    # httplib2 transport of the Google Calendar service
+    def __init__(self, cassette: Cassette, **kwargs):
+        super().__init__(**kwargs)
+        self.cassette = cassette
+
+    def request(self, uri, method='GET', body=None, headers=None, **kwargs):
+        if self.cassette.mode == REPLAY:
+            interaction, content = self.cassette.play(method, uri)
+            time.sleep(self.cassette.latency(interaction))
+            return (
+                httplib2.Response({
+                    'status': str(interaction['status']),
+                    **interaction['headers'],
+                    }),
+                content,
+                )
+        for name, value in (headers or {}).items():
+            if name.lower() == 'authorization':
+                self.cassette.add_secret(value)
+        started = time.monotonic()
+        (resp, content) = super().request(
+            uri, method, body=body, headers=headers, **kwargs
+            )
+        self.cassette.record(
+            method, uri, resp.status, resp, content,
+            time.monotonic() - started
+            )
+        return (resp, content)
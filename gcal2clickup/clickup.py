@@ -1,28 +1,150 @@
-from typing import List, Union
+from typing import List, Optional, Union
 
 from datetime import datetime, time, date
+from weakref import WeakKeyDictionary
+from urllib.parse import urlparse
+from contextlib import contextmanager
 
-import requests
+from asgiref.sync import async_to_sync, sync_to_async
+from gcal2clickup import codec
+from gcal2clickup.sessions import SessionRegistry, clickup_sessions
+from gcal2clickup.ratelimit import (
+    RateLimitGovernor, rate_limit_governor, token_key
+    )
+from gcal2clickup.metrics import timed, clickup_path
+from gcal2clickup.breaker import BreakerRegistry, breakers
+from gcal2clickup.cassette import CassetteTransport, active_cassette
+from gcal2clickup.retry import (
+    RetryPolicy, HTTPStatusError, clickup_retry, parse_retry_after
+    )
+from app.settings import CLICKUP_POOL_SIZE, CLICKUP_ASYNC_CONCURRENCY
+
+import threading
+import asyncio
 import logging
-import json
+import httpx
 
 logger = logging.getLogger('gcal2clikup')
 
 DATE_ONLY_TIME = time(hour=2, minute=0, second=0)
 
+# Webhook events that change the workspace hierarchy
+HIERARCHY_WEBHOOK_EVENTS = [
+    f'{kind}{action}'
+    for kind in ['space', 'folder', 'list']
+    for action in ['Created', 'Updated', 'Deleted']
+    ]
+
+
+class CommentBuffer:
+    # Pending comments by (token, task_id), merged into one request per task
+    def __init__(self):
+        self.comments = {}
+
+    @staticmethod
+    def blocks(data: dict) -> List[dict]:
+        if 'comment' in data:
+            return list(data['comment'])
+        return [{'text': data.get('comment_text', ''), 'attributes': {}}]
+
+    def add(self, api: 'Clickup', task_id: str, data: dict):
+        key = (api.token, task_id)
+        if key not in self.comments:
+            self.comments[key] = (api, data)
+            return
+        api, pending = self.comments[key]
+        comment = self.blocks(pending) + [{'text': '\n', 'attributes': {}}]
+        comment += self.blocks(data)
+        pending = {k: v for k, v in pending.items() if k != 'comment_text'}
+        pending['comment'] = comment
+        self.comments[key] = (api, pending)
+
+    def discard(self, api: 'Clickup', task_id: str):
+        self.comments.pop((api.token, task_id), None)
+
+    def flush(self):
+        # Every task gets its comment even if a previous one fails
+        comments, self.comments = self.comments, {}
+        for (_, task_id), (api, data) in comments.items():
+            try:
+                api.post(f'task/{task_id}/comment', data=data)
+            except Exception as e:
+                logger.error(f'Failed commenting task {task_id}', exc_info=e)
+
+
+_local = threading.local()
+
+
+def comment_buffer() -> Optional[CommentBuffer]:
+    return getattr(_local, 'comment_buffer', None)
 
-class Clickup:
-    def __init__(self, token):
+
+@contextmanager
+def coalesce_comments():
+    """Merge the Clickup comments posted to each task until the block exits.
+
+    The comments are sent when the outermost block exits, also when it exits
+    with an error. It can be used as a decorator of sync operations.
+    """
+    buffer = comment_buffer()
+    if buffer is not None:  # Nested operations share the outer buffer
+        yield buffer
+        return
+    buffer = _local.comment_buffer = CommentBuffer()
+    try:
+        yield buffer
+    finally:
+        _local.comment_buffer = None
+        buffer.flush()
+
+
+class ClickupBase:
+    """URLs, headers and parsing shared by `Clickup` and `AsyncClickup`.
+
+    It sends no request, each client implements the request methods and the
+    endpoints on top of them.
+    """
+    HOST = 'api.clickup.com'
+
+    DEFAULT_WEBHOOK_EVENTS = [
+        "taskCreated",
+        "taskUpdated",
+        "taskDeleted",
+        "taskMoved",
+        ] + HIERARCHY_WEBHOOK_EVENTS
+
+    def __init__(
+        self,
+        token,
+        governor: RateLimitGovernor = rate_limit_governor,
+        retry: RetryPolicy = clickup_retry,
+        tenant: str = None,
+        breakers: BreakerRegistry = breakers,
+        ):
         self.token = token
+        # Label of the API metrics, the token hash by default
+        self.tenant = tenant or self.circuit_key(token)
+        # Circuits are per token as the rate limits, not per metrics label
+        self.circuit = self.circuit_key(token)
+        self.governor = governor
+        self.retry = retry
+        self.breakers = breakers
+        # Seconds waited for the rate limit by the last request and overall
+        self.throttled = 0.0
+        self.throttled_total = 0.0
+
+    @staticmethod
+    def circuit_key(token: str) -> str:
+        return token_key(token)[:12]
 
     def url(self, path: str, version: int = 2):
         return self.base_url(version=version) + path
 
     def base_url(self, version: int = 2):
-        return f'https://api.clickup.com/api/v{version}/'
+        return f'https://{self.HOST}/api/v{version}/'
 
-    def request(self, method, url, version: int = 2, retry_count=0, **kwargs):
-        headers = kwargs.pop('headers', {})
+    def headers(self, headers: dict = None) -> dict:
+        headers = {} if headers is None else headers
         headers['Authorization'] = self.token
         headers['Content-Type'] = (
             'application/json'
@@ -32,37 +154,129 @@ class Clickup:
             'application/json'
             if 'Accept' not in headers else headers['Accept']
             )
-        if not url.startswith('https://'):
-            url = self.url(url, version=version)
-        response = requests.request(method, url, headers=headers, **kwargs)
-        if response.status_code > 250:
-            if retry_count < 2:
-                return self.request(
-                    method, url, retry_count=retry_count + 1, **kwargs
-                    )
-            raise Exception(
-                f'Error { response.status_code }: { response.text }'
+        return headers
+
+    @staticmethod
+    def parse_response(status_code: int, content: bytes, headers: dict = None):
+        if status_code > 250:
+            raise HTTPStatusError(
+                status_code, content.decode(errors='replace'), headers
                 )
+        try:
+            return codec.loads(content)
+        except codec.DecodeError:
+            return content.decode(errors='replace')
+
+    @staticmethod
+    def parse_task_time(
+            t: Union[datetime, date], field: str
+        ) -> dict:
+        data = {
+            f'{field}_date_time': type(t) == datetime,
+        }
+        if not data[f'{field}_date_time']:
+            t = datetime.combine(t, DATE_ONLY_TIME)
+        # Clickup won't accept dates that are not multiples of 15 min
+        round_to = 15*60
+        # In the following line // is a floor division
+        data[f'{field}_date'] = t.timestamp() // round_to * round_to * 1000
+        return data
+
+    @staticmethod
+    def repr_list(l: dict) -> str:
+        if not l["folder"]["hidden"]:
+            folder = " > " + l["folder"]["name"]
         else:
+            folder = ""
+        return f'{l["space"]["name"]}{folder} > {l["name"]}'
+
+
+class Clickup(ClickupBase):
+    def __init__(
+        self,
+        token,
+        sessions: SessionRegistry = clickup_sessions,
+        governor: RateLimitGovernor = rate_limit_governor,
+        retry: RetryPolicy = clickup_retry,
+        tenant: str = None,
+        breakers: BreakerRegistry = breakers,
+        ):
+        super().__init__(
+            token,
+            governor=governor,
+            retry=retry,
+            tenant=tenant,
+            breakers=breakers,
+            )
+        self.sessions = sessions
+
+    @property
+    def session(self):
+        return self.sessions.get(self.token)
+
+    def request(
+        self,
+        method,
+        url,
+        version: int = 2,
+        idempotent: Optional[bool] = None,
+        **kwargs,
+        ):
+        headers = self.headers(kwargs.pop('headers', {}))
+        if not url.startswith('https://'):
+            url = self.url(url, version=version)
+        self.throttled = 0.0
+        path = clickup_path(url)
+        breaker = self.breakers.get(urlparse(url).netloc, self.circuit)
+        attempts = []
+
+        def send():
+            breaker.allow()
             try:
-                return json.loads(response.text)
-            except json.decoder.JSONDecodeError:
-                return response.text
+                throttled = self.governor.acquire(self.token)
+            except BaseException:
+                breaker.release()
+                raise
+            self.throttled += throttled
+            self.throttled_total += throttled
+            if throttled:
+                logger.info(f'{method} {url} throttled {throttled:.2f}s')
+            with breaker.guard(allow=False), timed(
+                'clickup', method, path, self.tenant
+                ) as t:
+                t.retry = bool(attempts)
+                attempts.append(t)
+                t.throttled = throttled
+                t.bytes_sent = len(kwargs.get('data', None) or b'')
+                response = self.session.request(
+                    method, url, headers=headers, **kwargs
+                    )
+                t.bytes_received = len(response.content)
+                self.governor.update(self.token, response.headers)
+                if response.status_code == 429:
+                    self.governor.exhaust(
+                        self.token, parse_retry_after(response.headers)
+                        )
+                return self.parse_response(
+                    response.status_code, response.content, response.headers
+                    )
+
+        return self.retry.call(send, method, idempotent=idempotent)
 
     def options(self, url):
         return self.request('OPTIONS', url)
 
     def post(self, url, data):
-        return self.request('POST', url, data=json.dumps(data))
+        return self.request('POST', url, data=codec.dumps(data))
 
     def get(self, url, params=None):
         return self.request('GET', url, params=params)
 
     def put(self, url, data):
-        return self.request('PUT', url, data=json.dumps(data))
+        return self.request('PUT', url, data=codec.dumps(data))
 
     def patch(self, url, data):
-        return self.request('PATCH', url, data=json.dumps(data))
+        return self.request('PATCH', url, data=codec.dumps(data))
 
     def delete(self, url, params=None):
         return self.request('DELETE', url, params=params)
@@ -75,6 +289,57 @@ class Clickup:
         for team in self.get('team')['teams']:
             yield team
 
+    # Tasks per page of the filtered team tasks endpoint
+    TEAM_TASKS_PAGE_SIZE = 100
+
+    def list_team_tasks(
+        self,
+        team_id: Union[int, str],
+        list_ids: List[str] = None,
+        updated_after: datetime = None,
+        **params,
+        ):
+        # Tasks of a team changed since `updated_after`, page by page
+        params = {
+            'order_by': 'updated',
+            'include_closed': 'true',
+            'subtasks': 'true',
+            **params,
+            }
+        if list_ids is not None:
+            params['list_ids[]'] = list(list_ids)
+        if updated_after is not None:
+            params['date_updated_gt'] = int(updated_after.timestamp() * 1000)
+        page = 0
+        while True:
+            response = self.get(
+                f'team/{team_id}/task', params={
+                    **params, 'page': page
+                    }
+                )
+            tasks = response.get('tasks', [])
+            yield from tasks
+            if response.get('last_page', False) or \
+                len(tasks) < self.TEAM_TASKS_PAGE_SIZE:
+                return
+            page += 1
+
+    def run_async(self, name: str, *args, **kwargs):
+        # Runs a method of the asynchronous client from synchronous code, in
+        # a new event loop with its own connections. Only worth it for the
+        # concurrent walk of the whole hierarchy
+        async def run():
+            async with AsyncClickup(
+                self.token,
+                governor=self.governor,
+                retry=self.retry,
+                tenant=self.tenant,
+                breakers=self.breakers,
+                ) as api:
+                return await getattr(api, name)(*args, **kwargs)
+
+        return async_to_sync(run)()
+
     def list_spaces(self, teams: List[dict] = None):
         if teams is None:
             teams = self.list_teams()
@@ -99,21 +364,6 @@ class Clickup:
             for _list in self.get(f'space/{space["id"]}/list')['lists']:
                 yield _list
 
-    @staticmethod
-    def parse_task_time(
-            t: Union[datetime, date], field: str
-        ) -> dict:
-        data = {
-            f'{field}_date_time': type(t) == datetime,
-        }
-        if not data[f'{field}_date_time']:
-            t = datetime.combine(t, DATE_ONLY_TIME)
-        # Clickup won't accept dates that are not multiples of 15 min
-        round_to = 15*60
-        # In the following line // is a floor division
-        data[f'{field}_date'] = t.timestamp() // round_to * round_to * 1000
-        return data
-
     def create_task(
         self,
         list_id: str,
@@ -141,6 +391,9 @@ class Clickup:
         return self.put(f'task/{task_id}', data=data)
     
     def comment_task(self, task_id: str, **data):
+        buffer = comment_buffer()
+        if buffer is not None:
+            return buffer.add(self, task_id, data)
         return self.post(f'task/{task_id}/comment', data=data)
     
     def task_logger(self, text: str, task_id: str):
@@ -149,30 +402,18 @@ class Clickup:
         return self.comment_task(task_id=task_id, **data)
 
     def delete_task(self, task_id: str):
+        buffer = comment_buffer()
+        if buffer is not None:  # Comments of a deleted task would fail
+            buffer.discard(self, task_id)
         return self.delete(f'task/{task_id}')
 
-    @staticmethod
-    def repr_list(l: dict) -> str:
-        if not l["folder"]["hidden"]:
-            folder = " > " + l["folder"]["name"]
-        else:
-            folder = ""
-        return f'{l["space"]["name"]}{folder} > {l["name"]}'
-
-    def list_webhooks(self, teams: List[str] = None):
+    def list_webhooks(self, teams: List[dict] = None):
         if teams is None:
             teams = self.list_teams()
         for team in teams:
             for webhook in self.get(f'team/{team["id"]}/webhook')['webhooks']:
                 yield webhook
 
-    DEFAULT_WEBHOOK_EVENTS = [
-        "taskCreated",
-        "taskUpdated",
-        "taskDeleted",
-        "taskMoved",
-        ]
-
     def create_webhook(
         self,
         team: dict,
@@ -186,5 +427,288 @@ class Clickup:
         data['events'] = events
         return self.post(f'team/{team["id"]}/webhook', data)
 
+    def update_webhook(self, webhook: dict, events: List[str] = None):
+        if events is None:
+            events = self.DEFAULT_WEBHOOK_EVENTS
+        data = {
+            'endpoint': webhook['endpoint'],
+            'events': events,
+            'status': 'active',
+            }
+        return self.put(f'webhook/{webhook["id"]}', data)
+
     def delete_webhook(self, webhook: dict):
         return self.delete(f'webhook/{webhook["id"]}')
+
+    def hierarchy(self) -> dict:
+        return self.run_async('hierarchy')
+
+
+# Semaphores bounding the concurrent requests per token in each event loop
+_semaphores = WeakKeyDictionary()
+
+
+class AsyncClickup(ClickupBase):
+    """Asynchronous twin of `Clickup`.
+
+    Every request method is a coroutine and the workspace hierarchy is walked
+    concurrently, with at most `concurrency` requests in flight per token. It
+    must be used as an async context manager so the HTTP client is closed in
+    the same event loop that opened it.
+    """
+    def __init__(
+        self,
+        token,
+        governor: RateLimitGovernor = rate_limit_governor,
+        retry: RetryPolicy = clickup_retry,
+        tenant: str = None,
+        concurrency: int = CLICKUP_ASYNC_CONCURRENCY,
+        breakers: BreakerRegistry = breakers,
+        ):
+        super().__init__(
+            token,
+            governor=governor,
+            retry=retry,
+            tenant=tenant,
+            breakers=breakers,
+            )
+        self.concurrency = concurrency
+        self.client = None
+
+    async def __aenter__(self):
+        limits = httpx.Limits(max_connections=CLICKUP_POOL_SIZE)
+        cassette = active_cassette()
+        if cassette is None:
+            self.client = httpx.AsyncClient(limits=limits)
+        else:
+            self.client = httpx.AsyncClient(
+                transport=CassetteTransport(
+                    cassette, httpx.AsyncHTTPTransport(limits=limits)
+                    )
+                )
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.client.aclose()
+        self.client = None
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        semaphores = _semaphores.setdefault(asyncio.get_running_loop(), {})
+        if self.token not in semaphores:
+            semaphores[self.token] = asyncio.Semaphore(self.concurrency)
+        return semaphores[self.token]
+
+    async def request(
+        self,
+        method,
+        url,
+        version: int = 2,
+        idempotent: Optional[bool] = None,
+        **kwargs,
+        ):
+        headers = self.headers(kwargs.pop('headers', {}))
+        if not url.startswith('https://'):
+            url = self.url(url, version=version)
+
+        path = clickup_path(url)
+        breaker = self.breakers.get(urlparse(url).netloc, self.circuit)
+        attempts = []
+
+        async def send():
+            async with self.semaphore:
+                breaker.allow()
+                try:
+                    throttled = await sync_to_async(self.governor.acquire
+                                                    )(self.token)
+                except BaseException:  # Also when the call is cancelled
+                    breaker.release()
+                    raise
+                self.throttled_total += throttled
+                if throttled:
+                    logger.info(f'{method} {url} throttled {throttled:.2f}s')
+                with breaker.guard(allow=False), timed(
+                    'clickup', method, path, self.tenant
+                    ) as t:
+                    t.retry = bool(attempts)
+                    attempts.append(t)
+                    t.throttled = throttled
+                    t.bytes_sent = len(kwargs.get('content', None) or b'')
+                    response = await self.client.request(
+                        method, url, headers=headers, **kwargs
+                        )
+                    t.bytes_received = len(response.content)
+                    await sync_to_async(self.governor.update
+                                        )(self.token, response.headers)
+                    if response.status_code == 429:
+                        await sync_to_async(self.governor.exhaust)(
+                            self.token, parse_retry_after(response.headers)
+                            )
+                    return self.parse_response(
+                        response.status_code, response.content,
+                        response.headers
+                        )
+
+        return await self.retry.call_async(
+            send, method, idempotent=idempotent
+            )
+
+    async def options(self, url):
+        return await self.request('OPTIONS', url)
+
+    async def post(self, url, data):
+        return await self.request('POST', url, content=codec.dumps(data))
+
+    async def get(self, url, params=None):
+        return await self.request('GET', url, params=params)
+
+    async def put(self, url, data):
+        return await self.request('PUT', url, content=codec.dumps(data))
+
+    async def patch(self, url, data):
+        return await self.request('PATCH', url, content=codec.dumps(data))
+
+    async def delete(self, url, params=None):
+        return await self.request('DELETE', url, params=params)
+
+    @property
+    async def user(self):
+        return (await self.get('user'))['user']
+
+    async def list_teams(self) -> List[dict]:
+        return (await self.get('team'))['teams']
+
+    async def _gather(self, key: str, paths: List[str]) -> List[dict]:
+        # GET every path concurrently and join the `key` items in order
+        responses = await asyncio.gather(*(self.get(p) for p in paths))
+        return [item for response in responses for item in response[key]]
+
+    async def list_spaces(self, teams: List[dict] = None) -> List[dict]:
+        if teams is None:
+            teams = await self.list_teams()
+        return await self._gather(
+            'spaces', [f'team/{team["id"]}/space' for team in teams]
+            )
+
+    async def list_folders(self, spaces: List[dict] = None) -> List[dict]:
+        if spaces is None:
+            spaces = await self.list_spaces()
+        return await self._gather(
+            'folders', [f'space/{space["id"]}/folder' for space in spaces]
+            )
+
+    async def _list_space_lists(self, space: dict) -> List[dict]:
+        folders, lists = await asyncio.gather(
+            self.list_folders(spaces=[space]),
+            self.get(f'space/{space["id"]}/list'),
+            )
+        folder_lists = await self._gather(
+            'lists', [f'folder/{folder["id"]}/list' for folder in folders]
+            )
+        return folder_lists + lists['lists']
+
+    async def list_lists(self, spaces: List[dict] = None) -> List[dict]:
+        if spaces is None:
+            spaces = await self.list_spaces()
+        lists = await asyncio.gather(
+            *(self._list_space_lists(space) for space in spaces)
+            )
+        return [_list for space_lists in lists for _list in space_lists]
+
+    async def hierarchy(self) -> dict:
+        # Every team, space, folder and list of the user. Spaces are returned
+        # with their team because Clickup does not include it
+        teams = await self.list_teams()
+        team_spaces = await asyncio.gather(
+            *(self.list_spaces(teams=[team]) for team in teams)
+            )
+        spaces = []
+        for team, _spaces in zip(teams, team_spaces):
+            for space in _spaces:
+                space['team'] = {'id': team['id']}
+                spaces.append(space)
+        folders = await self.list_folders(spaces=spaces)
+        folder_lists, space_lists = await asyncio.gather(
+            self._gather(
+                'lists', [f'folder/{folder["id"]}/list' for folder in folders]
+                ),
+            self._gather(
+                'lists', [f'space/{space["id"]}/list' for space in spaces]
+                ),
+            )
+        return {
+            'teams': teams,
+            'spaces': spaces,
+            'folders': folders,
+            'lists': folder_lists + space_lists,
+            }
+
+    async def create_task(
+        self,
+        list_id: str,
+        start_date: datetime = None,
+        due_date: datetime = None,
+        **data,
+        ):
+        if start_date:
+            data.update(self.parse_task_time(start_date, 'start'))
+        if due_date:
+            data.update(self.parse_task_time(due_date, 'due'))
+        return await self.post(f'list/{list_id}/task', data=data)
+
+    async def update_task(
+        self,
+        task_id: str,
+        start_date: datetime = None,
+        due_date: datetime = None,
+        **data,
+        ):
+        if start_date:
+            data.update(self.parse_task_time(start_date, 'start'))
+        if due_date:
+            data.update(self.parse_task_time(due_date, 'due'))
+        return await self.put(f'task/{task_id}', data=data)
+
+    async def comment_task(self, task_id: str, **data):
+        return await self.post(f'task/{task_id}/comment', data=data)
+
+    async def task_logger(self, text: str, task_id: str):
+        logger.info(text)
+        data = {'comment_text': 'gcal2clickup: ' + text}
+        return await self.comment_task(task_id=task_id, **data)
+
+    async def delete_task(self, task_id: str):
+        return await self.delete(f'task/{task_id}')
+
+    async def list_webhooks(self, teams: List[dict] = None) -> List[dict]:
+        if teams is None:
+            teams = await self.list_teams()
+        return await self._gather(
+            'webhooks', [f'team/{team["id"]}/webhook' for team in teams]
+            )
+
+    async def create_webhook(
+        self,
+        team: dict,
+        endpoint: str,
+        events: List[str] = None,
+        **data,
+        ):
+        data['endpoint'] = endpoint
+        if events is None:
+            events = self.DEFAULT_WEBHOOK_EVENTS
+        data['events'] = events
+        return await self.post(f'team/{team["id"]}/webhook', data)
+
+    async def update_webhook(self, webhook: dict, events: List[str] = None):
+        if events is None:
+            events = self.DEFAULT_WEBHOOK_EVENTS
+        data = {
+            'endpoint': webhook['endpoint'],
+            'events': events,
+            'status': 'active',
+            }
+        return await self.put(f'webhook/{webhook["id"]}', data)
+
+    async def delete_webhook(self, webhook: dict):
+        return await self.delete(f'webhook/{webhook["id"]}')
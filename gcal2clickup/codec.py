@@ -0,0 +1,97 @@
+from typing import Any, Callable, Dict, NamedTuple, Optional, Union
+
+from app.settings import JSON_CODEC
+
+import importlib
+import logging
+import json
+
+logger = logging.getLogger('gcal2clikup')
+
+
+class Codec(NamedTuple):
+    name: str
+    loads: Callable[[Union[bytes, str]], Any]  # Parses bytes directly
+    dumps: Callable[[Any], bytes]
+    error: type  # Raised by loads on invalid documents
+
+
+def _json() -> Codec:
+    return Codec(
+        'json',
+        json.loads,
+        lambda obj: json.dumps(obj).encode(),
+        json.JSONDecodeError,
+        )
+
+
+def _orjson() -> Codec:
+    orjson = importlib.import_module('orjson')
+    return Codec('orjson', orjson.loads, orjson.dumps, orjson.JSONDecodeError)
+
+
+def _ujson() -> Codec:
+    ujson = importlib.import_module('ujson')
+    return Codec(
+        'ujson',
+        ujson.loads,
+        lambda obj: ujson.dumps(obj).encode(),
+        ujson.JSONDecodeError,
+        )
+
+
+# Preferred first, the standard library is always available
+CODECS: Dict[str, Callable[[], Codec]] = {
+    'orjson': _orjson,
+    'ujson': _ujson,
+    'json': _json,
+    }
+
+
+def available_codecs() -> Dict[str, Codec]:
+    codecs = {}
+    for name, load in CODECS.items():
+        try:
+            codecs[name] = load()
+        except ImportError:
+            pass
+    return codecs
+
+
+def get_codec(name: Optional[str] = JSON_CODEC) -> Codec:
+    codecs = available_codecs()
+    if name:
+        if name not in codecs:
+            raise ImportError(f'JSON codec "{name}" is not installed')
+        return codecs[name]
+    return next(iter(codecs.values()))
+
+
+codec = get_codec()
+DecodeError = codec.error
+logger.debug(f'Using {codec.name} JSON codec')
+
+
+def loads(data: Union[bytes, str]) -> Any:
+    return codec.loads(data)
+
+
+def dumps(obj: Any) -> bytes:
+    return codec.dumps(obj)
+
+
+# Fields of a Clickup webhook body used by clickup_endpoint
+WEBHOOK_FIELDS = ['webhook_id', 'event', 'task_id', 'space_id', 'folder_id',
+                  'list_id']
+HISTORY_ITEM_FIELDS = ['field', 'before', 'after', 'data']
+
+
+def loads_webhook(data: bytes) -> dict:
+    # Keeps only the used parts of a Clickup webhook body. History items
+    # carry the full user and parent objects, which are dropped right away
+    body = loads(data)
+    payload = {k: body[k] for k in WEBHOOK_FIELDS if k in body}
+    payload['history_items'] = [{
+        k: i[k] for k in HISTORY_ITEM_FIELDS if k in i
+        } for i in body.get('history_items', None) or []]
+    return payload
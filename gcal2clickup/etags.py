@@ -0,0 +1,116 @@
+from typing import Optional, Tuple
+
+from django.apps import apps
+from app.settings import GOOGLE_ETAG_CACHE_SIZE, GOOGLE_ETAG_CACHE_DB
+
+from collections import Counter, OrderedDict
+
+import threading
+import hashlib
+import logging
+
+logger = logging.getLogger('gcal2clikup')
+
+# (etag, body) of a response
+Entry = Tuple[str, bytes]
+
+
+class ETagCache:
+    """Bounded LRU of the ETags and bodies of Google GET responses.
+
+    Cached responses are revalidated with `If-None-Match` and a 304 answer
+    is served from the cache, without transferring the body again. With
+    `persist` the entries are also kept in the `ETag` table, so every worker
+    and `runchecks` share them. `prune` keeps the `max_entries` most
+    recently stored rows there.
+    """
+    def __init__(
+        self,
+        max_entries: int = GOOGLE_ETAG_CACHE_SIZE,
+        persist: bool = GOOGLE_ETAG_CACHE_DB,
+        ):
+        self.max_entries = max_entries
+        self.persist = persist
+        self.counters = Counter()
+        self._entries: OrderedDict[str, Entry] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def model(self):
+        return apps.get_model('gcal2clickup', 'ETag')
+
+    @staticmethod
+    def key(tenant: Optional[str], uri: str) -> str:
+        # Responses are only shared by the same credentials
+        return hashlib.sha256(f'{tenant or ""} {uri}'.encode()).hexdigest()
+
+    def _remember(self, key: str, entry: Entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get(self, key: str) -> Optional[Entry]:
+        with self._lock:
+            entry = self._entries.get(key, None)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry
+        if not self.persist:
+            return None
+        try:
+            row = self.model.objects.filter(key=key).first()
+        except Exception as e:
+            # The cache must never break a sync
+            logger.error('Failed reading the ETag cache', exc_info=e)
+            return None
+        if row is None:
+            return None
+        entry = (row.etag, bytes(row.content))
+        self._remember(key, entry)
+        return entry
+
+    def put(self, key: str, etag: str, content: bytes):
+        self._remember(key, (etag, content))
+        self.counters['stored'] += 1
+        if not self.persist:
+            return
+        try:
+            self.model.objects.update_or_create(
+                key=key, defaults={'etag': etag, 'content': content}
+                )
+        except Exception as e:
+            logger.error('Failed saving the ETag cache', exc_info=e)
+
+    def hit(self):
+        self.counters['hits'] += 1
+
+    def miss(self):
+        self.counters['misses'] += 1
+
+    def prune(self) -> int:
+        # Returns the number of deleted rows
+        if not self.persist:
+            return 0
+        keep = list(
+            self.model.objects.order_by('-updated_at').values_list(
+                'key', flat=True
+                )[:self.max_entries]
+            )
+        deleted, _ = self.model.objects.exclude(key__in=keep).delete()
+        return deleted
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        if self.persist:
+            self.model.objects.all().delete()
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = len(self._entries)
+        return {'entries': entries, 'persist': self.persist, **self.counters}
+
+
+etag_cache = ETagCache()
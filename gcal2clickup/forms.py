@@ -10,7 +10,7 @@ class MatcherForm(forms.ModelForm):
         model = Matcher
         fields = [
             'user', 'calendar_id', 'clickup_list', '_tags', '_name_regex',
-            '_description_regex'
+            '_description_regex', '_lean_sync'
             ]
 
 
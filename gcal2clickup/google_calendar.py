@@ -1,80 +1,376 @@
-from typing import Tuple
-from datetime import datetime, date, timedelta
+from typing import (
+    Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+    )
+from datetime import datetime, date, timedelta, timezone
 
-from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
+from google.oauth2 import credentials
+from googleapiclient.discovery import build_from_document
+from googleapiclient.discovery_cache import get_static_doc
+from googleapiclient.errors import HttpError
+from google_auth_httplib2 import AuthorizedHttp, Request
+from gcal2clickup.retry import RetryPolicy, google_retry
+from gcal2clickup.metrics import timed
+from gcal2clickup.breaker import BreakerRegistry, breakers
+from gcal2clickup.cassette import CassetteHttp, active_cassette
+from gcal2clickup.records import event_bounds, parse_time
+from gcal2clickup.etags import ETagCache, etag_cache
+from urllib.parse import urlparse
+from functools import lru_cache
 from app import settings
 
+import threading
+import httplib2
 import logging
+import time
 
 logging.getLogger('googleapiclient.discovery_cache').setLevel(logging.WARNING)
-logger = logging.getLogger('gcal2clickup')
+logger = logging.getLogger('gcal2clikup')
+
+
+@lru_cache(maxsize=None)
+def discovery_document(service: str = 'calendar', version: str = 'v3') -> str:
+    # Read once per process from the copy bundled with googleapiclient. It is
+    # kept unparsed because building a service fills in the parsed document,
+    # so every build, possibly in another thread, parses its own copy
+    return get_static_doc(service, version)
+
+
+# GET requests revalidated with the ETag of their cached response. The
+# calendar list is synced with its sync token instead
+ETAG_METHODS = [
+    'calendar.events.get', 'calendar.calendars.get',
+    'calendar.calendarList.get'
+    ]
+
+# Event fields read by the sync, the only ones requested by `list_events`
+EVENT_FIELDS = [
+    'id', 'status', 'summary', 'description', 'start', 'end', 'created',
+    'updated', 'htmlLink'
+    ]
+# Largest page of events.list
+MAX_EVENTS_PAGE = 2500
+
+
+def is_sync_token_expired(error: Exception) -> bool:
+    # Google invalidates the sync tokens with 410 Gone
+    return getattr(getattr(error, 'resp', None), 'status', None) == 410
+
+
+class UnrequestedFieldError(Exception):
+    # Not a KeyError, so `except KeyError` or `.get` defaults do not hide it
+    pass
+
+
+class PartialEvent(dict):
+    """Event of a partial response that refuses fields it did not request.
+
+    Requested fields behave as in a dict, also when Google omitted them
+    because they are empty, but reading any other field raises
+    `UnrequestedFieldError` instead of silently missing it. The events of a
+    page share the same `fields` set.
+    """
+    __slots__ = ('fields', )
+
+    def __init__(self, event: dict, fields: Iterable[str]):
+        super().__init__(event)
+        self.fields = fields if isinstance(fields, frozenset) \
+            else frozenset(fields)
+
+    def check(self, key):
+        if key not in self.fields:
+            raise UnrequestedFieldError(
+                f'Event field "{key}" was not requested, add it to the '
+                f'fields of list_events'
+                )
+
+    def __getitem__(self, key):
+        self.check(key)
+        return super().__getitem__(key)
+
+    def __contains__(self, key):
+        self.check(key)
+        return super().__contains__(key)
+
+    def get(self, key, default=None):
+        self.check(key)
+        return super().get(key, default)
+
+
+class Credentials(credentials.Credentials):
+    # Shared by the transports of every thread, one refresh at a time. Calls
+    # `on_refresh` with the credentials after every token refresh
+    def __init__(self, *args, on_refresh: Callable = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.on_refresh = on_refresh
+        self._refresh_lock = threading.Lock()
+
+    def refresh(self, request):
+        token = self.token
+        with self._refresh_lock:
+            if self.token != token and self.valid:
+                return  # Refreshed by another thread while waiting
+            super().refresh(request)
+            if self.on_refresh is not None:
+                self.on_refresh(self)
+
+
+class BatchResult(NamedTuple):
+    response: Any
+    error: Optional[Exception]
 
 
 class GoogleCalendar:
-    def __init__(self, token, refresh_token):
-        credentials = Credentials(
+    HOST = 'www.googleapis.com'
+
+    def __init__(
+        self,
+        token,
+        refresh_token,
+        retry: RetryPolicy = google_retry,
+        tenant: str = None,
+        breakers: BreakerRegistry = breakers,
+        expiry: datetime = None,
+        on_refresh: Callable[[Credentials], Any] = None,
+        etags: Optional[ETagCache] = etag_cache,
+        ):
+        self.retry = retry
+        self.breakers = breakers
+        self.etags = etags
+        self.tenant = tenant  # Label of the API metrics
+        if expiry is not None:  # google-auth uses naive UTC datetimes
+            expiry = expiry.astimezone(timezone.utc).replace(tzinfo=None)
+        self.credentials = Credentials(
             token=token,
             refresh_token=refresh_token,
             token_uri=settings.GOOGLE_OAUTH_TOKEN_URI,
             client_id=settings.GOOGLE_OAUTH_CLIENT_ID,
-            client_secret=settings.GOOGLE_OAUTH_CLIENT_SECRET
-            )
-        self.service = build(
-            'calendar', 'v3', credentials=credentials, cache_discovery=False
+            client_secret=settings.GOOGLE_OAUTH_CLIENT_SECRET,
+            expiry=expiry,
+            on_refresh=on_refresh,
             )
+        self._service = None
+        self._local = threading.local()
+
+    def new_http(self) -> httplib2.Http:
+        cassette = active_cassette()
+        return httplib2.Http() if cassette is None else CassetteHttp(cassette)
+
+    @property
+    def http(self) -> AuthorizedHttp:
+        # httplib2 is not thread-safe, every thread sends its requests with
+        # its own connections and the shared credentials
+        http = getattr(self._local, 'http', None)
+        if http is None:
+            http = AuthorizedHttp(self.credentials, http=self.new_http())
+            self._local.http = http
+        return http
+
+    @property
+    def service(self):
+        # Built on first use, most clients of a request are never called.
+        # Requests are only built by it and sent with `http`
+        if self._service is None:
+            self._service = build_from_document(
+                discovery_document(), http=self.http
+                )
+        return self._service
 
     def __getattr__(self, name: str):
-        return getattr(self.service, name)()
+        # Resource collections such as `events` are built once per instance,
+        # later lookups find the attribute without getting here
+        if name.startswith('_') or name in ['service', 'http']:
+            raise AttributeError(name)
+        resource = getattr(self.service, name)()
+        setattr(self, name, resource)
+        return resource
+
+    def refresh_token(self):
+        # Renews the access token now instead of on the next expired call
+        with timed('google', 'POST', 'token', self.tenant):
+            self.credentials.refresh(Request(self.http.http))
+
+    def execute(self, request, idempotent: Optional[bool] = None):
+        attempts = []
+        postproc = request.postproc
+        key = cached = None
+        if self.etags is not None and request.method == 'GET' \
+            and request.methodId in ETAG_METHODS:
+            key = self.etags.key(self.tenant, request.uri)
+            cached = self.etags.get(key)
+            if cached is not None:
+                request.headers['If-None-Match'] = cached[0]
+
+        def _postproc(resp, content):
+            attempts[-1].bytes_received = len(content or b'')
+            if key is not None and resp.status == 200:
+                self.etags.miss()
+                if resp.get('etag', None):
+                    self.etags.put(key, resp['etag'], content)
+            return postproc(resp, content)
+
+        request.postproc = _postproc
+        breaker = self.breakers.get(urlparse(request.uri).netloc, self.tenant)
+
+        def send():
+            with breaker.guard(), timed(
+                'google', request.method, request.methodId, self.tenant
+                ) as t:
+                t.retry = bool(attempts)
+                attempts.append(t)
+                t.bytes_sent = len(request.body or b'')
+                try:
+                    return request.execute(http=self.http)
+                except HttpError as e:
+                    t.bytes_received = len(e.content or b'')
+                    if cached is not None and e.resp.status == 304:
+                        self.etags.hit()
+                        return postproc(
+                            httplib2.Response({'status': '200'}), cached[1]
+                            )
+                    raise e
+
+        return self.retry.call(send, request.method, idempotent=idempotent)
+
+    def execute_batch(
+        self,
+        requests: Dict[str, Any],
+        batch_size: int = settings.GOOGLE_BATCH_SIZE,
+        idempotent: Optional[bool] = None,
+        ) -> Dict[str, BatchResult]:
+        """Send requests through the batch endpoint, `batch_size` at a time.
+
+        Returns the result of every request by its key, errors are returned
+        instead of raised. Requests failing with a retryable status are sent
+        again in a later batch following the retry policy.
+        """
+        results = {}
+        pending = dict(requests)
+        started = time.monotonic()
+        retry = 0
+        while pending:
+            keys = list(pending)
+            for i in range(0, len(keys), batch_size):
+                results.update(
+                    self._execute_batch({
+                        k: pending[k]
+                        for k in keys[i:i + batch_size]
+                        })
+                    )
+            delays = {}
+            for key, request in pending.items():
+                error = results[key].error
+                if error is not None:
+                    delay = self.retry.next_delay(
+                        error, request.method, retry, started, idempotent
+                        )
+                    if delay is not None:
+                        delays[key] = delay
+            pending = {k: pending[k] for k in delays}
+            if pending:
+                time.sleep(max(delays.values()))
+                retry += 1
+        return results
+
+    def _execute_batch(
+        self, requests: Dict[str, Any]
+        ) -> Dict[str, BatchResult]:
+        results = {}
+
+        def callback(request_id, response, exception):
+            results[request_id] = BatchResult(response, exception)
+
+        batch = self.service.new_batch_http_request(callback=callback)
+        for key, request in requests.items():
+            batch.add(request, request_id=key)
+        breaker = self.breakers.get(self.HOST, self.tenant)
+        try:
+            with breaker.guard(), timed(
+                'google', 'POST', 'batch', self.tenant
+                ) as t:
+                t.bytes_sent = sum(
+                    len(r.body or b'') for r in requests.values()
+                    )
+                batch.execute(http=self.http)
+        except Exception as e:  # The whole batch failed
+            return {key: BatchResult(None, e) for key in requests}
+        return results
 
     @staticmethod
-    def event_bounds(event) -> Tuple[datetime, datetime, bool]:
-        if 'dateTime' in event['start']:
-            start = datetime.fromisoformat(
-                event['start']['dateTime'].replace('Z', '+00:00')
-                )
-            end = datetime.fromisoformat(
-                event['end']['dateTime'].replace('Z', '+00:00')
-                )
-        else:
-            start = datetime.fromisoformat(
-                event['start']['date'].replace('Z', '+00:00')
-                ).date()
-            end = datetime.fromisoformat(
-                event['end']['date'].replace('Z', '+00:00')
-                ).date()
-        return (start, end)
+    def event_bounds(event) -> Tuple[datetime, datetime]:
+        return event_bounds(event)
 
     @staticmethod
     def is_new_event(event) -> bool:
-        created = datetime.fromisoformat(
-            event['created'].replace('Z', '+00:00')
-            )
-        updated = datetime.fromisoformat(
-            event['updated'].replace('Z', '+00:00')
-            )
+        created = parse_time(event['created'])
+        updated = parse_time(event['updated'])
         return (updated - created) < timedelta(seconds=1)
 
     def list_calendars(self, **kwargs):
-        nextPageToken = True
-        while nextPageToken:
-            if isinstance(nextPageToken, str):
-                kwargs['pageToken'] = nextPageToken
-            response = self.service.calendarList().list(**kwargs).execute()
-            nextPageToken = response.get('nextPageToken', None)
-            for calendar in response['items']:
-                yield calendar
+        for page in self.list_calendars_pages(**kwargs):
+            yield from page['items']
 
-    def list_events(self, calendarId, **kwargs):
+    def list_calendars_pages(self, **kwargs):
+        # The last page has the `nextSyncToken` of the list
         nextPageToken = True
         while nextPageToken:
             if isinstance(nextPageToken, str):
                 kwargs['pageToken'] = nextPageToken
-            response = self.events.list(calendarId=calendarId,
-                                        **kwargs).execute()
+            response = self.execute(
+                self.service.calendarList().list(**kwargs)
+                )
             nextPageToken = response.get('nextPageToken', None)
-            for event in response['items']:
-                yield event
+            yield response
+
+    def list_events(
+        self,
+        calendarId,
+        fields: Optional[List[str]] = EVENT_FIELDS,
+        **kwargs,
+        ):
+        for page in self.list_events_pages(calendarId, fields, **kwargs):
+            yield from page['items']
+
+    def events_list_request(
+        self,
+        calendarId,
+        fields: Optional[List[str]] = EVENT_FIELDS,
+        **kwargs,
+        ):
+        # Only `fields` of the events are fetched, all of them when None.
+        # Responses are gzipped, googleapiclient always asks for it
+        kwargs.setdefault('maxResults', MAX_EVENTS_PAGE)
+        if fields is not None:
+            kwargs['fields'] = (
+                f'nextPageToken,nextSyncToken,items({",".join(fields)})'
+                )
+        return self.events.list(calendarId=calendarId, **kwargs)
+
+    def list_events_pages(
+        self,
+        calendarId,
+        fields: Optional[List[str]] = EVENT_FIELDS,
+        first_page: Optional[dict] = None,
+        **kwargs,
+        ):
+        # The last page holds the `nextSyncToken`. A `first_page` already
+        # fetched with the same arguments, e.g. in a batch, is not requested
+        page = first_page
+        requested = None if fields is None else frozenset(fields)
+        while True:
+            if page is None:
+                page = self.execute(
+                    self.events_list_request(calendarId, fields, **kwargs)
+                    )
+            nextPageToken = page.get('nextPageToken', None)
+            page['items'] = [
+                event if requested is None else PartialEvent(event, requested)
+                for event in page.get('items', [])
+                ]
+            yield page
+            if not nextPageToken:
+                break
+            kwargs['pageToken'] = nextPageToken
+            page = None
 
     @staticmethod
     def parse_event_time(t: datetime):
@@ -90,16 +386,20 @@ class GoogleCalendar:
         end_time: datetime,
         start_time: datetime,
         description: str = None,
+        **body,
         ):
-        return self.events.insert(
-            calendarId=calendarId,
-            body={
-                'summary': summary,
-                'end': self.parse_event_time(end_time),
-                'start': self.parse_event_time(start_time),
-                'description': description,
-                }
-            ).execute()
+        return self.execute(
+            self.events.insert(
+                calendarId=calendarId,
+                body={
+                    'summary': summary,
+                    'end': self.parse_event_time(end_time),
+                    'start': self.parse_event_time(start_time),
+                    'description': description,
+                    **body,
+                    }
+                )
+            )
 
     def update_event(
         self,
@@ -115,11 +415,13 @@ class GoogleCalendar:
             body['start'] = self.parse_event_time(start_time)
         if body:
             try:
-                return self.events.patch(
-                    calendarId=calendarId,
-                    eventId=eventId,
-                    body=body,
-                    ).execute()
+                return self.execute(
+                    self.events.patch(
+                        calendarId=calendarId,
+                        eventId=eventId,
+                        body=body,
+                        )
+                    )
             except Exception as e:
                 logger.error(calendarId)
                 logger.error(eventId)
@@ -127,12 +429,14 @@ class GoogleCalendar:
                 raise e
 
     def delete_event(self, calendarId: str, eventId: str):
-        return self.events.delete(
-            calendarId=calendarId,
-            eventId=eventId,
-            ).execute()
+        return self.execute(
+            self.events.delete(
+                calendarId=calendarId,
+                eventId=eventId,
+                )
+            )
 
-    def add_events_watch(self, calendarId, id, address, ttl=604800):
+    def events_watch_request(self, calendarId, id, address, ttl=604800):
         return self.events.watch(
             calendarId=calendarId,
             body={
@@ -143,12 +447,23 @@ class GoogleCalendar:
                     'ttl': ttl
                     }
                 }
-            ).execute()
+            )
 
-    def stop_watch(self, id, resourceId):
+    def add_events_watch(self, calendarId, id, address, ttl=604800):
+        return self.execute(
+            self.events_watch_request(calendarId, id, address, ttl=ttl)
+            )
+
+    def stop_watch_request(self, id, resourceId):
         return self.channels.stop(
             body={
                 'id': str(id),
                 'resourceId': resourceId
                 }
-            ).execute()
+            )
+
+    def stop_watch(self, id, resourceId):
+        # Stopping a channel twice has the same effect
+        return self.execute(
+            self.stop_watch_request(id, resourceId), idempotent=True
+            )
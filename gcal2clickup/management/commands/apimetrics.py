@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+
+from gcal2clickup.metrics import metrics
+from gcal2clickup.models import ApiMetric
+
+import json
+
+
+class Command(BaseCommand):
+    help = 'Show the calls, latency and payload sizes of the API endpoints'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--json', action='store_true')
+        parser.add_argument(
+            '--reset', action='store_true', help='Delete the stored metrics'
+            )
+
+    def handle(self, *args, **options):
+        rows = metrics.rows()
+        if options['json']:
+            self.stdout.write(json.dumps(rows, indent=2))
+        else:
+            self.stdout.write(
+                f'{"api":8} {"method":7} {"path":36} {"tenant":12} '
+                f'{"calls":>7} {"errors":>6} {"retries":>7} {"avg ms":>8} '
+                f'{"total s":>8} {"throttle s":>10} {"sent kB":>8} '
+                f'{"recv kB":>8}'
+                )
+            for r in rows:
+                average = r['latency'] / r['calls'] * 1000 if r['calls'] else 0
+                self.stdout.write(
+                    f'{r["api"]:8} {r["method"]:7} {r["path"]:36} '
+                    f'{r["tenant"]:12} {r["calls"]:7} {r["errors"]:6} '
+                    f'{r["retries"]:7} {average:8.1f} {r["latency"]:8.2f} '
+                    f'{r["throttled"]:10.2f} {r["bytes_sent"] / 1000:8.1f} '
+                    f'{r["bytes_received"] / 1000:8.1f}'
+                    )
+        if options['reset']:
+            ApiMetric.objects.all().delete()
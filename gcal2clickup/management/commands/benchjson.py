@@ -0,0 +1,86 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from gcal2clickup.codec import available_codecs, loads_webhook
+from gcal2clickup.codec import codec as default_codec
+
+from pathlib import Path
+
+import timeit
+import json
+
+
+def synthetic_webhook(history_items: int = 200) -> bytes:
+    # Clickup taskUpdated body with heavy history items, used when no
+    # recorded payload is given
+    user = {
+        'id': 1,
+        'username': 'user',
+        'email': 'user@example.com',
+        'color': '#000000',
+        'initials': 'U',
+        'profilePicture': 'https://example.com/' + 'x' * 64,
+        }
+    item = {
+        'id': '1',
+        'type': 1,
+        'date': '1631375377000',
+        'field': 'content',
+        'parent_id': '1',
+        'data': {},
+        'source': None,
+        'user': user,
+        'before': json.dumps({'ops': [{'insert': 'before ' * 50}]}),
+        'after': json.dumps({'ops': [{'insert': 'after ' * 50}]}),
+        }
+    return json.dumps({
+        'event': 'taskUpdated',
+        'history_items': [item] * history_items,
+        'task_id': 'abc',
+        'webhook_id': '00000000-0000-0000-0000-000000000000',
+        }).encode()
+
+
+class Command(BaseCommand):
+    help = 'Compare the installed JSON codecs on recorded payloads'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'payloads',
+            nargs='*',
+            help='Files with recorded Clickup responses or webhook bodies',
+            )
+        parser.add_argument('-n', '--number', type=int, default=200)
+
+    def handle(self, *args, **options):
+        payloads = {}
+        for path in options['payloads']:
+            try:
+                payloads[Path(path).name] = Path(path).read_bytes()
+            except OSError as e:
+                raise CommandError(str(e)) from e
+        if not payloads:
+            payloads['synthetic_webhook'] = synthetic_webhook()
+        number = options['number']
+        codecs = available_codecs()
+        codec_name = default_codec.name
+        for name, data in payloads.items():
+            self.stdout.write(f'{name} ({len(data)} bytes)')
+            for codec in codecs.values():
+                # The text step that was used before the codec layer
+                text = timeit.timeit(
+                    lambda: json.loads(data.decode()), number=number
+                    ) if codec.name == 'json' else None
+                loads = timeit.timeit(lambda: codec.loads(data), number=number)
+                line = f'  {codec.name:8} loads {loads / number * 1e6:10.1f}us'
+                if text is not None:
+                    line += f'  decode+loads {text / number * 1e6:10.1f}us'
+                self.stdout.write(line)
+            if b'history_items' in data:
+                webhook = timeit.timeit(
+                    lambda: loads_webhook(data), number=number
+                    )
+                kept = len(json.dumps(loads_webhook(data)))
+                self.stdout.write(
+                    f'  {codec_name:8} webhook {webhook / number * 1e6:8.1f}us'
+                    f' keeping {kept} of {len(data)} bytes'
+                    )
@@ -0,0 +1,151 @@
+from django.core.management.base import BaseCommand
+
+from gcal2clickup.google_calendar import (
+    GoogleCalendar, EVENT_FIELDS, PartialEvent
+    )
+from gcal2clickup.records import EventRecord
+
+from datetime import datetime, timedelta, timezone
+
+import tracemalloc
+import statistics
+import timeit
+import json
+
+
+def synthetic_page(events: int) -> bytes:
+    # events.list response of a backfill with the fields requested by the
+    # sync, half of the events updated after their creation
+    now = datetime.now(timezone.utc)
+    items = []
+    for i in range(events):
+        start = now + timedelta(hours=i)
+        created = now - timedelta(days=30)
+        items.append({
+            'id': f'event{i:06}',
+            'status': 'confirmed',
+            'summary': f'Event {i}',
+            'description': 'Description ' * 10,
+            'htmlLink': f'https://www.google.com/calendar/event?eid={i:06}',
+            'start': {'dateTime': start.isoformat()},
+            'end': {'dateTime': (start + timedelta(hours=1)).isoformat()},
+            'created': created.isoformat().replace('+00:00', 'Z'),
+            'updated': (created + timedelta(seconds=i % 2 * 60)
+                        ).isoformat().replace('+00:00', 'Z'),
+            })
+    return json.dumps({'items': items}).encode()
+
+
+def is_matched(i: int, matched: float) -> bool:
+    # Whether the i-th event is accepted by a matcher
+    return i % 100 < matched * 100
+
+
+def dict_pipeline(events, matchers: int = 3, matched: float = 1.0):
+    # Reads of the sync on the event dicts. Even events are new ones going
+    # through check_event and the matchers, the `matched` share of them
+    # through _create_task_from_event and SyncedEvent.create. Odd ones are
+    # updates of synced events
+    for i, event in enumerate(events):
+        (event['id'], event['status'])
+        if i % 2:
+            GoogleCalendar.is_new_event(event)
+        else:
+            for _ in range(matchers):
+                (event.get('summary', ''), event.get('description', None))
+            if not is_matched(i, matched):
+                continue
+            (event.get('summary', '(No title)'), event['htmlLink'])
+            if 'description' in event:
+                event['description']
+            GoogleCalendar.event_bounds(event)
+            event['id']
+        # SyncedEvent.event_values
+        GoogleCalendar.event_bounds(event)
+        (event.get('summary', '(No title)'), event.get('description', None))
+
+
+def record_pipeline(events, matchers: int = 3, matched: float = 1.0):
+    for i, event in enumerate(events):
+        event = EventRecord.from_event(event)
+        (event.id, event.status)
+        if i % 2:
+            event.is_new
+        else:
+            for _ in range(matchers):
+                (event.summary, event.description)
+            if not is_matched(i, matched):
+                continue
+            (event.name, event.html_link, event.description)
+            (event.start, event.end, event.id)
+        (event.start, event.end, event.name, event.description)
+
+
+def retained(build) -> int:
+    # Bytes still allocated by what `build` returns
+    tracemalloc.start()
+    try:
+        kept = build()
+        size, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del kept
+    return size
+
+
+class Command(BaseCommand):
+    help = 'Compare the cost per event of raw event dicts and event records'
+
+    def add_arguments(self, parser):
+        parser.add_argument('-e', '--events', type=int, default=2500)
+        parser.add_argument('-n', '--number', type=int, default=5)
+        parser.add_argument(
+            '-r', '--repeat', type=int, default=7, help='Runs of --number'
+            )
+        parser.add_argument(
+            '-m',
+            '--matched',
+            type=float,
+            default=1.0,
+            help='Share of the new events accepted by a matcher',
+            )
+
+    def handle(self, *args, **options):
+        events = options['events']
+        number = options['number']
+        repeat = options['repeat']
+        matched = options['matched']
+        page = synthetic_page(events)
+        # Shared by the events of a page as in list_events_pages
+        fields = frozenset(EVENT_FIELDS)
+        items = [PartialEvent(e, fields) for e in json.loads(page)['items']]
+        for name, pipeline in [
+            ('dicts', dict_pipeline), ('records', record_pipeline)
+            ]:
+            # Median of the runs, single runs vary more than the difference
+            seconds = statistics.median(
+                timeit.repeat(
+                    lambda: pipeline(items, matched=matched),
+                    number=number,
+                    repeat=repeat,
+                    )
+                )
+            self.stdout.write(
+                f'{name:8} parse {seconds / number / events * 1e6:8.2f}us '
+                f'per event, median of {repeat} runs'
+                )
+        dicts = retained(
+            lambda: [
+                PartialEvent(e, fields) for e in json.loads(page)['items']
+                ]
+            )
+        records = retained(
+            lambda: [
+                EventRecord.from_event(PartialEvent(e, fields))
+                for e in json.loads(page)['items']
+                ]
+            )
+        self.stdout.write(
+            f'{"dicts":8} kept {dicts / events:8.0f}B per event\n'
+            f'{"records":8} kept {records / events:8.0f}B per event'
+            )
@@ -0,0 +1,77 @@
+from django.core.management.base import BaseCommand
+
+from gcal2clickup.google_calendar import GoogleCalendar, discovery_document
+from googleapiclient.discovery import build, build_from_document
+
+from datetime import datetime, timedelta, timezone
+
+import timeit
+
+
+def sync_requests(google_calendar, events: int, collection):
+    # Requests built by a sync that patches `events` events, `collection`
+    # returns the events resource as the client looks it up
+    now = datetime.now(timezone.utc)
+    for i in range(events):
+        start = now + timedelta(hours=i)
+        end = start + timedelta(hours=1)
+        collection(google_calendar).patch(
+            calendarId='primary',
+            eventId=f'event{i}',
+            body={
+                'start': {'dateTime': start.isoformat()},
+                'end': {'dateTime': end.isoformat()},
+                },
+            )
+
+
+class Command(BaseCommand):
+    help = 'Compare building the Google service and resources per call or once'
+
+    def add_arguments(self, parser):
+        parser.add_argument('-e', '--events', type=int, default=500)
+        parser.add_argument('-n', '--number', type=int, default=5)
+
+    def handle(self, *args, **options):
+        events = options['events']
+        number = options['number']
+        google_calendar = GoogleCalendar('token', 'refresh_token')
+        # Cold start of a client, as done for every profile before
+        credentials = google_calendar.credentials
+        discovered = timeit.timeit(
+            lambda: build(
+                'calendar',
+                'v3',
+                credentials=credentials,
+                cache_discovery=False,
+                ),
+            number=number,
+            ) / number
+        discovery_document()
+        shared = timeit.timeit(
+            lambda: build_from_document(
+                discovery_document(), credentials=credentials
+                ),
+            number=number,
+            ) / number
+        self.stdout.write(
+            f'Service build: discovery {discovered * 1000:.1f}ms, shared '
+            f'document {shared * 1000:.1f}ms'
+            )
+        rebuilt = timeit.timeit(
+            lambda: sync_requests(
+                google_calendar, events, lambda g: g.service.events()
+                ),
+            number=number,
+            ) / number
+        cached = timeit.timeit(
+            lambda: sync_requests(
+                google_calendar, events, lambda g: g.events
+                ),
+            number=number,
+            ) / number
+        self.stdout.write(
+            f'{events} event patches: rebuilt {rebuilt * 1000:.1f}ms, '
+            f'cached {cached * 1000:.1f}ms '
+            f'({(rebuilt - cached) / events * 1e6:.1f}us saved per event)'
+            )
@@ -0,0 +1,79 @@
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+
+from gcal2clickup.cassette import (
+    Cassette, RECORD, REPLAY, active_cassette, use_cassette
+    )
+from gcal2clickup.sessions import clickup_sessions
+
+import statistics
+import argparse
+import time
+
+
+def add_run_arguments(parser):
+    parser.add_argument(
+        '-n', '--repeat', type=int, default=1, help='Times to run it'
+        )
+    parser.add_argument(
+        '-s',
+        '--scale',
+        type=float,
+        default=1.0,
+        help='Multiplies the recorded latencies, 0 to replay at once',
+        )
+
+
+# Reads the run options given after the command name, which are collected
+# with its arguments
+run_parser = argparse.ArgumentParser(add_help=False)
+add_run_arguments(run_parser)
+
+
+class Command(BaseCommand):
+    help = '''Run a command recording the Clickup and Google responses to a
+    cassette, or replaying them from it without network'''
+
+    def add_arguments(self, parser):
+        parser.add_argument('mode', choices=[RECORD, REPLAY])
+        parser.add_argument(
+            'path', help='Cassette file, compressed when it ends with .gz'
+            )
+        parser.add_argument('command', help='Command to run, e.g. runchecks')
+        parser.add_argument('command_args', nargs=argparse.REMAINDER)
+        add_run_arguments(parser)
+
+    def handle(self, *args, **options):
+        run, command_args = run_parser.parse_known_args(
+            options['command_args'],
+            argparse.Namespace(
+                repeat=options['repeat'], scale=options['scale']
+                ),
+            )
+        options.update(repeat=run.repeat, scale=run.scale)
+        try:
+            cassette = Cassette(
+                options['path'], options['mode'], options['scale']
+                )
+        except OSError as e:
+            raise CommandError(str(e)) from e
+        previous = active_cassette()
+        use_cassette(cassette)
+        # Sessions opened before would skip the cassette
+        clickup_sessions.close()
+        timings = []
+        try:
+            for i in range(options['repeat']):
+                cassette.rewind()
+                started = time.monotonic()
+                call_command(options['command'], *command_args)
+                timings.append(time.monotonic() - started)
+                self.stdout.write(f'Run {i + 1}: {timings[-1]:.3f}s')
+        finally:
+            use_cassette(previous)
+            clickup_sessions.close()
+        if len(timings) > 1:
+            self.stdout.write(
+                f'min {min(timings):.3f}s, median '
+                f'{statistics.median(timings):.3f}s, max {max(timings):.3f}s'
+                )
@@ -2,11 +2,27 @@ from datetime import datetime, timedelta, timezone
 from django.urls import reverse
 from django.core.management.base import BaseCommand, CommandError
 from django.contrib.auth.models import User
+from django.db import connections
+from django.db.models import QuerySet
+from typing import List, Optional
 
 from gcal2clickup.models import (
     ClickupUser, ClickupWebhook, GoogleCalendarWebhook, Matcher, SyncedEvent
     )
-from app.settings import DOMAIN
+from gcal2clickup.sessions import clickup_sessions
+from gcal2clickup.retry import clickup_retry, google_retry
+from gcal2clickup.metrics import metrics
+from gcal2clickup.breaker import breakers, CircuitOpenError
+from gcal2clickup.clickup import Clickup
+from gcal2clickup.google_calendar import GoogleCalendar
+from gcal2clickup.tokens import token_refresher
+from gcal2clickup.calendars import calendar_syncer
+from gcal2clickup.etags import etag_cache
+from app.settings import (
+    DOMAIN, GOOGLE_TOKEN_REFRESHER, GOOGLE_CHECK_WORKERS
+    )
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import logging
 
@@ -16,47 +32,145 @@ EXPIRATION_GAP = timedelta(days=1)
 END_GAP = timedelta(days=1)
 
 
+def is_available(
+    user_id: int, *hosts: str, tokens: Optional[List[str]] = None
+    ) -> bool:
+    # Users with an open circuit are skipped instead of waiting for timeouts.
+    # Clickup circuits are per token, all the ones of the user by default
+    for host in hosts:
+        if host == Clickup.HOST:
+            if tokens is None:
+                users = ClickupUser.objects.filter(user_id=user_id)
+                tokens = users.values_list('token', flat=True)
+            keys = [Clickup.circuit_key(t) for t in tokens]
+        else:
+            keys = [str(user_id)]
+        if any(breakers.is_open(host, k) for k in keys):
+            logger.warning(f'Skipping user {user_id}, {host} circuit is open')
+            return False
+    return True
+
+
+def check_events(webhooks: QuerySet):
+    # Runs in a pool thread, which closes its own database connections, also
+    # the one of the Clickup rate limit governor
+    try:
+        return webhooks.check_events()
+    finally:
+        connections.close_all()
+
+
 class Command(BaseCommand):
     def handle(self, *args, **options):
+        if GOOGLE_TOKEN_REFRESHER:
+            # Renews the tokens about to expire while the checks run
+            token_refresher.start()
         # Remove all webhooks that point to the app that are not saved
         endpoint = f'{DOMAIN}{reverse("clickup_endpoint")}'
         deleted = 0
         for cu in ClickupUser.objects.all():
-            for team in cu.api.list_teams():
-                for w in cu.api.list_webhooks(teams=[team]):
-                    if w['endpoint'] == endpoint:
-                        try:
-                            cw = ClickupWebhook.objects.get(webhook_id=w['id'])
-                            if w['health']['status'] != 'active':
-                                cw.delete()
+            if not is_available(cu.user_id, Clickup.HOST, tokens=[cu.token]):
+                continue
+            try:
+                for team in cu.api.list_teams():
+                    for w in cu.api.list_webhooks(teams=[team]):
+                        if w['endpoint'] == endpoint:
+                            try:
+                                cw = ClickupWebhook.objects.get(
+                                    webhook_id=w['id']
+                                    )
+                                if w['health']['status'] != 'active':
+                                    cw.delete()
+                                    deleted += 1
+                                elif set(w['events']) != set(
+                                    cu.api.DEFAULT_WEBHOOK_EVENTS
+                                    ):
+                                    cu.api.update_webhook(w)
+                            except ClickupWebhook.DoesNotExist:
+                                cu.api.delete_webhook(w)
                                 deleted += 1
-                        except ClickupWebhook.DoesNotExist:
-                            cu.api.delete_webhook(w)
-                            deleted += 1
-            logger.info(
-                f'Deleted {deleted} clickup webhooks from {cu.username}'
-                )
-            cu.save()
+                logger.info(
+                    f'Deleted {deleted} clickup webhooks from {cu.username}'
+                    )
+                cu.save()
+            except CircuitOpenError as e:
+                logger.warning(f'Skipped {cu}: {e}')
 
         # Refresh Google Calendar webhooks about to expire
-        refreshed = 0
-        for w in GoogleCalendarWebhook.objects.filter(
+        expiring = GoogleCalendarWebhook.objects.filter(
             expiration__lte=datetime.now(timezone.utc) + EXPIRATION_GAP
-            ):
-            w = w.refresh()
-            w.save()
-            refreshed += 1
+            )
+        users = [
+            u for u in set(expiring.values_list('user_id', flat=True))
+            if is_available(u, GoogleCalendar.HOST)
+            ]
+        refreshed = expiring.filter(user_id__in=users).refresh()
         logger.info(f'Refreshed {refreshed} google calendar webhooks')
 
+        # Store the calendar names shown by the admin and the logs from the
+        # calendar lists, synced with their changes when they are old
+        synced = calendar_syncer.sync_due()
+        logger.info(f'Synced {synced} google calendar lists')
+        renamed = GoogleCalendarWebhook.objects.all().refresh_names()
+        logger.info(f'Renamed {renamed} google calendar webhooks')
+
         # Delete not related GoogleCalendarWebhooks
-        GoogleCalendarWebhook.objects.filter(matcher=None).delete()
+        unrelated = GoogleCalendarWebhook.objects.filter(matcher=None)
+        users = [
+            u for u in set(unrelated.values_list('user_id', flat=True))
+            if is_available(u, GoogleCalendar.HOST)
+            ]
+        try:
+            unrelated.filter(user_id__in=users).delete()
+        except CircuitOpenError as e:
+            logger.warning(f'Skipped deleting unrelated webhooks: {e}')
+
+        # Check Google Calendar webhooks, the first page of events of all
+        # the calendars of a user is listed in one batch
+        users = [
+            u for u in set(
+                GoogleCalendarWebhook.objects.values_list('user_id', flat=True)
+                ) if is_available(u, GoogleCalendar.HOST, Clickup.HOST)
+            ]
+        with ThreadPoolExecutor(GOOGLE_CHECK_WORKERS) as pool:
+            futures = {
+                pool.submit(
+                    check_events,
+                    GoogleCalendarWebhook.objects.filter(user_id=u),
+                    ): u
+                for u in users
+                }
+            for future in as_completed(futures):
+                try:
+                    checked = future.result()
+                except CircuitOpenError as e:
+                    logger.warning(
+                        f'Skipped checking calendars of {futures[future]}: {e}'
+                        )
+                    continue
+                for obj, (created, updated) in checked.items():
+                    logger.info(
+                        f'''Checked {obj}: Created {created} synced events,
+                        updated {updated} existing ones'''
+                        )
 
-        # Check Google Calendar webhooks
-        for obj in GoogleCalendarWebhook.objects.all():
-            (created, updated) = obj.check_events()
+        # Catch up with Clickup task changes missed by the webhooks
+        for obj in ClickupWebhook.objects.select_related('clickup_user'):
+            if not is_available(
+                obj.clickup_user.user_id,
+                Clickup.HOST,
+                GoogleCalendar.HOST,
+                tokens=[obj.clickup_user.token],
+                ):
+                continue
+            try:
+                (created, updated) = obj.check_tasks()
+            except CircuitOpenError as e:
+                logger.warning(f'Skipped checking team {obj.team_id}: {e}')
+                continue
             logger.info(
-                f'''Checked {obj}: Created {created} synced events, updated
-                {updated} existing ones'''
+                f'''Checked tasks of {obj.team}: Created {created} synced
+                events, updated {updated} existing ones'''
                 )
 
         # ? set status of started synced events to "active"
@@ -66,7 +180,27 @@ class Command(BaseCommand):
         for e in SyncedEvent.objects.filter(
             end__lte=datetime.now(timezone.utc) - END_GAP
             ):
-            e.delete()
+            try:
+                e.delete()
+            except CircuitOpenError as error:
+                logger.warning(f'Skipped stopping {e}: {error}')
+                continue
             deleted += 1
         logger.info(f'Stopped syncing {deleted} events')
         # ? set status of finished synced events to "closed"
+
+        stats = clickup_sessions.stats()
+        logger.info(
+            f'''Clickup sent {stats['requests']} requests over
+            {stats['connections']} connections ({stats['reused']} reused)'''
+            )
+        for retry in [clickup_retry, google_retry]:
+            logger.info(f'{retry.name} retries: {retry.stats()}')
+        logger.info(f'Google ETag cache: {etag_cache.stats()}')
+        pruned = etag_cache.prune()
+        if pruned:
+            logger.info(f'Pruned {pruned} cached Google responses')
+        for stats in breakers.stats():
+            if stats['state'] != 'closed' or stats.get('outages', 0):
+                logger.warning(f'Circuit breaker: {stats}')
+        metrics.flush()
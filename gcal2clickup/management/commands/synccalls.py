@@ -0,0 +1,115 @@
+from django.core.management.base import BaseCommand
+from django.contrib.auth.models import User
+
+from admin_sso.models import Profile
+from gcal2clickup.clickup import Clickup, coalesce_comments
+from gcal2clickup.google_calendar import GoogleCalendar
+from gcal2clickup.metrics import clickup_path
+from gcal2clickup.models import (
+    ClickupUser, GoogleCalendarWebhook, Matcher, SyncedEvent,
+    SYNC_GOOGLE_CALENDAR_DESCRIPTION
+    )
+
+from datetime import datetime, timedelta, timezone
+
+START = datetime(2021, 9, 1, 10, tzinfo=timezone.utc)
+END = START + timedelta(hours=1)
+
+EVENT = {
+    'id': 'event',
+    'summary': 'Event',
+    'description': 'Event description',
+    'htmlLink': 'https://www.google.com/calendar/event?eid=event',
+    'start': {'dateTime': START.isoformat()},
+    'end': {'dateTime': END.isoformat()},
+    }
+TASK = {
+    'id': 'task',
+    'name': 'Task',
+    'description': 'Task description',
+    'url': 'https://app.clickup.com/t/task',
+    'list': {'id': 'list'},
+    'start_date': str(int(START.timestamp() * 1000)),
+    'due_date': str(int(END.timestamp() * 1000)),
+    'tags': [],
+    }
+
+
+class CountingClickup(Clickup):
+    # Answers every call with the same task instead of sending it
+    def __init__(self, calls: list):
+        super().__init__('token', tenant='report')
+        self.calls = calls
+
+    def request(self, method, url, version: int = 2, **kwargs):
+        self.calls.append(f'clickup {method} {clickup_path(self.url(url))}')
+        return TASK
+
+
+class CountingGoogleCalendar(GoogleCalendar):
+    # Answers every call with the same event instead of sending it
+    def __init__(self, calls: list):
+        super().__init__('token', 'refresh_token', tenant='report')
+        self.calls = calls
+
+    def execute(self, request, idempotent=None):
+        self.calls.append(f'google {request.method} {request.methodId}')
+        return EVENT
+
+
+def operations(matcher: Matcher):
+    synced_event = SyncedEvent(
+        matcher=matcher,
+        task_id=TASK['id'],
+        event_id=EVENT['id'],
+        start=START,
+        end=END,
+        sync_description=SYNC_GOOGLE_CALENDAR_DESCRIPTION,
+        )
+    history_items = [{'field': 'name', 'before': 'Task', 'after': 'Renamed'}]
+    return {
+        'create task from event':
+            lambda: matcher._create_task_from_event(EVENT),
+        'create event from task':
+            lambda: matcher._create_event_from_task(TASK),
+        'update task from event':
+            lambda: synced_event.update_task_from_event(EVENT),
+        'update event from task':
+            lambda: synced_event.update_event_from_task_history(history_items),
+        }
+
+
+class Command(BaseCommand):
+    help = 'Show the API calls made by each sync operation in every mode'
+
+    def handle(self, *args, **options):
+        calls = []
+        user = User(id=0, username='report')
+        profile = Profile(user=user)
+        profile._google_calendar = CountingGoogleCalendar(calls)
+        user.profile = profile
+        clickup_user = ClickupUser(id=0, user=user, token='token')
+        clickup_user._api = CountingClickup(calls)
+        webhook = GoogleCalendarWebhook(user=user, calendar_id='calendar')
+        self.stdout.write(
+            f'{"operation":24} {"mode":8} {"calls":>5}  requests'
+            )
+        totals = {}
+        for mode, lean_sync in [('verbose', False), ('lean', True)]:
+            matcher = Matcher(
+                user=user,
+                google_calendar_webhook=webhook,
+                clickup_user=clickup_user,
+                list_id=TASK['list']['id'],
+                _lean_sync=lean_sync,
+                )
+            for name, operation in operations(matcher).items():
+                calls.clear()
+                with coalesce_comments():  # As in the webhooks and runchecks
+                    operation()
+                totals[mode] = totals.get(mode, 0) + len(calls)
+                self.stdout.write(
+                    f'{name:24} {mode:8} {len(calls):5}  {", ".join(calls)}'
+                    )
+        for mode, total in totals.items():
+            self.stdout.write(f'{"total":24} {mode:8} {total:5}')
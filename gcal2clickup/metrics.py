@@ -0,0 +1,181 @@
+from typing import Dict, List, Optional, Tuple
+
+from django.apps import apps
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.core.signals import request_finished
+from app.settings import METRICS_FLUSH_INTERVAL, CLICKUP_RATE_LIMIT_DATABASE
+
+from bisect import bisect_left
+from urllib.parse import urlparse
+
+import threading
+import logging
+import time
+import re
+
+logger = logging.getLogger('gcal2clikup')
+
+# Upper bounds in seconds of the latency histogram buckets, the last bucket
+# holds the slower calls
+LATENCY_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+COUNTERS = [
+    'calls', 'errors', 'retries', 'latency', 'throttled', 'bytes_sent',
+    'bytes_received'
+    ]
+
+# (api, method, path template, tenant)
+Labels = Tuple[str, str, str, str]
+
+
+def clickup_path(url: str) -> str:
+    # task/abc123/comment -> task/{id}/comment
+    path = re.sub(r'^/api/v\d+/', '', urlparse(url).path)
+    return '/'.join(
+        '{id}' if i % 2 else segment
+        for i, segment in enumerate(path.strip('/').split('/'))
+        )
+
+
+class MetricsRegistry:
+    """Counters and latency histograms of every outbound API call.
+
+    Samples are aggregated in memory and added to the `ApiMetric` table at
+    most every `flush_interval` seconds, so the numbers of every web worker
+    and `runchecks` end up in the same place. They are saved through the
+    connection of the rate limit governor, so the row locks are never held
+    by the transaction of the caller, and kept for the next flush when they
+    cannot be saved.
+    """
+    def __init__(self, flush_interval: float = METRICS_FLUSH_INTERVAL):
+        self.flush_interval = flush_interval
+        self._pending: Dict[Labels, dict] = {}
+        self._lock = threading.Lock()
+        self._flushed_at = time.monotonic()
+
+    @staticmethod
+    def empty() -> dict:
+        sample = {c: 0 for c in COUNTERS}
+        sample['buckets'] = [0] * (len(LATENCY_BUCKETS) + 1)
+        return sample
+
+    def record(
+        self,
+        api: str,
+        method: str,
+        path: str,
+        tenant: str,
+        latency: float,
+        error: bool = False,
+        retry: bool = False,
+        throttled: float = 0.0,
+        bytes_sent: int = 0,
+        bytes_received: int = 0,
+        ):
+        labels = (api, method.upper(), path, tenant or '')
+        with self._lock:
+            sample = self._pending.setdefault(labels, self.empty())
+            sample['calls'] += 1
+            sample['errors'] += int(error)
+            sample['retries'] += int(retry)
+            sample['latency'] += latency
+            sample['throttled'] += throttled
+            sample['bytes_sent'] += bytes_sent or 0
+            sample['bytes_received'] += bytes_received or 0
+            sample['buckets'][bisect_left(LATENCY_BUCKETS, latency)] += 1
+
+    @staticmethod
+    def add(sample: dict, other: dict):
+        for c in COUNTERS:
+            sample[c] += other[c]
+        sample['buckets'] = [
+            a + b for a, b in zip(sample['buckets'], other['buckets'])
+            ]
+
+    def restore(self, pending: Dict[Labels, dict]):
+        # Puts back samples that could not be saved
+        with self._lock:
+            for labels, sample in pending.items():
+                if labels in self._pending:
+                    self.add(sample, self._pending[labels])
+                self._pending[labels] = sample
+
+    @property
+    def using(self) -> str:
+        if CLICKUP_RATE_LIMIT_DATABASE in connections.databases:
+            return CLICKUP_RATE_LIMIT_DATABASE
+        return DEFAULT_DB_ALIAS
+
+    def maybe_flush(self):
+        if time.monotonic() - self._flushed_at >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._flushed_at = time.monotonic()
+        if not pending:
+            return
+        using = self.using
+        if connections[using].in_atomic_block:
+            # Saved after the transaction of the caller instead
+            return self.restore(pending)
+        model = apps.get_model('gcal2clickup', 'ApiMetric')
+        try:
+            with transaction.atomic(using=using):
+                for (api, method, path, tenant), sample in pending.items():
+                    metric, _ = model.objects.using(using).select_for_update(
+                        ).get_or_create(
+                            api=api, method=method, path=path, tenant=tenant
+                            )
+                    metric.add(sample)
+                    metric.save()
+        except Exception as e:
+            # Metrics must never break a sync
+            logger.error('Failed saving API metrics', exc_info=e)
+            self.restore(pending)
+
+    def rows(self) -> List[dict]:
+        self.flush()
+        model = apps.get_model('gcal2clickup', 'ApiMetric')
+        return [
+            m.as_dict()
+            for m in model.objects.using(self.using).order_by('-latency')
+            ]
+
+
+metrics = MetricsRegistry()
+
+
+@request_finished.connect
+def flush_metrics(sender, **kwargs):
+    metrics.maybe_flush()
+
+
+def timed(api: str, method: str, path: str, tenant: Optional[str]):
+    return _Timer(api, method, path, tenant)
+
+
+class _Timer:
+    # Records one call: `with timed(...) as t: t.bytes_received = ...`
+    def __init__(self, api, method, path, tenant):
+        self.labels = (api, method, path, tenant)
+        self.retry = False
+        self.throttled = 0.0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    def __enter__(self):
+        self.started = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        metrics.record(
+            *self.labels,
+            latency=time.monotonic() - self.started,
+            error=exc_type is not None,
+            retry=self.retry,
+            throttled=self.throttled,
+            bytes_sent=self.bytes_sent,
+            bytes_received=self.bytes_received,
+            )
+        return False
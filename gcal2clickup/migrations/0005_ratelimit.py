@@ -0,0 +1,22 @@
+# Generated by Django 3.2.5 on 2026-10-17 21:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gcal2clickup', '0004_auto_20210909_1843'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RateLimit',
+            fields=[
+                ('key', models.CharField(help_text='SHA-256 of the Clickup token', max_length=64, primary_key=True, serialize=False)),
+                ('limit', models.PositiveIntegerField()),
+                ('remaining', models.IntegerField()),
+                ('reset', models.DateTimeField()),
+            ],
+        ),
+    ]
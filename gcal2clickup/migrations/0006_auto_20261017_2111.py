@@ -0,0 +1,35 @@
+# Generated by Django 3.2.5 on 2026-10-17 21:11
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gcal2clickup', '0005_ratelimit'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='clickupuser',
+            name='hierarchy_refreshed_at',
+            field=models.DateTimeField(editable=False, help_text='Last time that the whole workspace hierarchy has been fetched\n            from Clickup', null=True),
+        ),
+        migrations.CreateModel(
+            name='ClickupItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('team', 'Team'), ('space', 'Space'), ('folder', 'Folder'), ('list', 'List')], max_length=8)),
+                ('item_id', models.CharField(max_length=64)),
+                ('name', models.CharField(max_length=256)),
+                ('parent_id', models.CharField(help_text='Team of a space, space of a folder or folder of a list', max_length=64, null=True)),
+                ('space_id', models.CharField(max_length=64, null=True)),
+                ('hidden', models.BooleanField(default=False)),
+                ('clickup_user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='gcal2clickup.clickupuser')),
+            ],
+            options={
+                'unique_together': {('clickup_user', 'kind', 'item_id')},
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.2.5 on 2026-10-17 21:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gcal2clickup', '0006_auto_20261017_2111'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='syncedevent',
+            name='event_fingerprint',
+            field=models.CharField(blank=True, default='', editable=False, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='syncedevent',
+            name='task_fingerprint',
+            field=models.CharField(blank=True, default='', editable=False, max_length=64),
+        ),
+    ]
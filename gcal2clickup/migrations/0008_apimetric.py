@@ -0,0 +1,34 @@
+# Generated by Django 3.2.5 on 2026-10-17 21:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gcal2clickup', '0007_auto_20261017_2114'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ApiMetric',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('api', models.CharField(max_length=16)),
+                ('method', models.CharField(max_length=16)),
+                ('path', models.CharField(help_text='Path template', max_length=256)),
+                ('tenant', models.CharField(blank=True, max_length=64)),
+                ('calls', models.PositiveBigIntegerField(default=0)),
+                ('errors', models.PositiveBigIntegerField(default=0)),
+                ('retries', models.PositiveBigIntegerField(default=0)),
+                ('latency', models.FloatField(default=0, help_text='Seconds')),
+                ('latency_buckets', models.JSONField(default=list)),
+                ('throttled', models.FloatField(default=0, help_text='Seconds')),
+                ('bytes_sent', models.PositiveBigIntegerField(default=0)),
+                ('bytes_received', models.PositiveBigIntegerField(default=0)),
+            ],
+            options={
+                'unique_together': {('api', 'method', 'path', 'tenant')},
+            },
+        ),
+    ]
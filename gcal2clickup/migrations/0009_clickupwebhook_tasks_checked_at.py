@@ -0,0 +1,18 @@
+# Generated by Django 3.2.5 on 2026-10-17 21:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gcal2clickup', '0008_apimetric'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='clickupwebhook',
+            name='tasks_checked_at',
+            field=models.DateTimeField(editable=False, help_text='Last time that the tasks of the team have been checked for\n            changes missed by the webhook', null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.5 on 2026-10-17 21:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gcal2clickup', '0009_clickupwebhook_tasks_checked_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='matcher',
+            name='_lean_sync',
+            field=models.BooleanField(blank=True, choices=[(None, 'Default'), (True, 'Yes'), (False, 'No')], help_text='Link tasks and events from the task description and the event\n            source instead of posting comments, which saves API calls', null=True, verbose_name='Lean sync'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.5 on 2026-10-17 21:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gcal2clickup', '0010_matcher__lean_sync'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='googlecalendarwebhook',
+            name='sync_token',
+            field=models.TextField(editable=False, help_text='Lists the events changed since the last check', null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.5 on 2026-10-17 21:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gcal2clickup', '0011_googlecalendarwebhook_sync_token'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='googlecalendarwebhook',
+            name='calendar_name',
+            field=models.CharField(blank=True, editable=False, max_length=256),
+        ),
+    ]
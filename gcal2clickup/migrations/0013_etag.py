@@ -0,0 +1,22 @@
+# Generated by Django 3.2.5 on 2026-10-17 21:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gcal2clickup', '0012_googlecalendarwebhook_calendar_name'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ETag',
+            fields=[
+                ('key', models.CharField(help_text='SHA-256 of the credentials and the URL', max_length=64, primary_key=True, serialize=False)),
+                ('etag', models.CharField(max_length=256)),
+                ('content', models.BinaryField()),
+                ('updated_at', models.DateTimeField(auto_now=True, db_index=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.5 on 2026-10-17 21:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gcal2clickup', '0013_etag'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='clickupuser',
+            name='username',
+            field=models.CharField(blank=True, editable=False, max_length=255),
+        ),
+    ]
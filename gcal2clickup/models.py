@@ -1,4 +1,4 @@
-from typing import Set, Tuple, List, Optional, Any
+from typing import Dict, Set, Tuple, List, Optional, Any, Union
 
 from django.db import models
 from django.urls import reverse
@@ -8,15 +8,27 @@ from django.core.exceptions import ValidationError
 from django.utils.translation import ugettext_lazy as _
 from django.db.models.signals import pre_delete, post_delete
 
-from app.settings import DOMAIN, SYNCED_TASK_TAG
-from gcal2clickup.clickup import Clickup, DATE_ONLY_TIME
-from gcal2clickup.utils import make_aware_datetime
+from django.db import transaction
+from app.settings import (
+    DOMAIN, SYNCED_TASK_TAG, CLICKUP_HIERARCHY_MAX_AGE, CLICKUP_TASKS_BACKFILL,
+    LEAN_SYNC
+    )
+from gcal2clickup.clickup import (
+    Clickup, DATE_ONLY_TIME, HIERARCHY_WEBHOOK_EVENTS, coalesce_comments
+    )
+from gcal2clickup.records import EventRecord, TaskRecord
+from gcal2clickup.google_calendar import is_sync_token_expired
+from googleapiclient.errors import HttpError
+from gcal2clickup.utils import (
+    make_aware_datetime, make_fingerprint, changed_fields
+    )
 from gcal2clickup.validators import validate_is_clickup_token, validate_is_pattern
 
-from datetime import datetime, date, timezone
+from datetime import datetime, date, timezone, timedelta
 from markdownify import markdownify
 from sort_order_field import SortOrderField
 
+import threading
 import logging
 import uuid
 import pytz
@@ -24,6 +36,146 @@ import re
 
 logger = logging.getLogger('gcal2clikup')
 
+# Channels already stopped by a batch, skipped by the pre_delete signal
+_stopped_channels = threading.local()
+
+
+def is_already_stopped(error: Exception) -> bool:
+    return 'not found for project' in str(error)
+
+
+class GoogleCalendarWebhookQuerySet(models.QuerySet):
+    def by_user(self) -> Dict[int, List['GoogleCalendarWebhook']]:
+        webhooks = {}
+        for w in self.select_related('user__profile'):
+            webhooks.setdefault(w.user_id, []).append(w)
+        return webhooks
+
+    def stop_watches(self) -> Set[uuid.UUID]:
+        # Stops the channels in batches, returns the stopped channel ids
+        stopped = set()
+        for webhooks in self.by_user().values():
+            google_calendar = webhooks[0].google_calendar
+            requests = {
+                str(w.channel_id): google_calendar.stop_watch_request(
+                    id=w.channel_id, resourceId=w.resource_id
+                    )
+                for w in webhooks
+                }
+            results = google_calendar.execute_batch(requests, idempotent=True)
+            for w in webhooks:
+                error = results[str(w.channel_id)].error
+                if error is None or is_already_stopped(error):
+                    stopped.add(w.channel_id)
+                else:
+                    logger.error(
+                        f'Failed stopping channel {w.channel_id}',
+                        exc_info=error
+                        )
+        return stopped
+
+    def delete(self):
+        # Channels that failed in the batch are stopped one by one by the
+        # pre_delete signal
+        _stopped_channels.ids = self.stop_watches()
+        try:
+            return super().delete()
+        finally:
+            _stopped_channels.ids = set()
+
+    def refresh(self) -> int:
+        # Replaces the channels of the webhooks with new ones, returns the
+        # number of refreshed webhooks
+        address = f'{DOMAIN}{reverse("google_calendar_endpoint")}'
+        refreshed = 0
+        for webhooks in self.by_user().values():
+            google_calendar = webhooks[0].google_calendar
+            requests = {
+                str(w.channel_id): google_calendar.events_watch_request(
+                    calendarId=w.calendar_id, id=uuid.uuid4(), address=address
+                    )
+                for w in webhooks
+                }
+            results = google_calendar.execute_batch(requests)
+            old = []
+            for w in webhooks:
+                (response, error) = results[str(w.channel_id)]
+                if error is not None:
+                    logger.error(
+                        f'Failed refreshing {w.calendar_id}', exc_info=error
+                        )
+                    continue
+                old.append((w.channel_id, w.resource_id))
+                w.replace_channel(response)
+                refreshed += 1
+            requests = {
+                str(channel_id): google_calendar.stop_watch_request(
+                    id=channel_id, resourceId=resource_id
+                    )
+                for (channel_id, resource_id) in old
+                }
+            results = google_calendar.execute_batch(requests, idempotent=True)
+            for key, (_, error) in results.items():
+                if error is not None and not is_already_stopped(error):
+                    logger.error(
+                        f'Failed stopping channel {key}', exc_info=error
+                        )
+        return refreshed
+
+
+    def refresh_names(self) -> int:
+        # Stores the calendar names from the synced calendar list of each
+        # user, returns the number of renamed webhooks
+        renamed = []
+        for webhooks in self.by_user().values():
+            names = dict(webhooks[0].user.profile.google_calendars)
+            for w in webhooks:
+                name = names.get(w.calendar_id, w.calendar_name)
+                if name != w.calendar_name:
+                    w.calendar_name = name
+                    renamed.append(w)
+        self.model.objects.bulk_update(renamed, ['calendar_name'])
+        return len(renamed)
+
+
+    def check_events(self) -> Dict['GoogleCalendarWebhook', Tuple[int, int]]:
+        # Lists the first page of events of all the calendars of a user in
+        # one batch, only the calendars with more pages list them one by
+        # one. Returns the (created, updated) tasks of each checked webhook
+        checked = {}
+        for webhooks in self.by_user().values():
+            google_calendar = webhooks[0].google_calendar
+            queries = {w: w.events_query(w.sync_token) for w in webhooks}
+            requests = {
+                str(w.channel_id): google_calendar.events_list_request(
+                    w.calendar_id, **query
+                    )
+                for w, query in queries.items()
+                }
+            results = google_calendar.execute_batch(requests, idempotent=True)
+            for w, query in queries.items():
+                w.user = webhooks[0].user  # Same Google client
+                (response, error) = results[str(w.channel_id)]
+                if error is None:
+                    checked[w] = w.check_events(
+                        query=query, first_page=response
+                        )
+                elif w.sync_token and is_sync_token_expired(error):
+                    # Full resync of the upcoming events
+                    logger.info(f'Sync token of {w.calendar_id} expired')
+                    checked[w] = w.check_events(query=w.events_query())
+                else:
+                    logger.error(
+                        f'Failed listing the events of {w.calendar_id}',
+                        exc_info=error
+                        )
+        return checked
+
+
+class GoogleCalendarWebhookManager(models.Manager):
+    def get_queryset(self):
+        return GoogleCalendarWebhookQuerySet(self.model, using=self._db)
+
 
 class GoogleCalendarWebhook(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -41,6 +193,16 @@ class GoogleCalendarWebhook(models.Model):
             updated events'''
             ),
         )
+    sync_token = models.TextField(
+        null=True,
+        editable=False,
+        help_text='Lists the events changed since the last check',
+        )
+    calendar_name = models.CharField(
+        max_length=256, blank=True, editable=False
+        )
+
+    objects = GoogleCalendarWebhookManager()
 
     class Meta:
         unique_together = [['user', 'calendar_id']]
@@ -54,15 +216,15 @@ class GoogleCalendarWebhook(models.Model):
 
     @property
     def calendar(self) -> Tuple[str, str]:  # (id, name)
-        name = self.google_calendar.calendars.get(calendarId=self.calendar_id
-                                                  ).execute()['summary']
-        return (self.calendar_id, name)
+        # The name is stored by `runchecks`, rendering makes no API calls
+        return (self.calendar_id, self.calendar_name or self.calendar_id)
 
     @classmethod
     def create(
         cls,
         user: 'User',
         calendarId: str,
+        calendar_name: str = '',
         ) -> 'GoogleCalendarWebhook':
         response = user.profile.google_calendar.add_events_watch(
             calendarId=calendarId,
@@ -78,73 +240,123 @@ class GoogleCalendarWebhook(models.Model):
             channel_id=response['id'],
             resource_id=response['resourceId'],
             expiration=expiration,
+            calendar_name=calendar_name,
+            )
+
+    def refresh(self) -> 'GoogleCalendarWebhook':
+        type(self).objects.filter(pk=self.pk).refresh()
+        return type(self).objects.get(
+            user_id=self.user_id, calendar_id=self.calendar_id
             )
 
-    def refresh(self):
-        # Create new webhook
-        new = self.create(user=self.user, calendarId=self.calendar_id)
-        new.checked_at = self.checked_at
-        new.matcher_set = self.matcher_set
-        # Stop old webhook
-        self.delete()
-        return new
+    def replace_channel(self, response: dict):
+        # Moves the webhook and its matchers to the new watch channel. The
+        # row is updated in place, so the matchers are not deleted
+        expiration = make_aware_datetime(
+            datetime.fromtimestamp(int(response['expiration']) / 1000)
+            )
+        with transaction.atomic():
+            Matcher.objects.filter(google_calendar_webhook=self).update(
+                google_calendar_webhook_id=response['id']
+                )
+            type(self).objects.filter(pk=self.pk).update(
+                channel_id=response['id'],
+                resource_id=response['resourceId'],
+                expiration=expiration,
+                )
+        self.channel_id = uuid.UUID(response['id'])
+        self.resource_id = response['resourceId']
+        self.expiration = expiration
+
+    def events_query(self, sync_token: Optional[str] = None) -> dict:
+        # Arguments of events.list, the events changed since the last check
+        # or all the upcoming ones. Sync tokens are only valid for the query
+        # that made them
+        query = {'showDeleted': True, 'singleEvents': True}
+        if sync_token:
+            query['syncToken'] = sync_token
+        else:
+            query['timeMin'] = datetime.utcnow().isoformat('T') + 'Z'
+        return query
 
     def check_events(
         self,
         matchers: Optional[models.QuerySet['Matcher']] = None,
+        query: Optional[dict] = None,
+        first_page: Optional[dict] = None,
         ) -> Tuple[int, int]:  # (created, updated)
-        created = 0
-        updated = 0
+        # `first_page` is the response already listed with `query`
+        counts = [0, 0]
         if matchers is None:
             matchers = self.matcher_set.order_by('order')
-        # Build the query arguments
-        if not self.checked_at:
-            kwargs = {
-                'timeMin': datetime.utcnow().isoformat('T') + 'Z',
-                'singleEvents': True,
-                }
-        else:
-            kwargs = {
-                'updatedMin': self.checked_at.isoformat('T'),
-                'orderBy': 'updated',
-                }
-        kwargs['showDeleted'] = True
-        # Query events and check them individually, storing some statistics
-        for event in self.google_calendar.list_events(
-            calendarId=self.calendar_id, **kwargs
-            ):
-            _created, _updated = self.check_event(event, matchers)
-            created += _created
-            updated += _updated
+        if query is None:
+            query = self.events_query(self.sync_token)
+        try:
+            sync_token = self._check_events(
+                matchers, query, counts, first_page
+                )
+        except HttpError as e:
+            if 'syncToken' not in query or not is_sync_token_expired(e):
+                raise
+            # Full resync of the upcoming events, once
+            logger.info(f'Sync token of {self.calendar_id} expired')
+            sync_token = self._check_events(
+                matchers, self.events_query(), counts
+                )
         # Update the check time
+        self.sync_token = sync_token
         self.checked_at = datetime.now(timezone.utc)
         self.save()
-        return (created, updated)
+        return tuple(counts)
 
+    def _check_events(
+        self,
+        matchers: models.QuerySet['Matcher'],
+        query: dict,
+        counts: List[int],
+        first_page: Optional[dict] = None,
+        ) -> Optional[str]:
+        # Adds the created and updated tasks to `counts` and returns the next
+        # sync token
+        page = {}
+        for page in self.google_calendar.list_events_pages(
+            calendarId=self.calendar_id, first_page=first_page, **query
+            ):
+            # The event dicts of the page are released once parsed
+            events = [EventRecord.from_event(e) for e in page.pop('items')]
+            for event in events:
+                _created, _updated = self.check_event(event, matchers)
+                counts[0] += _created
+                counts[1] += _updated
+        return page.get('nextSyncToken', None)
+
+    @coalesce_comments()
     def check_event(
         self,
-        event: dict,
+        event: Union[dict, EventRecord],
         matchers: Optional[models.QuerySet['Matcher']] = None,
         ) -> Tuple[int, int]:  # (created, updated)
         created = 0
         updated = 0
+        event = EventRecord.of(event)
         if matchers is None:
             matchers = self.matcher_set.order_by('order')
         try:
-            synced_event = SyncedEvent.objects.get(event_id=event['id'])
+            synced_event = SyncedEvent.objects.get(event_id=event.id)
             # Delete the task from a cancelled event
-            if event['status'] == 'cancelled':
+            if event.is_cancelled:
                 # TODO if the description was changed in the task, remove
                 # TODO sync, do not delete
                 synced_event.delete(with_task=True)
             # Update the task when an event is updated, not created
-            elif not self.google_calendar.is_new_event(event):
-                synced_event.update_task_from_event(event)
-                synced_event.save()
-                updated += 1
+            elif not event.is_new:
+                # Skip events where no synced field changed
+                if synced_event.update_task_from_event(event) is not None:
+                    synced_event.save()
+                    updated += 1
         except SyncedEvent.DoesNotExist:
             # Create a new synced event on confirmed events that match
-            if event['status'] != 'cancelled':
+            if not event.is_cancelled:
                 match, matcher = matchers.match(event=event)
                 if match:
                     SyncedEvent.create(matcher, match, event=event).save()
@@ -154,13 +366,15 @@ class GoogleCalendarWebhook(models.Model):
 
 @receiver(pre_delete, sender=GoogleCalendarWebhook)
 def stop_google_calendar_webhook(sender, instance, **kwargs):
+    if instance.channel_id in getattr(_stopped_channels, 'ids', set()):
+        return
     try:
         instance.user.profile.google_calendar.stop_watch(
             id=instance.channel_id, resourceId=instance.resource_id
             )
     except Exception as e:
         # Avoid errors when the webhook is already deleted
-        if 'not found for project' not in str(e):
+        if not is_already_stopped(e):
             raise e
 
 
@@ -170,18 +384,23 @@ class ClickupWebhook(models.Model):
         )
     clickup_user = models.ForeignKey('ClickupUser', on_delete=models.CASCADE)
     team_id = models.PositiveIntegerField()
+    tasks_checked_at = models.DateTimeField(
+        null=True,
+        editable=False,
+        help_text=(
+            '''Last time that the tasks of the team have been checked for
+            changes missed by the webhook'''
+            ),
+        )
     _team = None
 
     @property
     def team(self):
         if self._team is None:
-            for team in self.clickup_user.api.list_teams():
-                if int(team['id']) == self.team_id:
-                    self._team = team['name']
-                    break
-            else:
-                self.delete()
-                return 'Deleted! Please refresh'
+            team = self.clickup_user.clickupitem_set.filter(
+                kind=ClickupItem.TEAM, item_id=str(self.team_id)
+                ).first()
+            self._team = team.name if team else str(self.team_id)
         return self._team
 
     @classmethod
@@ -205,6 +424,44 @@ class ClickupWebhook(models.Model):
     def check_task(self, task_id: str):
         return self.clickup_user.check_task(task_id)
 
+    @property
+    def list_ids(self) -> List[str]:
+        # Lists of this team that are associated to a calendar
+        items = self.clickup_user.clickupitem_set
+        spaces = items.filter(
+            kind=ClickupItem.SPACE, parent_id=str(self.team_id)
+            ).values_list('item_id', flat=True)
+        return sorted(
+            items.filter(
+                kind=ClickupItem.LIST,
+                space_id__in=list(spaces),
+                item_id__in=self.clickup_user.matcher_set.values_list(
+                    'list_id', flat=True
+                    ),
+                ).values_list('item_id', flat=True)
+            )
+
+    def check_tasks(self) -> Tuple[int, int]:
+        # Catches up with the task changes since the last check in bulk
+        created = updated = 0
+        checked_at = datetime.now(timezone.utc)
+        list_ids = self.list_ids
+        if list_ids:
+            updated_after = self.tasks_checked_at or checked_at - timedelta(
+                seconds=CLICKUP_TASKS_BACKFILL
+                )
+            for task in self.clickup_user.api.list_team_tasks(
+                self.team_id, list_ids=list_ids, updated_after=updated_after
+                ):
+                (_created, _updated) = self.clickup_user.check_task_update(
+                    task
+                    )
+                created += _created
+                updated += _updated
+        self.tasks_checked_at = checked_at
+        self.save()
+        return (created, updated)
+
     @staticmethod
     def is_sync_tag_added(history_items: list) -> bool:
         for i in history_items:
@@ -249,33 +506,122 @@ class ClickupUser(models.Model):
             href=https://docs.clickup.com/en/articles/1367130-getting-started-with-the-clickup-api#personal-api-key>
             how to find the personal API key</a>''',
         )
+    # Stored with the hierarchy, so that rendering it needs no API calls
+    username = models.CharField(max_length=255, blank=True, editable=False)
+    hierarchy_refreshed_at = models.DateTimeField(
+        null=True,
+        editable=False,
+        help_text=(
+            '''Last time that the whole workspace hierarchy has been fetched
+            from Clickup'''
+            ),
+        )
     objects = ClickupUserManager()
     _api = None
-    _username = None
 
     def __str__(self):
-        return self.username
+        return self.username or str(self.id)
 
     @property
     def api(self):
         if self._api is None:
-            self._api = Clickup(token=self.token)
+            self._api = Clickup(token=self.token, tenant=str(self.user_id))
         return self._api
 
-    @property
-    def username(self):
-        if self._username is None:
-            self._username = self.api.user['username']
-        return self._username
-
     @property
     def list_choices(
             self
         ) -> List[Tuple[str, str]]:  # ("cu_pk,list_id", "name")
+        if self.hierarchy_refreshed_at is None or not self.username:
+            self.refresh_hierarchy()
+        items = {(i.kind, i.item_id): i for i in self.clickupitem_set.all()}
         return [(
-            str(self.pk) + ',' + l['id'],
-            self.username + ': ' + self.api.repr_list(l)
-            ) for l in self.api.list_lists()]
+            str(self.pk) + ',' + i.item_id,
+            self.username + ': ' + Clickup.repr_list(i.as_list(items))
+            ) for i in items.values() if i.kind == ClickupItem.LIST]
+
+    def repr_list(self, list_id: str) -> str:
+        items = self.clickupitem_set.all()
+        try:
+            _list = items.get(kind=ClickupItem.LIST, item_id=list_id)
+        except ClickupItem.DoesNotExist:
+            return list_id
+        parents = {(i.kind, i.item_id): i
+                   for i in items.filter(
+                       item_id__in=[_list.parent_id, _list.space_id]
+                       )}
+        return Clickup.repr_list(_list.as_list(parents))
+
+    @property
+    def is_hierarchy_stale(self) -> bool:
+        return self.hierarchy_refreshed_at is None or (
+            datetime.now(timezone.utc) - self.hierarchy_refreshed_at >
+            timedelta(seconds=CLICKUP_HIERARCHY_MAX_AGE)
+            )
+
+    def refresh_hierarchy(self):
+        hierarchy = self.api.hierarchy()
+        username = self.api.user['username']
+        items = [
+            ClickupItem.from_clickup(self, kind, data)
+            for kind in ClickupItem.KINDS
+            for data in hierarchy[kind + 's']
+            ]
+        # Folderless lists belong to a hidden folder that is not listed
+        items += [
+            ClickupItem.from_clickup(
+                self, ClickupItem.FOLDER, dict(l['folder'], space=l['space'])
+                ) for l in hierarchy['lists'] if l['folder'].get('hidden')
+            ]
+        with transaction.atomic():
+            self.clickupitem_set.all().delete()
+            ClickupItem.objects.bulk_create(items, ignore_conflicts=True)
+            self.hierarchy_refreshed_at = datetime.now(timezone.utc)
+            self.username = username
+            super().save(update_fields=['hierarchy_refreshed_at', 'username'])
+
+    def apply_hierarchy_event(self, body: dict, team_id: str):
+        # Apply a space, folder or list webhook event to the stored hierarchy
+        event = body['event']
+        kind = ClickupItem.event_kind(event)
+        item_id = str(body[f'{kind}_id'])
+        if event.endswith('Deleted'):
+            # With the folders and lists it contains, ids are only unique
+            # within a kind
+            deleted = models.Q(kind=kind, item_id=item_id)
+            if kind == ClickupItem.SPACE:
+                deleted |= models.Q(
+                    kind__in=[ClickupItem.FOLDER, ClickupItem.LIST],
+                    space_id=item_id,
+                    )
+            elif kind == ClickupItem.FOLDER:
+                deleted |= models.Q(kind=ClickupItem.LIST, parent_id=item_id)
+            self.clickupitem_set.filter(deleted).delete()
+            return
+        data = self.api.get(f'{kind}/{item_id}')
+        if kind == ClickupItem.SPACE:
+            data['team'] = {'id': team_id}
+        items = [ClickupItem.from_clickup(self, kind, data)]
+        if kind == ClickupItem.LIST and data['folder'].get('hidden'):
+            items.append(
+                ClickupItem.from_clickup(
+                    self,
+                    ClickupItem.FOLDER,
+                    dict(data['folder'], space=data['space']),
+                    )
+                )
+        for item in items:
+            ClickupItem.objects.update_or_create(
+                clickup_user=self,
+                kind=item.kind,
+                item_id=item.item_id,
+                defaults={
+                    'name': item.name,
+                    'parent_id': item.parent_id,
+                    'space_id': item.space_id,
+                    'hidden': item.hidden,
+                    },
+                )
 
     def create_webhook(self, team: dict, endpoint: str = None):
         return ClickupWebhook.create(
@@ -302,15 +648,20 @@ class ClickupUser(models.Model):
             webhook.delete()
         return created
 
-    def check_task(self, task_id: str) -> bool:
-        task = self.api.get(f'task/{task_id}')
+    @coalesce_comments()
+    def check_task(
+        self, task_id: str, task: Union[dict, TaskRecord] = None
+        ) -> bool:
+        if task is None:
+            task = self.api.get(f'task/{task_id}')
+        task = TaskRecord.of(task)
         # Is task valid?
-        if not SYNCED_TASK_TAG in [t['name'] for t in task.get('tags', [])]:
+        if not SYNCED_TASK_TAG in task.tags:
             return False
-        if not task.get('due_date', None):
+        if not task.due_date:
             self.api.task_logger(
                 'Due date must not be empty for calendar synchronization',
-                task_id=task['id'],
+                task_id=task.id,
                 )
             self.remove_sync_tag(task_id)
             return False
@@ -320,18 +671,37 @@ class ClickupUser(models.Model):
             return True
         self.api.task_logger(
             'List is not associated to any calendar',
-            task_id=task['id'],
+            task_id=task.id,
             )
         self.remove_sync_tag(task_id)
         return False
 
+    @coalesce_comments()
+    def check_task_update(self, task: dict) -> Tuple[int, int]:
+        # Applies a task from the changed tasks feed, returns the number of
+        # (created, updated) synced events
+        task = TaskRecord.from_task(task)
+        try:
+            synced_event = SyncedEvent.objects.get(task_id=task.id)
+        except SyncedEvent.DoesNotExist:
+            return (int(self.check_task(task.id, task=task)), 0)
+        if synced_event.update_event_from_task(task):
+            synced_event.save()
+            return (0, 1)
+        return (0, 0)
+
     def save(self, *args, **kwargs):
-        # Add the clickup user id
-        self.id = self.api.user['id']
+        # Add the clickup user id and name
+        user = self.api.user
+        self.id = user['id']
+        self.username = user['username']
         super().save(*args, **kwargs)
         # Check webhooks
         created = self.check_webhooks()
         logger.info(f'Created {created} clickup webhooks for {self.username}')
+        # Full refresh of the hierarchy, webhooks keep it updated meanwhile
+        if self.is_hierarchy_stale:
+            self.refresh_hierarchy()
         # Enforce permissions check by saving the user
         self.user.save()
 
@@ -341,8 +711,159 @@ def refresh_user(sender, instance, **kwargs):
     instance.user.save()
 
 
+class ClickupItem(models.Model):
+    # Stored Clickup hierarchy of a user, so it can be read without API calls
+    TEAM = 'team'
+    SPACE = 'space'
+    FOLDER = 'folder'
+    LIST = 'list'
+    KINDS = [TEAM, SPACE, FOLDER, LIST]
+
+    clickup_user = models.ForeignKey(ClickupUser, on_delete=models.CASCADE)
+    kind = models.CharField(
+        max_length=8, choices=[(k, k.capitalize()) for k in KINDS]
+        )
+    item_id = models.CharField(max_length=64)
+    name = models.CharField(max_length=256)
+    parent_id = models.CharField(
+        max_length=64,
+        null=True,
+        help_text='Team of a space, space of a folder or folder of a list',
+        )
+    space_id = models.CharField(max_length=64, null=True)
+    hidden = models.BooleanField(default=False)
+
+    class Meta:
+        unique_together = [['clickup_user', 'kind', 'item_id']]
+
+    def __str__(self):
+        return self.name
+
+    @classmethod
+    def event_kind(cls, event: str) -> Optional[str]:
+        for kind in [cls.SPACE, cls.FOLDER, cls.LIST]:
+            if event.startswith(kind) and event in HIERARCHY_WEBHOOK_EVENTS:
+                return kind
+        return None
+
+    @classmethod
+    def from_clickup(
+        cls,
+        clickup_user: ClickupUser,
+        kind: str,
+        data: dict,
+        ) -> 'ClickupItem':
+        parent_id = None
+        space_id = None
+        if kind == cls.SPACE:
+            parent_id = data['team']['id']
+        elif kind == cls.FOLDER and 'space' in data:
+            parent_id = space_id = data['space']['id']
+        elif kind == cls.LIST:
+            parent_id = data['folder']['id']
+            space_id = data['space']['id']
+        return cls(
+            clickup_user=clickup_user,
+            kind=kind,
+            item_id=str(data['id']),
+            name=data['name'],
+            parent_id=parent_id and str(parent_id),
+            space_id=space_id and str(space_id),
+            hidden=data.get('hidden', False),
+            )
+
+    def as_list(self, items: dict) -> dict:
+        # Rebuild the list fields used by Clickup.repr_list from
+        # {(kind, item_id): ClickupItem}
+        folder = items.get((self.FOLDER, self.parent_id), None)
+        space = items.get((self.SPACE, self.space_id), None)
+        return {
+            'id': self.item_id,
+            'name': self.name,
+            'folder': {
+                'name': folder.name if folder else '',
+                'hidden': folder.hidden if folder else True,
+                },
+            'space': {'name': space.name if space else ''},
+            }
+
+
+class ApiMetric(models.Model):
+    # Aggregated samples of gcal2clickup.metrics.MetricsRegistry
+    api = models.CharField(max_length=16)
+    method = models.CharField(max_length=16)
+    path = models.CharField(max_length=256, help_text='Path template')
+    tenant = models.CharField(max_length=64, blank=True)
+    calls = models.PositiveBigIntegerField(default=0)
+    errors = models.PositiveBigIntegerField(default=0)
+    retries = models.PositiveBigIntegerField(default=0)
+    latency = models.FloatField(default=0, help_text='Seconds')
+    latency_buckets = models.JSONField(default=list)
+    throttled = models.FloatField(default=0, help_text='Seconds')
+    bytes_sent = models.PositiveBigIntegerField(default=0)
+    bytes_received = models.PositiveBigIntegerField(default=0)
+
+    class Meta:
+        unique_together = [['api', 'method', 'path', 'tenant']]
+
+    def add(self, sample: dict):
+        for field in [
+            'calls', 'errors', 'retries', 'latency', 'throttled',
+            'bytes_sent', 'bytes_received'
+            ]:
+            setattr(self, field, getattr(self, field) + sample[field])
+        buckets = self.latency_buckets or [0] * len(sample['buckets'])
+        self.latency_buckets = [a + b for a, b in zip(buckets,
+                                                      sample['buckets'])]
+
+    def as_dict(self) -> dict:
+        return {
+            'api': self.api,
+            'method': self.method,
+            'path': self.path,
+            'tenant': self.tenant,
+            'calls': self.calls,
+            'errors': self.errors,
+            'retries': self.retries,
+            'latency': self.latency,
+            'latency_buckets': self.latency_buckets,
+            'throttled': self.throttled,
+            'bytes_sent': self.bytes_sent,
+            'bytes_received': self.bytes_received,
+            }
+
+
+class RateLimit(models.Model):
+    # Shared state of gcal2clickup.ratelimit.RateLimitGovernor
+    key = models.CharField(
+        max_length=64,
+        primary_key=True,
+        help_text='SHA-256 of the Clickup token',
+        )
+    limit = models.PositiveIntegerField()
+    remaining = models.IntegerField()
+    reset = models.DateTimeField()
+
+
+class ETag(models.Model):
+    # Shared entries of gcal2clickup.etags.ETagCache
+    key = models.CharField(
+        max_length=64,
+        primary_key=True,
+        help_text='SHA-256 of the credentials and the URL',
+        )
+    etag = models.CharField(max_length=256)
+    content = models.BinaryField()
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+
 class MatcherQuerySet(models.QuerySet):
-    def match(self, **kwargs) -> Tuple[re.Match, 'Matcher']:
+    def match(self, *, event=None, task=None) -> Tuple[re.Match, 'Matcher']:
+        # Parsed once for all the matchers
+        kwargs = {
+            'event': EventRecord.of(event) if event else None,
+            'task': TaskRecord.of(task) if task else None,
+            }
         for matcher in self:
             match = matcher.match(**kwargs)
             if match:
@@ -400,6 +921,16 @@ class Matcher(models.Model):
             clickup task'''
             ),
         )
+    _lean_sync = models.BooleanField(
+        null=True,
+        blank=True,
+        choices=[(None, 'Default'), (True, 'Yes'), (False, 'No')],
+        verbose_name='Lean sync',
+        help_text=(
+            '''Link tasks and events from the task description and the event
+            source instead of posting comments, which saves API calls'''
+            ),
+        )
     order = SortOrderField(_("Order"))
     objects = MatcherManager()
 
@@ -418,6 +949,7 @@ class Matcher(models.Model):
     def save(self, *args, **kwargs):
         # Reset the checks when modified
         self.google_calendar_webhook.checked_at = None
+        self.google_calendar_webhook.sync_token = None
         self.google_calendar_webhook.save()
         super().save(*args, **kwargs)
 
@@ -429,6 +961,10 @@ class Matcher(models.Model):
     def name_regex(self):
         return re.compile(self._name_regex) if self._name_regex else None
 
+    @property
+    def lean_sync(self) -> bool:
+        return LEAN_SYNC if self._lean_sync is None else self._lean_sync
+
     @property
     def calendar_id(self):
         return self.google_calendar_webhook.calendar_id
@@ -439,10 +975,7 @@ class Matcher(models.Model):
 
     @property
     def clickup_list(self) -> Tuple[str, str]:  # (id, name)
-        name = Clickup.repr_list(
-            self.clickup_user.api.get(f'list/{self.list_id}')
-            )
-        return (self.list_id, name)
+        return (self.list_id, self.clickup_user.repr_list(self.list_id))
 
     @property
     def description_regex(self):
@@ -456,51 +989,72 @@ class Matcher(models.Model):
     def comment_task(self, task_id: str, **data):
         return self.clickup_user.api.comment_task(task_id=task_id, **data)
 
-    def match(self, *, event: dict = None, task: dict = None) -> re.Match:
+    def match(
+        self,
+        *,
+        event: Union[dict, EventRecord] = None,
+        task: Union[dict, TaskRecord] = None,
+        ) -> re.Match:
         if event and task is None:
-            return self._match_event(event)
+            return self._match_event(EventRecord.of(event))
         elif task and event is None:
-            return self._match_task(task)
+            return self._match_task(TaskRecord.of(task))
         raise AttributeError(
             f'''Either "event" or "task" must be a non empty dictionary.
             event={event}
             task={task}'''
             )
 
-    def _match_event(self, event: dict) -> re.Match:
+    def _match_event(self, event: EventRecord) -> re.Match:
         match = None
-        name = event.get('summary', '')
+        name = event.summary
         if name and self.name_regex:
             match = self.name_regex.search(name)
         if not match:
-            description = event.get('description', None)
+            description = event.description
             if description and self.description_regex:
                 match = self.description_regex.search(description)
         return match
 
-    def _match_task(self, task: dict) -> bool:
-        return task.get('list', {}).get('id', None) == self.list_id
+    def _match_task(self, task: TaskRecord) -> bool:
+        return task.list_id == self.list_id
 
     def _create_task(self, **data):
         return self.clickup_user.api.create_task(list_id=self.list_id, **data)
 
+    def task_description(
+        self, event: Union[dict, EventRecord]
+        ) -> Optional[str]:
+        # Markdown description of the task synced with the event
+        event = EventRecord.of(event)
+        description = None
+        if event.description is not None:
+            description = markdownify(event.description)
+        if self.lean_sync:  # The link replaces the comment
+            link = f'[Google Calendar event]({event.html_link})'
+            description = f'{description}\n\n{link}' if description else link
+        return description
+
     def _create_task_from_event(
         self,
-        event: dict,
+        event: Union[dict, EventRecord],
         match: re.Match = None,
         ) -> Tuple[dict, datetime, datetime]:
+        event = EventRecord.of(event)
         data = {
             'assignees': [self.clickup_user.id],
-            'name': event.get('summary', '(No title)'),
+            'name': event.name,
             'tags': [SYNCED_TASK_TAG] + self.tags,
             }
-        if 'description' in event:
-            data['markdown_description'] = markdownify(event['description'])
-        (start_date, due_date) = \
-            self.user.profile.google_calendar.event_bounds(event)
+        description = self.task_description(event)
+        if description is not None:
+            data['markdown_description'] = description
+        (start_date, due_date) = (event.start, event.end)
         task = self._create_task(
             start_date=start_date, due_date=due_date, **data
             )
+        if self.lean_sync:
+            return (task, start_date, due_date)
         self.comment_task(
             task_id=task['id'],
             comment=[
@@ -511,7 +1065,7 @@ class Matcher(models.Model):
                 {
                     'text': data['name'],
                     'attributes': {
-                        'link': event['htmlLink']
+                        'link': event.html_link
                         }
                     },
                 ]
@@ -531,27 +1085,22 @@ class Matcher(models.Model):
 
     def _create_event_from_task(
         self,
-        task: dict,
+        task: Union[dict, TaskRecord],
         match: re.Match = None,
         ) -> Tuple[dict, datetime, datetime]:
         # Tasks must have due_date to be valid
-        end_time = datetime.fromtimestamp(int(task['due_date']) / 1000)
-        end_time = pytz.utc.localize(end_time)
-        if end_time.time() == DATE_ONLY_TIME:  # Recognize whole day due dates
-            end_time = end_time.date()
-        if not task.get('start_date', None):  # Start date is not mandatory
-            start_time = end_time
-        else:
-            start_time = datetime.fromtimestamp(int(task['start_date']) / 1000)
-            start_time = pytz.utc.localize(start_time)
-            if type(end_time) == date:  # Start must be the same format as end
-                start_time = start_time.date()
-            elif end_time == start_time:  # Recognize whole day dates
-                end_time = end_time.date()
-                start_time = start_time.date()
-        data = {'summary': task['name']}
-        if task['description']:
-            data['description'] = task['description']
+        task = TaskRecord.of(task)
+        (start_time, end_time) = (task.start, task.end)
+        data = {'summary': task.name}
+        if task.description:
+            data['description'] = task.description
+        if self.lean_sync:  # Link the task from the event instead of comment
+            data['source'] = {'title': task.name, 'url': task.url}
+            data['extendedProperties'] = {
+                'private': {
+                    'clickupTaskId': task.id
+                    }
+                }
         try:
             event = self._create_event(
                 end_time=end_time,
@@ -561,18 +1110,24 @@ class Matcher(models.Model):
         except Exception as e:
             self.task_logger(
                 f'Could not create calendar event from task: ' + str(e),
-                task_id=task['id'],
+                task_id=task.id,
                 )
             raise e
+        if self.lean_sync:
+            return (
+                event,
+                task.start_at,
+                task.end_at,
+                )
         self.comment_task(
-            task_id=task['id'],
+            task_id=task.id,
             comment=[
                 {
                     'text': 'Created calendar event ',
                     'attributes': {}
                     },
                 {
-                    'text': task['name'],
+                    'text': task.name,
                     'attributes': {
                         'link': event['htmlLink']
                         }
@@ -585,8 +1140,8 @@ class Matcher(models.Model):
             )
         return (
             event,
-            make_aware_datetime(start_time),
-            make_aware_datetime(end_time),
+            task.start_at,
+            task.end_at,
             )
 
     def _delete_event(self, event_id: str):
@@ -616,13 +1171,23 @@ class SyncedEvent(models.Model):
             (SYNC_CLICKUP_DESCRIPTION, 'Clickup -> Google Calendar')
             ]
         )
+    # Hashes of the last synced name, description, start and end of each side
+    event_fingerprint = models.CharField(
+        max_length=64, blank=True, default='', editable=False
+        )
+    task_fingerprint = models.CharField(
+        max_length=64, blank=True, default='', editable=False
+        )
 
     @property
     def event(self):
-        return self.matcher.user.profile.google_calendar.events.get(
-            calendarId=self.matcher.calendar_id,
-            eventId=self.event_id,
-            ).execute()
+        google_calendar = self.matcher.user.profile.google_calendar
+        return google_calendar.execute(
+            google_calendar.events.get(
+                calendarId=self.matcher.calendar_id,
+                eventId=self.event_id,
+                )
+            )
 
     @property
     def task(self):
@@ -643,43 +1208,76 @@ class SyncedEvent(models.Model):
             task_id=self.task_id, **data
             )
 
-    def update_task_from_event(self, event: dict = None) -> dict:
-        if event is None:
-            event = self.event
-        name = event.get('summary', '(No title)')
-        self.comment_task(
-            comment=[
-                {
-                    'text': 'Updating task from changed event ',
-                    'attributes': {}
-                    },
-                {
-                    'text': f'{name}',
-                    'attributes': {
-                        'link': event['htmlLink']
-                        }
-                    },
-                ]
-            )
-        data = {'name': name}
-        if self.sync_description is SYNC_GOOGLE_CALENDAR_DESCRIPTION:
-            if 'description' in event:
-                data['markdown_description'] = markdownify(
-                    event['description']
+    @staticmethod
+    def event_values(event: Union[dict, EventRecord]) -> dict:
+        event = EventRecord.of(event)
+        return {
+            'name': event.name,
+            'description': event.description,
+            'start': event.start,
+            'end': event.end,
+            }
+
+    @staticmethod
+    def task_values(task: Union[dict, TaskRecord]) -> dict:
+        task = TaskRecord.of(task)
+        return {
+            'name': task.name,
+            'description': task.description,
+            'start': task.start_date,
+            'end': task.due_date,
+            }
+
+    def update_task_from_event(
+        self, event: Union[dict, EventRecord] = None
+        ) -> Optional[dict]:
+        # Returns None when the synced fields of the event did not change
+        event = EventRecord.of(self.event if event is None else event)
+        values = self.event_values(event)
+        changed = changed_fields(self.event_fingerprint, **values)
+        if not changed:
+            return None
+        self.event_fingerprint = make_fingerprint(**values)
+        name = values['name']
+        data = {}
+        if 'name' in changed:
+            data['name'] = name
+        if 'description' in changed:
+            if self.sync_description is SYNC_GOOGLE_CALENDAR_DESCRIPTION:
+                description = self.matcher.task_description(event)
+                if description is not None:
+                    data['markdown_description'] = description
+            elif self.sync_description is not None:
+                self.task_logger(
+                    'Description will not be synced to google calendar anymore'
                     )
-        elif self.sync_description is not None:
-            self.task_logger(
-                'Description will not be synced to google calendar anymore'
+                self.sync_description = None
+        (start_date, due_date) = (values['start'], values['end'])
+        if 'start' in changed:
+            data['start_date'] = start_date
+        if 'end' in changed:
+            data['due_date'] = due_date
+        self.start = event.start_at
+        self.end = event.end_at
+        if not data:
+            return {}
+        if not self.matcher.lean_sync:
+            self.comment_task(
+                comment=[
+                    {
+                        'text': 'Updating task from changed event ',
+                        'attributes': {}
+                        },
+                    {
+                        'text': f'{name}',
+                        'attributes': {
+                            'link': event.html_link
+                            }
+                        },
+                    ]
                 )
-            self.sync_description = None
-        (start_date, due_date) = \
-            self.matcher.user.profile.google_calendar.event_bounds(event)
-        # TODO check if dates have been changed before updating them
-        task = self.update_task(
-            start_date=start_date, due_date=due_date, **data
-            )
-        self.start = make_aware_datetime(start_date)
-        self.end = make_aware_datetime(due_date)
+        task = self.update_task(**data)
+        self.task_fingerprint = make_fingerprint(**self.task_values(task))
         return task
 
     def update_event(self, **data):
@@ -689,22 +1287,62 @@ class SyncedEvent(models.Model):
             **data,
             )
 
-    def update_event_from_task_history(self, history_items: list):
+    def update_event_from_task(self, task: Union[dict, TaskRecord]):
+        # Same as the webhook update but from the current task, used when its
+        # history is not available
+        task = TaskRecord.of(task)
+        tags = [{'name': t} for t in task.tags]
+        history_items = [
+            {'field': 'tag_removed', 'after': tags},
+            {'field': 'name', 'after': task.name},
+            {'field': 'content', 'after': task.description},
+            ]
+        for field in ['start_date', 'due_date']:
+            _date = getattr(task, field)
+            # Tasks do not tell whether the date has time, dates without it
+            # are stored at DATE_ONLY_TIME
+            has_time = _date is not None and datetime.fromtimestamp(
+                int(_date) / 1000, timezone.utc
+                ).time() != DATE_ONLY_TIME
+            history_items.append({
+                'field': field,
+                'after': _date,
+                'data': {f'{field}_time': has_time},
+                })
+        return self.update_event_from_task_history(history_items, task=task)
+
+    def update_event_from_task_history(
+        self, history_items: list, task: Union[dict, TaskRecord] = None
+        ):
+        # Returns a falsy value when there is nothing to save
+        before = (self.task_fingerprint, self.sync_description)
         data = {}
+        values = {}  # New values of the task synced fields
         # Iterate accross changes
         for i in history_items:
-            # Avoid circular updates
-            if i.get('after', None) == i.get('before', None):
+            # Avoid circular updates. Items built from the current task have
+            # no 'before', their removed dates must not be skipped
+            if 'before' in i and i.get('after', None) == i['before']:
                 continue
             field = i['field']
             # Handle name changes
             if field == 'name':
-                data['summary'] = i['after']
+                values['name'] = i['after']
+                if changed_fields(self.task_fingerprint, name=i['after']):
+                    data['summary'] = i['after']
             # Handle description changes
             elif field == 'content':
+                if self.sync_description is None:
+                    continue
+                description = TaskRecord.of(task or self.task).description
+                values['description'] = description
+                if not changed_fields(
+                    self.task_fingerprint, description=description
+                    ):
+                    continue
                 if self.sync_description is SYNC_CLICKUP_DESCRIPTION:
-                    data['description'] = self.task['description']
-                elif self.sync_description is not None:
+                    data['description'] = description
+                else:
                     self.task_logger(
                         '''Description will not be synced from google calendar
                         anymore'''
@@ -712,6 +1350,12 @@ class SyncedEvent(models.Model):
                     self.sync_description = None
             # Handle date changes
             elif field in ['due_date', 'start_date']:
+                key = 'end' if field == 'due_date' else 'start'
+                values[key] = i['after']
+                if not changed_fields(
+                    self.task_fingerprint, **{key: i['after']}
+                    ):
+                    continue
                 # Webhook sends utc miliseconds timestamp or None
                 _date = i['after']
                 if _date:
@@ -731,7 +1375,12 @@ class SyncedEvent(models.Model):
                     if tag['name'] == SYNCED_TASK_TAG:
                         break
                 else:  # Delete event if the sync is cancelled from the task
-                    return self.delete(with_event=True)
+                    self.delete(with_event=True)
+                    return False
+        if values:
+            self.task_fingerprint = make_fingerprint(
+                self.task_fingerprint, **values
+                )
         # Perform the update
         if data:
             # Update the synced event
@@ -750,23 +1399,29 @@ class SyncedEvent(models.Model):
             data['start_time'] = start
             self.start = make_aware_datetime(start)
             try:
-                return self.update_event(**data)
+                event = self.update_event(**data)
             except Exception as e:
                 logger.error(data)
                 raise e
-        return False
+            self.event_fingerprint = make_fingerprint(
+                **self.event_values(event)
+                )
+            return event
+        return (self.task_fingerprint, self.sync_description) != before
 
     @classmethod
     def create(cls, matcher, match, *, event=None, task=None) -> 'SyncedEvent':
         if event and task is None:
+            event = EventRecord.of(event)
             (task, start, end) = matcher._create_task_from_event(event, match)
             task_id = task['id']
-            event_id = event['id']
+            event_id = event.id
             sync_description = SYNC_GOOGLE_CALENDAR_DESCRIPTION
         elif task and event is None:
+            task = TaskRecord.of(task)
             (event, start, end) = matcher._create_event_from_task(task, match)
             event_id = event['id']
-            task_id = task['id']
+            task_id = task.id
             sync_description = SYNC_CLICKUP_DESCRIPTION
         else:
             raise AttributeError(
@@ -782,6 +1437,8 @@ class SyncedEvent(models.Model):
             start=start,
             end=end,
             sync_description=sync_description,
+            event_fingerprint=make_fingerprint(**cls.event_values(event)),
+            task_fingerprint=make_fingerprint(**cls.task_values(task)),
             )
 
     def delete_task(self, task_id: str = None) -> dict:
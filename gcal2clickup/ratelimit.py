@@ -0,0 +1,155 @@
+from typing import Mapping, Optional
+
+from django.apps import apps
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.db.models.functions import Least
+from app.settings import (
+    CLICKUP_RATE_LIMIT, CLICKUP_RATE_LIMIT_RESERVE,
+    CLICKUP_RATE_LIMIT_MAX_WAIT, CLICKUP_RATE_LIMIT_DATABASE
+    )
+
+from datetime import datetime, timedelta, timezone
+
+import hashlib
+import logging
+import time
+
+logger = logging.getLogger('gcal2clikup')
+
+# Clickup restores the quota of a token every minute
+WINDOW = timedelta(minutes=1)
+
+
+def token_key(token: str) -> str:
+    # Tokens are never stored, only their hash
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+class RateLimitGovernor:
+    """Token bucket per Clickup token shared by every process.
+
+    The bucket lives in the `RateLimit` table so web workers and `runchecks`
+    draw from the same quota. Each call takes a token before it is sent and
+    the bucket is corrected with the `X-RateLimit-*` headers of the response.
+    When the bucket is down to `reserve` tokens, callers sleep until it is
+    refilled instead of spending the quota.
+
+    The bucket is read and written through its own database connection, so
+    its row lock is never held by the transaction of the caller. Without it,
+    calls made inside a transaction are not throttled nor counted.
+    """
+    def __init__(
+        self,
+        limit: int = CLICKUP_RATE_LIMIT,
+        reserve: int = CLICKUP_RATE_LIMIT_RESERVE,
+        max_wait: float = CLICKUP_RATE_LIMIT_MAX_WAIT,
+        ):
+        self.limit = limit
+        self.reserve = reserve
+        self.max_wait = max_wait
+
+    @property
+    def model(self):
+        return apps.get_model('gcal2clickup', 'RateLimit')
+
+    @property
+    def using(self) -> str:
+        if CLICKUP_RATE_LIMIT_DATABASE in connections.databases:
+            return CLICKUP_RATE_LIMIT_DATABASE
+        return DEFAULT_DB_ALIAS
+
+    @property
+    def objects(self):
+        return self.model.objects.using(self.using)
+
+    def in_caller_transaction(self) -> bool:
+        # Locks taken in the transaction of the caller would last until it
+        # commits, across its sleeps and later requests
+        return connections[self.using].in_atomic_block
+
+    def _bucket(self, key: str, now: datetime):
+        bucket, _ = self.objects.select_for_update().get_or_create(
+            key=key,
+            defaults={
+                'limit': self.limit,
+                'remaining': self.limit,
+                'reset': now + WINDOW,
+                },
+            )
+        # Refill the bucket once the window is over
+        if bucket.reset <= now:
+            bucket.remaining = bucket.limit
+            bucket.reset = now + WINDOW
+        return bucket
+
+    def acquire(self, token: str) -> float:
+        # Returns the seconds that the caller has been throttled
+        if self.in_caller_transaction():
+            return 0.0
+        key = token_key(token)
+        waited = 0.0
+        while True:
+            now = datetime.now(timezone.utc)
+            # Take a token in one statement while the window is running
+            if self.objects.filter(
+                key=key, reset__gt=now, remaining__gt=self.reserve
+                ).update(remaining=F('remaining') - 1):
+                return waited
+            with transaction.atomic(using=self.using):
+                bucket = self._bucket(key, now)
+                if bucket.remaining > self.reserve:
+                    bucket.remaining -= 1
+                    bucket.save()
+                    return waited
+                wait = (bucket.reset - now).total_seconds()
+            # Sleep once the bucket lock is released
+            wait = min(max(wait, 0.0), self.max_wait - waited)
+            if wait <= 0:
+                logger.warning('Clickup rate limit wait exceeded, sending')
+                return waited
+            logger.info(f'Clickup rate limit reached, waiting {wait:.2f}s')
+            time.sleep(wait)
+            waited += wait
+
+    def update(self, token: str, headers: Mapping[str, str]):
+        remaining = self.parse_int(headers.get('X-RateLimit-Remaining'))
+        if remaining is None or self.in_caller_transaction():
+            return
+        limit = self.parse_int(headers.get('X-RateLimit-Limit'))
+        reset = self.parse_int(headers.get('X-RateLimit-Reset'))
+        # Concurrent calls may have taken tokens since the response
+        fields = {'remaining': Least(F('remaining'), Value(remaining))}
+        if limit:
+            fields['limit'] = limit
+        if reset:
+            reset = datetime.fromtimestamp(reset, timezone.utc)
+            fields['remaining'] = Case(
+                # Clickup already started a new window
+                When(reset__lt=reset, then=Value(remaining)),
+                default=fields['remaining'],
+                output_field=IntegerField(),
+                )
+            fields['reset'] = reset
+        self.objects.filter(key=token_key(token)).update(**fields)
+
+    def exhaust(self, token: str, retry_after: Optional[float] = None):
+        # Empty the bucket after a 429 response
+        if self.in_caller_transaction():
+            return
+        fields = {'remaining': 0}
+        if retry_after is not None:
+            fields['reset'] = datetime.now(timezone.utc) + timedelta(
+                seconds=retry_after
+                )
+        self.objects.filter(key=token_key(token)).update(**fields)
+
+    @staticmethod
+    def parse_int(value: Optional[str]) -> Optional[int]:
+        try:
+            return int(float(value))
+        except (TypeError, ValueError):
+            return None
+
+
+rate_limit_governor = RateLimitGovernor()
@@ -0,0 +1,219 @@
+from typing import Optional, Tuple, Union
+
+from gcal2clickup.clickup import DATE_ONLY_TIME
+from gcal2clickup.utils import make_aware_datetime
+
+from datetime import datetime, date, timedelta
+
+import pytz
+
+Bound = Union[datetime, date]
+
+
+def parse_time(value: str) -> datetime:
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+
+def parse_bound(value: str) -> Bound:
+    # Event dateTime, or date of whole day events
+    if 'T' in value:
+        return parse_time(value)
+    return parse_time(value).date()
+
+
+def event_bounds(event: dict) -> Tuple[Bound, Bound]:
+    # Datetimes, or dates for whole day events
+    if 'dateTime' in event['start']:
+        return (
+            parse_time(event['start']['dateTime']),
+            parse_time(event['end']['dateTime']),
+            )
+    return (
+        parse_time(event['start']['date']).date(),
+        parse_time(event['end']['date']).date(),
+        )
+
+
+def task_bounds(task: dict) -> Tuple[Optional[Bound], Optional[Bound]]:
+    # Tasks without start date start at the due date, dates without time are
+    # stored at DATE_ONLY_TIME
+    if not task.get('due_date', None):
+        return (None, None)
+    end = datetime.fromtimestamp(int(task['due_date']) / 1000)
+    end = pytz.utc.localize(end)
+    if end.time() == DATE_ONLY_TIME:  # Recognize whole day due dates
+        end = end.date()
+    if not task.get('start_date', None):  # Start date is not mandatory
+        return (end, end)
+    start = datetime.fromtimestamp(int(task['start_date']) / 1000)
+    start = pytz.utc.localize(start)
+    if type(end) == date:  # Start must be the same format as end
+        start = start.date()
+    elif end == start:  # Recognize whole day dates
+        end = end.date()
+        start = start.date()
+    return (start, end)
+
+
+class EventRecord:
+    """Fields of a Google Calendar event read by the sync.
+
+    Built once per listed event, so the event dict can be released. The
+    timestamps are kept as received and parsed once on first use, so
+    cancelled events and events that no matcher accepts never parse their
+    bounds, and `created` and `updated` are only parsed by `is_new`.
+    """
+    __slots__ = (
+        'id', 'status', 'summary', 'description', 'html_link', '_start',
+        '_end', 'created', 'updated'
+        )
+
+    def __init__(
+        self,
+        id: str,
+        status: Optional[str] = None,
+        summary: Optional[str] = None,
+        description: Optional[str] = None,
+        html_link: Optional[str] = None,
+        start: Optional[Union[str, Bound]] = None,
+        end: Optional[Union[str, Bound]] = None,
+        created: Optional[str] = None,
+        updated: Optional[str] = None,
+        ):
+        self.id = id
+        self.status = status
+        self.summary = summary
+        self.description = description
+        self.html_link = html_link
+        # dateTime or date strings, replaced by their bound once parsed
+        self._start = start
+        self._end = end
+        self.created = created
+        self.updated = updated
+
+    def __repr__(self):
+        return f'EventRecord({self.id}, {self.summary!r})'
+
+    @classmethod
+    def from_event(cls, event: dict) -> 'EventRecord':
+        # Cancelled events only have an id and status
+        start = end = None
+        if 'start' in event:
+            start = event['start'].get('dateTime', None) \
+                or event['start']['date']
+            end = event['end'].get('dateTime', None) or event['end']['date']
+        return cls(
+            id=event['id'],
+            status=event.get('status', None),
+            summary=event.get('summary', None),
+            description=event.get('description', None),
+            html_link=event.get('htmlLink', None),
+            start=start,
+            end=end,
+            created=event.get('created', None),
+            updated=event.get('updated', None),
+            )
+
+    @classmethod
+    def of(cls, event: Union[dict, 'EventRecord']) -> 'EventRecord':
+        return event if isinstance(event, cls) else cls.from_event(event)
+
+    @property
+    def start(self) -> Optional[Bound]:
+        if isinstance(self._start, str):
+            self._start = parse_bound(self._start)
+        return self._start
+
+    @property
+    def end(self) -> Optional[Bound]:
+        if isinstance(self._end, str):
+            self._end = parse_bound(self._end)
+        return self._end
+
+    @property
+    def name(self) -> str:
+        return '(No title)' if self.summary is None else self.summary
+
+    @property
+    def is_cancelled(self) -> bool:
+        return self.status == 'cancelled'
+
+    @property
+    def is_new(self) -> bool:
+        created = parse_time(self.created)
+        return (parse_time(self.updated) - created) < timedelta(seconds=1)
+
+    @property
+    def start_at(self) -> datetime:
+        return make_aware_datetime(self.start)
+
+    @property
+    def end_at(self) -> datetime:
+        return make_aware_datetime(self.end)
+
+
+class TaskRecord:
+    """Fields of a Clickup task read by the sync.
+
+    The raw `start_date` and `due_date` timestamps are kept for the
+    fingerprints next to the parsed `start` and `end` bounds.
+    """
+    __slots__ = (
+        'id', 'name', 'description', 'url', 'list_id', 'tags', 'start_date',
+        'due_date', 'start', 'end'
+        )
+
+    def __init__(
+        self,
+        id: str,
+        name: Optional[str] = None,
+        description: Optional[str] = None,
+        url: Optional[str] = None,
+        list_id: Optional[str] = None,
+        tags: Tuple[str, ...] = (),
+        start_date: Optional[str] = None,
+        due_date: Optional[str] = None,
+        start: Optional[Bound] = None,
+        end: Optional[Bound] = None,
+        ):
+        self.id = id
+        self.name = name
+        self.description = description
+        self.url = url
+        self.list_id = list_id
+        self.tags = tags
+        self.start_date = start_date
+        self.due_date = due_date
+        self.start = start
+        self.end = end
+
+    def __repr__(self):
+        return f'TaskRecord({self.id}, {self.name!r})'
+
+    @classmethod
+    def from_task(cls, task: dict) -> 'TaskRecord':
+        (start, end) = task_bounds(task)
+        return cls(
+            id=task['id'],
+            name=task.get('name', None),
+            description=task.get('description', None),
+            url=task.get('url', None),
+            list_id=(task.get('list', None) or {}).get('id', None),
+            tags=tuple(t['name'] for t in task.get('tags', None) or []),
+            start_date=task.get('start_date', None),
+            due_date=task.get('due_date', None),
+            start=start,
+            end=end,
+            )
+
+    @classmethod
+    def of(cls, task: Union[dict, 'TaskRecord']) -> 'TaskRecord':
+        return task if isinstance(task, cls) else cls.from_task(task)
+
+    @property
+    def start_at(self) -> datetime:
+        return make_aware_datetime(self.start)
+
+    @property
+    def end_at(self) -> datetime:
+        return make_aware_datetime(self.end)
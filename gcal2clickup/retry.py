@@ -0,0 +1,195 @@
+from typing import Any, Awaitable, Callable, Mapping, Optional, Tuple
+
+from app.settings import (
+    RETRY_MAX_RETRIES, RETRY_BACKOFF, RETRY_MAX_BACKOFF, RETRY_DEADLINE
+    )
+
+from collections import Counter
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+import threading
+import asyncio
+import logging
+import random
+import httplib2
+import httpx
+import time
+
+logger = logging.getLogger('gcal2clikup')
+
+# Methods that can be sent twice without changing the result. Our PATCH
+# requests always set absolute values, so they are safe to repeat too
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'OPTIONS', 'PUT', 'PATCH', 'DELETE'}
+# Statuses worth retrying for idempotent requests
+RETRY_STATUSES = {408, 429, 500, 502, 503, 504}
+# Statuses where the server did not process the request, so any method can
+# be retried
+REJECTED_STATUSES = {429}
+# Errors raised before a response is received
+NETWORK_ERRORS = (OSError, httpx.TransportError, httplib2.HttpLib2Error)
+
+
+class HTTPStatusError(Exception):
+    def __init__(self, status: int, text: str, headers: Mapping = None):
+        super().__init__(f'Error { status }: { text }')
+        self.status = status
+        self.text = text
+        self.headers = headers or {}
+
+
+def error_status(e: Exception) -> Tuple[Optional[int], Mapping]:
+    # (status, headers) of HTTPStatusError and googleapiclient's HttpError
+    if isinstance(e, HTTPStatusError):
+        return e.status, e.headers
+    resp = getattr(e, 'resp', None)
+    if resp is not None:
+        return int(resp.status), resp
+    return None, {}
+
+
+def parse_retry_after(headers: Mapping) -> Optional[float]:
+    value = None
+    for key in ['Retry-After', 'retry-after']:
+        value = headers.get(key, value)
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max((when - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+
+class RetryPolicy:
+    """Retries of failed API calls shared by the Clickup and Google clients.
+
+    A call is retried when its status is in `RETRY_STATUSES` or it failed
+    with a network error, but non idempotent calls are only retried when the
+    server rejected them without processing (429). Waits grow exponentially
+    with full jitter, honour the `Retry-After` header and never go past the
+    `deadline` of the whole call.
+    """
+    def __init__(
+        self,
+        name: str,
+        max_retries: int = RETRY_MAX_RETRIES,
+        backoff: float = RETRY_BACKOFF,
+        max_backoff: float = RETRY_MAX_BACKOFF,
+        deadline: float = RETRY_DEADLINE,
+        ):
+        self.name = name
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.deadline = deadline
+        self.counters = Counter()
+        self._lock = threading.Lock()
+
+    def count(self, key: str, n: int = 1):
+        with self._lock:
+            self.counters[key] += n
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self.counters)
+
+    @staticmethod
+    def is_idempotent(method: str, idempotent: Optional[bool] = None):
+        if idempotent is not None:
+            return idempotent
+        return method.upper() in IDEMPOTENT_METHODS
+
+    def should_retry(
+        self, e: Exception, method: str, idempotent: Optional[bool] = None
+        ) -> bool:
+        status, _ = error_status(e)
+        if status in REJECTED_STATUSES:
+            return True
+        if not self.is_idempotent(method, idempotent):
+            return False
+        if status is None:
+            return isinstance(e, NETWORK_ERRORS)
+        return status in RETRY_STATUSES
+
+    def delay(self, retry: int, retry_after: Optional[float] = None) -> float:
+        delay = random.uniform(
+            0, min(self.max_backoff, self.backoff * 2**retry)
+            )
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+    def next_delay(
+        self,
+        e: Exception,
+        method: str,
+        retry: int,
+        started: float,
+        idempotent: Optional[bool] = None,
+        ) -> Optional[float]:
+        # Seconds to wait before retrying, None if the error must be raised
+        status, headers = error_status(e)
+        reason = f'status:{status}' if status else type(e).__name__
+        if retry >= self.max_retries or not self.should_retry(
+            e, method, idempotent
+            ):
+            self.count('failed')
+            self.count(f'failed:{reason}')
+            return None
+        delay = self.delay(retry, parse_retry_after(headers))
+        if time.monotonic() - started + delay > self.deadline:
+            self.count('deadline')
+            return None
+        self.count('retries')
+        self.count(f'retries:{reason}')
+        logger.warning(
+            f'{self.name}: retrying {method} in {delay:.2f}s after {reason}'
+            )
+        return delay
+
+    def call(
+        self,
+        func: Callable[[], Any],
+        method: str,
+        idempotent: Optional[bool] = None,
+        ) -> Any:
+        self.count('calls')
+        started = time.monotonic()
+        retry = 0
+        while True:
+            try:
+                return func()
+            except Exception as e:
+                delay = self.next_delay(e, method, retry, started, idempotent)
+                if delay is None:
+                    raise e
+            time.sleep(delay)
+            retry += 1
+
+    async def call_async(
+        self,
+        func: Callable[[], Awaitable[Any]],
+        method: str,
+        idempotent: Optional[bool] = None,
+        ) -> Any:
+        self.count('calls')
+        started = time.monotonic()
+        retry = 0
+        while True:
+            try:
+                return await func()
+            except Exception as e:
+                delay = self.next_delay(e, method, retry, started, idempotent)
+                if delay is None:
+                    raise e
+            await asyncio.sleep(delay)
+            retry += 1
+
+
+clickup_retry = RetryPolicy('clickup')
+google_retry = RetryPolicy('google')
@@ -0,0 +1,114 @@
+from typing import Dict, Tuple
+
+from requests.adapters import HTTPAdapter
+from app.settings import CLICKUP_POOL_SIZE, CLICKUP_SESSION_IDLE_TIMEOUT
+from gcal2clickup.cassette import CassetteAdapter, active_cassette
+
+import requests
+import threading
+import logging
+import time
+
+logger = logging.getLogger('gcal2clikup')
+
+
+class SessionRegistry:
+    """Process-wide keep-alive sessions keyed by API token.
+
+    Every token gets its own `requests.Session` with a pooled adapter so
+    consecutive calls reuse the same TCP+TLS connection. Sessions that have
+    not been used for `idle_timeout` seconds are closed on the next lookup.
+    """
+    def __init__(
+        self,
+        pool_size: int = CLICKUP_POOL_SIZE,
+        idle_timeout: float = CLICKUP_SESSION_IDLE_TIMEOUT,
+        ):
+        self.pool_size = pool_size
+        self.idle_timeout = idle_timeout
+        self._sessions: Dict[str, Tuple[requests.Session, float]] = {}
+        self._lock = threading.Lock()
+        # Counters of the sessions that have already been closed
+        self._closed_connections = 0
+        self._closed_requests = 0
+
+    def _new_session(self) -> requests.Session:
+        session = requests.Session()
+        cassette = active_cassette()
+        if cassette is None:
+            adapter = HTTPAdapter(
+                pool_connections=self.pool_size,
+                pool_maxsize=self.pool_size,
+                )
+        else:
+            adapter = CassetteAdapter(
+                cassette,
+                pool_connections=self.pool_size,
+                pool_maxsize=self.pool_size,
+                )
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    def get(self, token: str) -> requests.Session:
+        now = time.monotonic()
+        with self._lock:
+            self._evict_idle(now)
+            session, _ = self._sessions.get(token, (None, None))
+            if session is None:
+                session = self._new_session()
+            self._sessions[token] = (session, now)
+        return session
+
+    def _evict_idle(self, now: float):
+        for token, (session, last_used) in list(self._sessions.items()):
+            if now - last_used > self.idle_timeout:
+                self._close(token, session)
+
+    def _close(self, token: str, session: requests.Session):
+        connections, requests_ = self._count(session)
+        self._closed_connections += connections
+        self._closed_requests += requests_
+        del self._sessions[token]
+        session.close()
+
+    def evict_idle(self):
+        with self._lock:
+            self._evict_idle(time.monotonic())
+
+    def close(self):
+        with self._lock:
+            for token, (session, _) in list(self._sessions.items()):
+                self._close(token, session)
+
+    @staticmethod
+    def _count(session: requests.Session) -> Tuple[int, int]:
+        # (connections opened, requests sent)
+        connections = 0
+        requests_ = 0
+        for adapter in set(session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools[key]
+                connections += pool.num_connections
+                requests_ += pool.num_requests
+        return (connections, requests_)
+
+    def stats(self) -> dict:
+        with self._lock:
+            connections = self._closed_connections
+            requests_ = self._closed_requests
+            for session, _ in self._sessions.values():
+                _connections, _requests = self._count(session)
+                connections += _connections
+                requests_ += _requests
+            sessions = len(self._sessions)
+        return {
+            'sessions': sessions,
+            'connections': connections,
+            'requests': requests_,
+            'reused': max(requests_ - connections, 0),
+            }
+
+
+clickup_sessions = SessionRegistry()
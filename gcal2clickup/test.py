@@ -2,13 +2,33 @@ import unittest
 
 from django.test import Client
 from django.contrib.auth.models import User
+from django.db import OperationalError, transaction
 
 from gcal2clickup.models import (
     GoogleCalendarWebhook, ClickupUser, Matcher, SyncedEvent, SYNCED_TASK_TAG
     )
+from gcal2clickup.utils import make_fingerprint, changed_fields
+from gcal2clickup.metrics import MetricsRegistry
+from gcal2clickup.retry import RetryPolicy, HTTPStatusError, parse_retry_after
+from gcal2clickup.breaker import (
+    BreakerRegistry, CircuitBreaker, CircuitOpenError, CLOSED, OPEN, HALF_OPEN
+    )
+from gcal2clickup.google_calendar import GoogleCalendar
+from gcal2clickup.clickup import Clickup, coalesce_comments
+from gcal2clickup.tokens import TokenRefresher
+from gcal2clickup.calendars import CalendarListSyncer
 
 from time import sleep
+from email.utils import format_datetime
 from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+from unittest import mock
+
+import threading
+import httplib2
+import json
 
 
 class TestBase(unittest.TestCase):
@@ -182,4 +202,474 @@ class TestBase(unittest.TestCase):
 
         # Test moving a task from a specified time to all day
 
-        # Test moving a task event from all day to an specified time
\ No newline at end of file
+        # Test moving a task event from all day to an specified time
+
+class TestFingerprint(unittest.TestCase):
+    def test_changed_fields(self):
+        start = datetime(2021, 6, 1, 10, tzinfo=timezone.utc)
+        fingerprint = make_fingerprint(
+            name='Event', description=None, start=start, end=start.date()
+            )
+        self.assertEqual(
+            changed_fields(
+                fingerprint,
+                name='Event',
+                description='',  # Empty and missing are the same
+                start=start.astimezone(timezone(timedelta(hours=2))),
+                end=start.date(),
+                ),
+            set(),
+            )
+        self.assertEqual(
+            changed_fields(fingerprint, name='Renamed', end=start),
+            {'name', 'end'},
+            )
+
+    def test_partial_updates(self):
+        fingerprint = make_fingerprint(name='Event', description='Text')
+        updated = make_fingerprint(fingerprint, name='Renamed')
+        self.assertFalse(
+            changed_fields(updated, name='Renamed', description='Text')
+            )
+        # Without a fingerprint every field is changed
+        self.assertEqual(changed_fields(None, name='Event'), {'name'})
+        self.assertEqual(changed_fields('invalid', end=None), {'end'})
+
+
+class TestMetricsRegistry(unittest.TestCase):
+    labels = ('clickup', 'GET', 'task/{id}', 'tenant')
+
+    def setUp(self):
+        self.metrics = MetricsRegistry()
+        self.metrics.record(*self.labels, latency=0.2)
+
+    def test_failed_flush_keeps_samples(self):
+        with mock.patch(
+            'gcal2clickup.metrics.transaction.atomic',
+            side_effect=OperationalError('database is down'),
+            ):
+            self.metrics.flush()
+        self.metrics.record(*self.labels, latency=3, error=True)
+        sample = self.metrics._pending[self.labels]
+        self.assertEqual((sample['calls'], sample['errors']), (2, 1))
+        self.assertEqual(sum(sample['buckets']), 2)
+
+    def test_flush_waits_for_caller_transaction(self):
+        with transaction.atomic(using=self.metrics.using):
+            self.metrics.flush()
+            self.assertEqual(self.metrics._pending[self.labels]['calls'], 1)
+
+
+class TestRetryPolicy(unittest.TestCase):
+    def setUp(self):
+        self.retry = RetryPolicy(
+            'test', max_retries=3, backoff=0.5, max_backoff=3, deadline=10
+            )
+        self.sleeps = []
+        # Longest waits, without sleeping
+        patches = [
+            mock.patch('gcal2clickup.retry.random.uniform', lambda a, b: b),
+            mock.patch('gcal2clickup.retry.time.sleep', self.sleeps.append),
+            ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def failing(self, *errors: Exception):
+        # Raises the errors in order, then returns 'ok'
+        errors = list(errors)
+
+        def func():
+            if errors:
+                raise errors.pop(0)
+            return 'ok'
+
+        return func
+
+    def test_backoff(self):
+        self.assertEqual(
+            [self.retry.delay(r) for r in range(4)], [0.5, 1, 2, 3]
+            )
+        self.assertEqual(self.retry.delay(0, retry_after=2.5), 2.5)
+
+    def test_parse_retry_after(self):
+        self.assertEqual(parse_retry_after({'Retry-After': '2'}), 2.0)
+        self.assertEqual(parse_retry_after({'retry-after': '-1'}), 0.0)
+        self.assertIsNone(parse_retry_after({}))
+        self.assertIsNone(parse_retry_after({'Retry-After': 'soon'}))
+        when = datetime.now(timezone.utc) + timedelta(seconds=30)
+        self.assertAlmostEqual(
+            parse_retry_after({'Retry-After': format_datetime(when, True)}),
+            30,
+            delta=2,
+            )
+
+    def test_should_retry(self):
+        cases = [
+            ('GET', HTTPStatusError(503, ''), True),
+            ('GET', HTTPStatusError(404, ''), False),
+            ('GET', ConnectionResetError(), True),
+            ('GET', ValueError(), False),
+            ('POST', HTTPStatusError(503, ''), False),
+            ('POST', HTTPStatusError(429, ''), True),
+            ]
+        for method, e, retried in cases:
+            self.assertEqual(
+                self.retry.should_retry(e, method), retried, (method, e)
+                )
+        self.assertTrue(
+            self.retry.should_retry(
+                HTTPStatusError(503, ''), 'POST', idempotent=True
+                )
+            )
+
+    def test_call_retries(self):
+        func = self.failing(HTTPStatusError(503, ''), ConnectionResetError())
+        self.assertEqual(self.retry.call(func, 'GET'), 'ok')
+        self.assertEqual(self.sleeps, [0.5, 1])
+
+    def test_call_honours_retry_after(self):
+        func = self.failing(
+            HTTPStatusError(429, '', {'Retry-After': '4'}),
+            HTTPStatusError(429, '', {'Retry-After': '20'}),
+            )
+        with self.assertRaises(HTTPStatusError):
+            self.retry.call(func, 'POST')
+        # The second wait would go past the deadline
+        self.assertEqual(self.sleeps, [4])
+
+    def test_call_gives_up(self):
+        with self.assertRaises(HTTPStatusError):
+            self.retry.call(self.failing(HTTPStatusError(500, '')), 'POST')
+        func = self.failing(*[HTTPStatusError(502, '')] * 4)
+        with self.assertRaises(HTTPStatusError):
+            self.retry.call(func, 'GET')
+        self.assertEqual(self.sleeps, [0.5, 1, 2])
+
+
+class TestCommentBuffer(unittest.TestCase):
+    def setUp(self):
+        patch = mock.patch.object(Clickup, 'post')
+        self.post = patch.start()
+        self.addCleanup(patch.stop)
+        self.api = Clickup('pk_test')
+
+    def test_comments_are_coalesced(self):
+        with coalesce_comments():
+            self.api.task_logger('First', task_id='1')
+            with coalesce_comments():  # Nested operations share the buffer
+                self.api.comment_task(
+                    task_id='1',
+                    comment=[{'text': 'Second', 'attributes': {'bold': 1}}],
+                    )
+            self.api.task_logger('Other', task_id='2')
+            self.post.assert_not_called()
+        self.assertEqual(
+            self.post.call_args_list, [
+                mock.call(
+                    'task/1/comment',
+                    data={
+                        'comment': [
+                            {'text': 'gcal2clickup: First', 'attributes': {}},
+                            {'text': '\n', 'attributes': {}},
+                            {'text': 'Second', 'attributes': {'bold': 1}},
+                            ]
+                        },
+                    ),
+                mock.call(
+                    'task/2/comment',
+                    data={'comment_text': 'gcal2clickup: Other'},
+                    ),
+                ]
+            )
+
+    def test_deleted_task_comments_are_dropped(self):
+        with mock.patch.object(Clickup, 'delete'):
+            with coalesce_comments():
+                self.api.task_logger('Deleted', task_id='1')
+                self.api.delete_task('1')
+        self.post.assert_not_called()
+
+    def test_flush_after_errors(self):
+        self.post.side_effect = [Exception('Failed'), None, None]
+        with self.assertRaises(ValueError):
+            with coalesce_comments():
+                self.api.task_logger('First', task_id='1')
+                self.api.task_logger('Second', task_id='2')
+                raise ValueError()
+        # Every task got its comment even if a previous one failed
+        self.assertEqual(self.post.call_count, 2)
+        # Comments are posted at once outside of a block
+        self.api.task_logger('Now', task_id='3')
+        self.assertEqual(self.post.call_count, 3)
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    def setUp(self):
+        self.now = 0.0
+        patch = mock.patch(
+            'gcal2clickup.breaker.time.monotonic', lambda: self.now
+            )
+        patch.start()
+        self.addCleanup(patch.stop)
+        self.breaker = CircuitBreaker(
+            'test', failure_threshold=3, reset_timeout=30, half_open_max=1
+            )
+
+    def outage(self, e: Exception = None):
+        with self.assertRaises(Exception):
+            with self.breaker.guard():
+                raise e or HTTPStatusError(503, '')
+
+    def open(self):
+        for _ in range(3):
+            self.outage()
+        self.assertEqual(self.breaker.state, OPEN)
+
+    def test_opens_after_consecutive_outages(self):
+        self.outage()
+        self.outage()
+        with self.breaker.guard():  # A success resets the failures
+            pass
+        self.outage()
+        self.outage(HTTPStatusError(404, ''))  # The host answered
+        self.outage()
+        self.outage()
+        self.assertEqual(self.breaker.state, CLOSED)
+        self.outage(ConnectionResetError())
+        self.assertEqual(self.breaker.state, OPEN)
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.allow()
+        self.assertTrue(self.breaker.is_open)
+
+    def test_probe_closes(self):
+        self.open()
+        self.now += 30
+        self.assertFalse(self.breaker.is_open)
+        self.breaker.allow()
+        self.assertEqual(self.breaker.state, HALF_OPEN)
+        with self.assertRaises(CircuitOpenError):  # Only one probe
+            self.breaker.allow()
+        self.breaker.success()
+        self.assertEqual(self.breaker.state, CLOSED)
+        self.breaker.allow()
+
+    def test_circuit_is_per_token(self):
+        registry = BreakerRegistry(failure_threshold=1)
+        api = Clickup('pk_test', tenant='1', breakers=registry)
+        same = Clickup('pk_test', tenant='2', breakers=registry)
+        other = Clickup('pk_other', tenant='1', breakers=registry)
+        self.assertEqual(api.circuit, same.circuit)
+        registry.get(Clickup.HOST, api.circuit).failure(
+            HTTPStatusError(503, '')
+            )
+        self.assertTrue(registry.is_open(Clickup.HOST, same.circuit))
+        self.assertFalse(registry.is_open(Clickup.HOST, other.circuit))
+
+    def test_unsent_probe_is_released(self):
+        # The call is allowed but fails before it is sent
+        api = Clickup(
+            'pk_test',
+            breakers=BreakerRegistry(
+                failure_threshold=1, reset_timeout=30, half_open_max=1
+                ),
+            )
+        breaker = api.breakers.get(Clickup.HOST, api.circuit)
+        breaker.failure(HTTPStatusError(503, ''))
+        self.now += 30
+        governor = mock.Mock()
+        governor.acquire.side_effect = OperationalError('ratelimit is down')
+        api.governor = governor
+        with self.assertRaises(OperationalError):
+            api.get('user')
+        self.assertEqual(breaker.state, HALF_OPEN)
+        self.assertEqual(breaker.probes, 0)
+        breaker.allow()  # The next call can still probe
+
+    def test_failed_probe_opens(self):
+        self.open()
+        self.now += 30
+        self.outage()
+        self.assertEqual(self.breaker.state, OPEN)
+        self.assertEqual(self.breaker.retry_in(), 30)
+
+
+class TestUpdateEventFromTask(unittest.TestCase):
+    def setUp(self):
+        self.end = datetime(2021, 6, 1, 10, tzinfo=timezone.utc)
+        self.synced_event = SyncedEvent(
+            task_id='task',
+            event_id='event',
+            start=self.end - timedelta(hours=1),
+            end=self.end,
+            task_fingerprint=make_fingerprint(
+                name='Task',
+                start=str(int(self.end.timestamp() * 1000) - 3600000),
+                end=str(int(self.end.timestamp() * 1000)),
+                ),
+            )
+
+    def test_removed_due_date_stops_sync(self):
+        # Without the task history the removed due date is only known from
+        # the current task
+        task = {
+            'id': 'task',
+            'name': 'Task',
+            'tags': [{'name': SYNCED_TASK_TAG}],
+            'start_date': None,
+            'due_date': None,
+            }
+        with mock.patch.object(SyncedEvent, 'delete') as delete:
+            self.assertFalse(self.synced_event.update_event_from_task(task))
+        delete.assert_called_once_with(with_event=True)
+
+
+class FakeGoogleHandler(BaseHTTPRequestHandler):
+    # Token endpoint and events of a calendar, slow enough for the requests
+    # of different threads to overlap
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        if 'token' in self.path:
+            self.server.refreshes += 1
+            sleep(0.2)
+            self.reply({'access_token': 'refreshed', 'expires_in': 3600})
+        else:
+            event = json.loads(body)
+            self.reply({'id': event['summary'], **event})
+
+    def do_GET(self):
+        self.reply({'items': [{'id': self.path, 'status': 'confirmed'}]})
+
+    def reply(self, data: dict):
+        if 'token' not in self.path and \
+            self.headers['Authorization'] != 'Bearer refreshed':
+            self.send_response(401)
+            self.end_headers()
+            return
+        sleep(0.01)
+        content = json.dumps(data).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+
+class LocalHttp(httplib2.Http):
+    # Sends every request to the fake server, failing when two threads use
+    # the same transport at once
+    def __init__(self, address: str, **kwargs):
+        super().__init__(**kwargs)
+        self.address = address
+        self.busy = threading.Lock()
+
+    def request(self, uri, *args, **kwargs):
+        if not self.busy.acquire(blocking=False):
+            raise AssertionError('Transport used by two threads at once')
+        try:
+            url = urlparse(uri)
+            uri = url._replace(scheme='http', netloc=self.address).geturl()
+            return super().request(uri, *args, **kwargs)
+        finally:
+            self.busy.release()
+
+
+class TestGoogleCalendarThreads(unittest.TestCase):
+    threads = 8
+    calls = 25
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), FakeGoogleHandler)
+        self.server.refreshes = 0
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        address = '%s:%s' % self.server.server_address
+        self.refreshed = []
+        self.google_calendar = GoogleCalendar(
+            'expired',
+            'refresh_token',
+            expiry=datetime.now(timezone.utc) - timedelta(minutes=1),
+            on_refresh=self.refreshed.append,
+            )
+        self.google_calendar.new_http = lambda: LocalHttp(address)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_concurrent_calls(self):
+        start = datetime.now(timezone.utc)
+
+        def calls(thread: int):
+            results = []
+            for i in range(self.calls):
+                calendar_id = f'calendar{thread}-{i}'
+                events = list(
+                    self.google_calendar.list_events(calendar_id, fields=None)
+                    )
+                self.assertEqual(len(events), 1)
+                self.assertIn(calendar_id, events[0]['id'])
+                event = self.google_calendar.create_event(
+                    calendarId=calendar_id,
+                    summary=calendar_id,
+                    start_time=start,
+                    end_time=start + timedelta(hours=1),
+                    )
+                results.append(event['id'])
+            return results
+
+        with ThreadPoolExecutor(self.threads) as pool:
+            results = list(pool.map(calls, range(self.threads)))
+        for thread, ids in enumerate(results):
+            self.assertEqual(
+                ids, [f'calendar{thread}-{i}' for i in range(self.calls)]
+                )
+        # Every thread waited for the same refresh
+        self.assertEqual(self.server.refreshes, 1)
+        self.assertEqual(len(self.refreshed), 1)
+
+    def test_concurrent_builds(self):
+        # Building a service fills in its discovery document, the services
+        # built at once by the threads must not share it
+        def build(thread: int):
+            google_calendar = GoogleCalendar('token', 'refresh_token')
+            google_calendar.events
+            return google_calendar.service._rootDesc
+
+        with ThreadPoolExecutor(self.threads) as pool:
+            documents = list(pool.map(build, range(self.threads)))
+        self.assertEqual(len({id(d) for d in documents}), self.threads)
+        self.assertTrue(all(d == documents[0] for d in documents))
+
+
+class TestPeriodicThreads(unittest.TestCase):
+    def run_thread(self, thread, runs: int = 3):
+        # Runs the loop of `thread` until `run_once` was called `runs` times
+        calls = []
+
+        def run_once():
+            calls.append(len(calls))
+            if len(calls) == runs:
+                thread._stop.set()
+            if len(calls) == 1:
+                raise OperationalError('server closed the connection')
+
+        with mock.patch.object(thread, 'run_once', run_once), \
+            mock.patch('gcal2clickup.background.close_old_connections') \
+            as close_old_connections:
+            thread.run()
+        return calls, close_old_connections.call_count
+
+    def test_connections_are_closed_around_runs(self):
+        calls, closed = self.run_thread(TokenRefresher(interval=0))
+        # A failed run does not stop the next ones, which start with a
+        # usable connection
+        self.assertEqual(calls, [0, 1, 2])
+        self.assertEqual(closed, 6)
+
+    def test_calendar_syncer_recovers_connections(self):
+        calls, closed = self.run_thread(CalendarListSyncer(interval=0))
+        self.assertEqual(calls, [0, 1, 2])
+        self.assertEqual(closed, 6)
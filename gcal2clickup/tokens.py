@@ -0,0 +1,82 @@
+from django.apps import apps
+from django.db import transaction
+from django.db.models import Q
+from django.core.signals import request_started
+from django.utils import timezone
+from app.settings import (
+    GOOGLE_TOKEN_REFRESHER, GOOGLE_TOKEN_REFRESH_MARGIN,
+    GOOGLE_TOKEN_REFRESH_INTERVAL
+    )
+
+from gcal2clickup.background import PeriodicThread
+
+from datetime import timedelta
+
+import logging
+
+logger = logging.getLogger('gcal2clikup')
+
+
+class TokenRefresher(PeriodicThread):
+    """Renews the Google access tokens before they expire.
+
+    Every `interval` seconds the profiles whose token expires within
+    `margin` seconds are refreshed and saved, so the webhook handlers and
+    `runchecks` load a valid token instead of waiting for the OAuth token
+    endpoint. Profiles are locked while refreshed so that several workers
+    do not renew the same token.
+    """
+    name = 'token-refresher'
+
+    def __init__(
+        self,
+        margin: float = GOOGLE_TOKEN_REFRESH_MARGIN,
+        interval: float = GOOGLE_TOKEN_REFRESH_INTERVAL,
+        ):
+        super().__init__(interval)
+        self.margin = margin
+
+    def due(self):
+        model = apps.get_model('admin_sso', 'Profile')
+        return model.objects.exclude(google_auth_refresh_token='').filter(
+            Q(google_auth_expiry__isnull=True)
+            | Q(
+                google_auth_expiry__lte=timezone.now() +
+                timedelta(seconds=self.margin)
+                )
+            )
+
+    def refresh_due(self) -> int:
+        refreshed = 0
+        for pk in self.due().values_list('pk', flat=True):
+            try:
+                with transaction.atomic():
+                    # Skip the profile if another worker is refreshing it or
+                    # has refreshed it already
+                    profile = self.due().select_for_update(
+                        skip_locked=True
+                        ).filter(pk=pk).first()
+                    if profile is None:
+                        continue
+                    profile.google_calendar.refresh_token()
+                    refreshed += 1
+            except Exception as e:
+                # Left to the clients, which refresh expired tokens anyway
+                logger.error(
+                    f'Failed refreshing the Google token of {pk}', exc_info=e
+                    )
+        return refreshed
+
+    def run_once(self):
+        refreshed = self.refresh_due()
+        if refreshed:
+            logger.info(f'Refreshed {refreshed} Google tokens')
+
+
+token_refresher = TokenRefresher()
+
+
+@request_started.connect
+def start_token_refresher(sender, **kwargs):
+    if GOOGLE_TOKEN_REFRESHER:
+        token_refresher.start()
@@ -27,4 +27,9 @@ urlpatterns = [
         views.clickup_endpoint,
         name='clickup_endpoint',
         ),
+    path(
+        'metrics/',
+        views.api_metrics,
+        name='api_metrics',
+        ),
     ]
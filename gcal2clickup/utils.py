@@ -1,9 +1,11 @@
-from typing import Union, Optional
+from typing import Any, Dict, Optional, Set, Union
 
 from django.utils.timezone import make_aware
 
 from datetime import datetime, date, timedelta
 
+import hashlib
+
 
 def make_aware_datetime(
     dt: Union[datetime, date],
@@ -18,4 +20,44 @@ def make_aware_datetime(
     except ValueError as e: 
         if 'Not naive datetime' in str(e):
             return dt
-        raise e
\ No newline at end of file
+        raise e
+
+# Synced fields stored in a fingerprint, in order
+FINGERPRINT_FIELDS = ['name', 'description', 'start', 'end']
+
+
+def fingerprint_part(value: Any) -> str:
+    if value is None:
+        value = ''
+    elif isinstance(value, datetime):  # Ignore the timezone representation
+        value = int(value.timestamp())
+    elif isinstance(value, date):
+        value = value.isoformat()
+    return hashlib.sha1(str(value).encode()).hexdigest()[:12]
+
+
+def parse_fingerprint(fingerprint: Optional[str]) -> Dict[str, Optional[str]]:
+    parts = fingerprint.split(':') if fingerprint else []
+    if len(parts) != len(FINGERPRINT_FIELDS):
+        parts = [None] * len(FINGERPRINT_FIELDS)
+    return dict(zip(FINGERPRINT_FIELDS, parts))
+
+
+def make_fingerprint(
+    fingerprint: Optional[str] = None,
+    **values,
+    ) -> str:
+    # Fingerprint of the given field values, the rest are kept from the
+    # previous fingerprint
+    parts = parse_fingerprint(fingerprint)
+    for field, value in values.items():
+        parts[field] = fingerprint_part(value)
+    return ':'.join(parts[f] or '' for f in FINGERPRINT_FIELDS)
+
+
+def changed_fields(fingerprint: Optional[str], **values) -> Set[str]:
+    parts = parse_fingerprint(fingerprint)
+    return set(
+        field for field, value in values.items()
+        if parts[field] != fingerprint_part(value)
+        )
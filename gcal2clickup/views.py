@@ -1,11 +1,19 @@
-from django.http import HttpResponse
+from django.http import HttpResponse, JsonResponse
 from django.http.response import HttpResponseForbidden
 from django.views.decorators.csrf import csrf_exempt
 
-from gcal2clickup.models import GoogleCalendarWebhook, ClickupWebhook, SyncedEvent
+from app.settings import METRICS_TOKEN
+from gcal2clickup import codec
+from gcal2clickup.metrics import metrics, LATENCY_BUCKETS
+from gcal2clickup.breaker import breakers
+from gcal2clickup.etags import etag_cache
+from gcal2clickup.clickup import coalesce_comments
+from gcal2clickup.models import (
+    GoogleCalendarWebhook, ClickupWebhook, ClickupItem, SyncedEvent
+    )
 
 import logging
-import json
+import hmac
 
 logger = logging.getLogger('gcal2clikup')
 
@@ -34,8 +42,9 @@ def google_calendar_endpoint(request):
 
 
 @csrf_exempt
+@coalesce_comments()
 def clickup_endpoint(request):
-    body = json.loads(request.body)
+    body = codec.loads_webhook(request.body)
     try:
         webhook = ClickupWebhook.objects.get(pk=body['webhook_id'])
     except ClickupWebhook.DoesNotExist:
@@ -44,8 +53,14 @@ def clickup_endpoint(request):
     if not webhook.clickup_user.user.is_active:
         logger.info(body)
         return HttpResponse('Ignored', status=218)
-    task_id = body['task_id']
     event = body['event']
+    # Keep the stored workspace hierarchy updated
+    if ClickupItem.event_kind(event):
+        webhook.clickup_user.apply_hierarchy_event(
+            body, team_id=webhook.team_id
+            )
+        return HttpResponse('Updated hierarchy', status=200)
+    task_id = body['task_id']
     items = body.get('history_items', [])
     try:
         try:
@@ -54,9 +69,10 @@ def clickup_endpoint(request):
                 synced_event.delete(with_event=True)
                 return HttpResponse('Event deleted', status=204)
             else:
-                synced_event.update_event_from_task_history(items)
-                synced_event.save()
-                return HttpResponse('Updated event', status=201)
+                if synced_event.update_event_from_task_history(items):
+                    synced_event.save()
+                    return HttpResponse('Updated event', status=201)
+                return HttpResponse('Nothing changed', status=200)
         except SyncedEvent.DoesNotExist:
             # Was sync tag added?
             if event == 'taskUpdated':
@@ -70,3 +86,18 @@ def clickup_endpoint(request):
         logger.error(body)
         raise e
     return HttpResponse('Nothing happened', status=200)
+
+
+def api_metrics(request):
+    authorization = request.headers.get('Authorization', '')
+    if not (request.user.is_authenticated and request.user.is_superuser) \
+        and not (METRICS_TOKEN and hmac.compare_digest(
+            authorization, f'Bearer {METRICS_TOKEN}'
+            )):
+        return HttpResponseForbidden()
+    return JsonResponse({
+        'latency_buckets': LATENCY_BUCKETS,
+        'metrics': metrics.rows(),
+        'breakers': breakers.stats(),
+        'etags': etag_cache.stats(),
+        })